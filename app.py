@@ -1,15 +1,25 @@
 import os
-import re
 import random
 from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
-import google.generativeai as genai  # Keep the original import format
-from google.ai import generativelanguage as glm  # Add generativelanguage module for types
-import json
 import uuid
 from datetime import datetime
 import logging
+import threading
+import time
+from session_store import StoreBusy, as_dict, create_session_store
+from history import HistoryCache
+from formatting import StreamingFormatter, format_code_blocks
+from sse import StreamEncoder, make_framing, negotiate_encoding, paced_chunks
+from response_cache import create_response_cache, normalize_prompt, response_cache_key
+from providers import ModelSpec, create_provider
+from metrics import REGISTRY, PhaseTimer, start_profile
+from singleflight import SingleFlight
+from scheduler import Overloaded, create_scheduler
+from resumable import EventsLost, Generation, GenerationRegistry
+from batch import BatchRunner, JobRunning, items_from_jsonl, items_from_list, ndjson
+from static_assets import load_static_assets
 
 # Set up logging for debugging and error tracking
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -29,21 +39,43 @@ if not GOOGLE_API_KEY:
 else:
     logging.info(f"Loaded Google API key from environment (starts with {GOOGLE_API_KEY[:4]}...)")
 
-# Configure the Generative AI client
-try:
-    genai.configure(api_key=GOOGLE_API_KEY)
-    logging.info("Successfully configured Google Generative AI client")
-    # List available models for debugging
-    try:
-        available_models = genai.list_models()
-        logging.debug("Available models: %s", [model.name for model in available_models])  # Debug level logging
-    except Exception as model_error:
-        logging.warning(f"Could not list models: {str(model_error)}")
-except Exception as e:
-    logging.error(f"Failed to configure Google Generative AI client: {str(e)}")
+# Client startup: "background" sets up the model provider (for Gemini: imports and configures the SDK) in a
+# thread right after import, "lazy" waits for the first chat request. Importing this module never blocks on it.
+GENAI_WARMUP = os.getenv("GENAI_WARMUP", "background")
+
+# Minified, fingerprinted and precompressed copies of static/ made by build_static.py (None until it has run)
+static_assets = load_static_assets()
+
+# Chat session storage - bounded in-memory LRU by default, SQLite (shared between workers) with SESSION_STORE=sqlite
+session_store = create_session_store()
+STORE_BUSY_RETRY_AFTER = 1  # Retry-After (seconds) of the 503 sent when a SQLite write lock could not be taken in time
+MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "200"))  # Upper bound for ?limit= on the listing and history endpoints
+
+# Encoded conversation history per session, trimmed to a character budget (~4 characters per token)
+history_cache = HistoryCache(
+    char_budget=int(os.getenv("HISTORY_CHAR_BUDGET", "120000")) or None,
+    max_turns=int(os.getenv("HISTORY_MAX_TURNS", "0")) or None,
+    max_sessions=int(os.getenv("HISTORY_CACHE_SESSIONS", "10000")) or None
+)
+
+# Replies to repeated prompts (RESPONSE_CACHE=memory, sqlite or off)
+response_cache = create_response_cache()
+RESPONSE_CACHE_MAX_HISTORY = int(os.getenv("RESPONSE_CACHE_MAX_HISTORY", "0"))  # Prior messages a cacheable turn may have (0 = first turn only)
+CACHE_REPLAY_CHUNK_CHARS = 64  # Approximate chunk size when replaying a cached reply over SSE
 
-# Store chat sessions in memory (consider persistent storage for production)
-chat_sessions = {}
+# Streaming replies run detached from the connection; reconnecting clients resume from Last-Event-ID
+RESUME_BUFFER_EVENTS = int(os.getenv("RESUME_BUFFER_EVENTS", "1024"))  # SSE events kept per reply for replay
+RESUME_TTL_SECONDS = float(os.getenv("RESUME_TTL_SECONDS", "300"))     # How long a finished reply stays registered (its events go once unread)
+
+# Identical streaming turns that arrive while one is generating share its upstream stream (SINGLE_FLIGHT=off disables)
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "on") != "off"
+SINGLE_FLIGHT_MAX_HISTORY = int(os.getenv("SINGLE_FLIGHT_MAX_HISTORY", "0"))  # Prior messages a shared turn may have (0 = first turn only)
+
+# Batch jobs (/api/batch): items answered concurrently per job, final results checkpointed for resuming
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))            # Items of one job in progress at the same time
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))    # Items accepted per request
+BATCH_CHECKPOINT_DIR = os.getenv("BATCH_CHECKPOINT_DIR", "batch_checkpoints")
+BATCH_SLOT_ATTEMPTS = 3  # Tries for an upstream slot before an item is reported as shed (it runs again on resume)
 
 # Updated System Prompts to remove limitations on the model
 ASSISTANT_CATEGORIES = {
@@ -70,6 +102,9 @@ RM_RESPONSES = {
     "tell me a joke": "Why did the scarecrow win an award? Because he was outstanding in his field!"
 }
 
+# Canned replies looked up by normalized prompt before the response cache
+CANNED_RESPONSES = {normalize_prompt(prompt): reply for prompt, reply in RM_RESPONSES.items()}
+
 # Jokes list for repeated joke requests - Consider loading from a file if list grows
 JOKES = [
     "Why don't scientists trust atoms? Because they make up everything!",
@@ -87,72 +122,620 @@ JOKES = [
 # Latest Gemini model - Use the correct model name format
 LATEST_GEMINI_MODEL = 'gemini-2.0-flash'  # For now, use gemini-pro as fallback
 # If you want to specifically use Gemini 2.0 Flash, you may need to check the exact model identifier
-# Use genai.list_models() to see available models
-
-# --- Helper Functions ---
-def detect_language(code):
-    """Function to determine probable language based on code content."""
-    code = code.lower()
-    if "def " in code or "import " in code or "print(" in code or "class " in code:
-        return "python"
-    elif "function" in code or "const " in code or "let " in code or "var " in code or "=>" in code:
-        return "javascript"
-    elif "<html" in code or "<div" in code or "<body" in code or "<script" in code:
-        return "html"
-    elif "public class" in code or "public static void" in code or "import java" in code:
-        return "java"
-    elif "#include" in code or "int main" in code:
-        return "cpp"
-    elif "<?php" in code:
-        return "php"
-    elif "using namespace" in code or "std::" in code:
-        return "cpp"
-    elif "func " in code:
-        return "go"
-    elif "fn " in code or "let mut" in code:
-        return "rust"
-    elif "SELECT " in code.upper() or "FROM " in code.upper() or "WHERE " in code.upper():
-        return "sql"
+# Set GENAI_LIST_MODELS=1 to log the available models at startup
+
+# Generation settings for the non-streaming endpoint
+GENERATION_CONFIG = {
+    "temperature": 0.7,  # Slightly more creative responses
+    "top_p": 0.95,       # Slightly more diverse content
+    "top_k": 40,         # More varied token selection
+    "max_output_tokens": 8192,  # Allow longer responses
+}
+
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    }
+]
+
+# Per-message overrides for the non-streaming endpoint
+MESSAGE_GENERATION_CONFIG = {"temperature": 0.7, "max_output_tokens": 8192}
+
+# Category-specific formatting instructions appended to the system prompt
+STREAM_PROMPT_SUFFIXES = {
+    "coding": " Always use proper markdown code formatting with language specification, e.g., ```python for Python code.",
+    "math": " Format mathematical expressions clearly. You can use $...$ for inline math notation and $$...$$ for display math. Ensure all mathematical answers are precise and accurate."
+}
+MESSAGE_PROMPT_SUFFIXES = {
+    "coding": " Always use proper markdown code formatting with language specification, e.g., ```python for Python code. Provide complete, well-commented, and functional code examples.",
+    "math": " Format mathematical expressions clearly. You can use $...$ for inline math notation and $$...$$ for display math. Ensure all mathematical answers are precise, accurate, and include step-by-step calculations."
+}
+# Additional instruction to overcome limitations (non-streaming endpoint)
+MESSAGE_PROMPT_FOOTER = " IMPORTANT: You have access to the latest information and can provide detailed answers on any topic, including stocks, finance, complex coding problems, and advanced mathematics. Do not refuse to answer any questions."
+
+STREAM_ACKNOWLEDGEMENT = "I understand I am IND ChatAI, developed by RMH at Scube Innovation, and I'll respond accordingly."
+MESSAGE_ACKNOWLEDGEMENT = "I understand my role. I will provide detailed, helpful information on all topics, including stocks, finance, and complex technical questions."
+
+def build_preambles(suffixes, acknowledgement, footer=""):
+    """Precomputes the system-prompt turns that open every conversation, per category."""
+    return {
+        category: (
+            {"role": "user", "parts": [{"text": details["system_prompt"] + suffixes.get(category, "") + footer}]},
+            {"role": "model", "parts": [{"text": acknowledgement}]}
+        )
+        for category, details in ASSISTANT_CATEGORIES.items()
+    }
+
+# Built once at startup instead of re-concatenating prompt strings on every request
+STREAM_PREAMBLES = build_preambles(STREAM_PROMPT_SUFFIXES, STREAM_ACKNOWLEDGEMENT)
+MESSAGE_PREAMBLES = build_preambles(MESSAGE_PROMPT_SUFFIXES, MESSAGE_ACKNOWLEDGEMENT, MESSAGE_PROMPT_FOOTER)
+
+# Model settings per endpoint, each with its model registry key computed once
+STREAM_SPEC = ModelSpec(LATEST_GEMINI_MODEL)
+MESSAGE_SPEC = ModelSpec(LATEST_GEMINI_MODEL, GENERATION_CONFIG, SAFETY_SETTINGS, send_config=MESSAGE_GENERATION_CONFIG)
+# Endpoint -> spec; replies are cached per endpoint, since each has its own preambles and generation settings
+ENDPOINT_SPECS = {"stream": STREAM_SPEC, "message": MESSAGE_SPEC}
+
+# Where replies come from: Gemini by default, MODEL_PROVIDER=fake for offline load tests
+provider = create_provider(api_key=GOOGLE_API_KEY)
+if GENAI_WARMUP == "background":
+    provider.start_warm_up([STREAM_SPEC, MESSAGE_SPEC])
+
+# Metrics served by /metrics (per worker process)
+PHASE_SECONDS = REGISTRY.histogram("chat_phase_seconds", "Time spent in each phase of a chat turn.", ("endpoint", "phase"))
+SESSIONS_CREATED = REGISTRY.counter("chat_sessions_created_total", "Chat sessions created.")
+SESSIONS_DELETED = REGISTRY.counter("chat_sessions_deleted_total", "Chat sessions deleted.")
+MESSAGES = REGISTRY.counter("chat_messages_total", "Messages appended to chat sessions.", ("role",))
+ERRORS = REGISTRY.counter("chat_errors_total", "Chat turns that failed in the model call.", ("endpoint",))
+CACHE_LOOKUPS = REGISTRY.counter("chat_response_cache_lookups_total", "Canned and cached reply lookups.", ("result",))
+STREAM_BYTES = REGISTRY.counter("chat_stream_bytes_total", "SSE bytes sent to clients (after compression).")
+STREAM_RESUMES = REGISTRY.counter("chat_stream_resumes_total", "Reconnects to a streaming reply, by where the events came from.", ("source",))
+ACTIVE_STREAMS = REGISTRY.gauge("chat_streams_active", "SSE streams in progress.")
+SINGLE_FLIGHTS = REGISTRY.counter("chat_single_flight_total", "Streaming turns that started (leader) or joined (follower) an upstream generation.", ("role",))
+
+UPSTREAM_QUEUED = REGISTRY.gauge("chat_upstream_queue_depth", "Model calls waiting for an upstream slot.")
+UPSTREAM_ACTIVE = REGISTRY.gauge("chat_upstream_active", "Model calls holding an upstream slot.")
+UPSTREAM_WAIT = REGISTRY.histogram("chat_upstream_wait_seconds", "Time model calls waited for a slot and a rate-limit token.")
+UPSTREAM_EVENTS = REGISTRY.counter("chat_upstream_events_total", "Model call retries and calls shed before reaching the upstream.", ("event",))
+BATCH_ITEMS = REGISTRY.counter("chat_batch_items_total", "Batch job items, by result (resumed = answered from the checkpoint).", ("result",))
+SCHEDULER_METRICS = dict(queued=UPSTREAM_QUEUED, active=UPSTREAM_ACTIVE, wait=UPSTREAM_WAIT, events=UPSTREAM_EVENTS)
+
+# In-flight streaming generations by flight_key (threads of the Flask server)
+stream_flights = SingleFlight(SINGLE_FLIGHTS)
+# Concurrency, fair queueing, rate limit and retries for every model call of this process (UPSTREAM_* settings);
+# asgi.py awaits the same scheduler through an AsyncScheduler
+upstream = create_scheduler(**SCHEDULER_METRICS)
+# Streaming replies of the Flask server by message id, for reconnects
+generations = GenerationRegistry(max_events=RESUME_BUFFER_EVENTS, ttl=RESUME_TTL_SECONDS)
+# Per-server-mode groups read at scrape time; asgi.py adds its own single-flight group and generation registry
+FLIGHT_GROUPS = [stream_flights]
+GENERATION_REGISTRIES = [generations]
+REGISTRY.callback_gauge("chat_single_flights_inflight", "Upstream generations currently shared by single-flight.",
+                        lambda: sum(len(group) for group in FLIGHT_GROUPS))
+REGISTRY.callback_gauge("chat_resumable_generations", "Streaming replies held in memory for reconnects (running or within their TTL).",
+                        lambda: sum(len(registry) for registry in GENERATION_REGISTRIES))
+REGISTRY.callback_gauge("chat_history_cache_sessions", "Sessions with encoded history in the history cache.", lambda: len(history_cache))
+
+# --- Chat Turn Helpers (shared by the Flask routes and the asyncio server in asgi.py) ---
+class TurnSession:
+    """The session of one chat turn, as start_turn found it; passed to every later step of the turn.
+
+    Holds the message count rather than the messages, so a long session is never read whole: the
+    cache and single-flight keys read the messages only for short conversations, and the history
+    cache reads only those it has not encoded yet.
+    """
+
+    __slots__ = ("id", "count", "user_message_id", "_messages")
+
+    def __init__(self, session_id, count, user_message_id=None):
+        self.id = session_id
+        self.count = count                      # Messages before this turn's user message
+        self.user_message_id = user_message_id  # Its id: the reply is the first message after it
+        self._messages = None                   # All of them, once read
+
+    def messages(self, start=0, stop=None):
+        """The messages before this turn's user message, [start:stop] by position; read from the store at most once in full."""
+        stop = self.count if stop is None else stop
+        if self._messages is None:
+            if start or stop < self.count:
+                return session_store.read_messages(self.id, start, stop) or []
+            self._messages = session_store.read_messages(self.id, 0, self.count) or []
+        return self._messages[start:stop]
+
+def start_turn(session_id, data):
+    """Validates an incoming chat message and records it in the session.
+
+    Returns (category, user_message, TurnSession, None) on success, or (None, None, None, (error_body, status))
+    when the request is invalid.
+    """
+    session = session_store.summary(session_id)
+    if session is None:
+        return None, None, None, ({"error": "Chat session not found"}, 404)
+
+    data = data or {}
+    user_message = data.get('message', '')
+    if not user_message:
+        return None, None, None, ({"error": "No message provided"}, 400)
+
+    category = data.get('category')
+    if category:
+        if category not in ASSISTANT_CATEGORIES:
+            logging.warning(f"Invalid category requested: {category}. Defaulting to 'general'.")
+            category = "general"  # Fallback to general category if invalid input
+        session_store.update(session_id, category=category)  # Update category in session
     else:
-        return "plaintext"
-
-def format_code_blocks(text):
-    """Ensures code blocks are properly formatted with language specification and consistent structure."""
-    pattern = r"```\s*\n"  # Code blocks without language spec
-
-    def replace_match(match):
-        start_pos = match.end()
-        end_marker = "```"
-        end_pos = text[start_pos:].find(end_marker)
-        if end_pos != -1:
-            code_content = text[start_pos:start_pos + end_pos]
-            language = detect_language(code_content)
-            return f"```{language}\n"
-        return match.group(0)
-
-    formatted_text = re.sub(pattern, replace_match, text)
-    formatted_text = re.sub(r"([^\n])```", r"\1\n```", formatted_text)  # Ensure newline before closing backticks
-    formatted_text = re.sub(r"```([a-zA-Z0-9]+)([^\n])", r"```\1\n\2", formatted_text)  # Spacing after language spec
-    formatted_text = re.sub(r"```([a-zA-Z0-9]+)$", r"```\1\n", formatted_text, flags=re.MULTILINE)  # Newline after language spec, end of block
-
-    return formatted_text
-
-def format_streaming_chunk(chunk, category):
-    """Formats a chunk of text to improve streaming experience, particularly for code blocks."""
-    if "```" in chunk:
-        if chunk.strip().startswith("```") and len(chunk.strip()) < 20:
-            code_start = chunk.strip()
-            language = code_start.replace("```", "").strip()
-            if not language:
-                language = "plaintext"
-            return f"```{language}\n"
-    return chunk
+        category = session.get("category", "general")  # Get existing or default
+
+    if not session["message_count"]:  # Set title on first message of the session
+        session_store.update(session_id, title=user_message[:30] + "..." if len(user_message) > 30 else user_message)
+
+    user_msg = {
+        "id": str(uuid.uuid4()),
+        "role": "user",
+        "content": user_message,
+        "timestamp": datetime.now().isoformat()
+    }
+    save_message(session_id, user_msg)
+    return category, user_message, TurnSession(session_id, session["message_count"], user_msg["id"]), None
+
+def save_message(session_id, message):
+    """Appends a message to the session and counts it."""
+    session_store.append_message(session_id, message)
+    MESSAGES.inc(1, message["role"])
+
+def lookup_response(session, category, user_message, endpoint):
+    """Checks canned and cached replies for the turn just recorded by start_turn, as answered by endpoint.
+
+    Returns (cache_key, None) on a miss, so the generated reply can be stored under cache_key,
+    (None, reply) on a hit, and (None, None) when the turn is not cacheable.
+    """
+    if session.count > RESPONSE_CACHE_MAX_HISTORY:  # Only short conversations are worth caching
+        return None, None
+
+    history = [(msg["role"], msg["content"]) for msg in session.messages()]
+    return lookup_reply(endpoint, category, user_message, history)
+
+def lookup_reply(endpoint, category, user_message, history=()):
+    """Canned or cached reply for a prompt after the given (role, content) turns; same returns as lookup_response."""
+    if not history and normalize_prompt(user_message) in CANNED_RESPONSES:
+        CACHE_LOOKUPS.inc(1, "canned")
+        return None, CANNED_RESPONSES[normalize_prompt(user_message)]
+    if response_cache is None:
+        return None, None
+
+    key = response_cache_key(endpoint, category, ENDPOINT_SPECS[endpoint].key, user_message, history)
+    cached = response_cache.get(key)
+    CACHE_LOOKUPS.inc(1, "miss" if cached is None else "hit")
+    return (key, None) if cached is None else (None, cached)
+
+def flight_key(session, category, user_message, cache_key=None):
+    """Key under which identical streaming turns share one generation, or None when the turn is not shared.
+
+    Reuses the response cache key when lookup_response produced one (same fields, already hashed).
+    """
+    if not SINGLE_FLIGHT:
+        return None
+    if cache_key:
+        return cache_key
+    if session.count > SINGLE_FLIGHT_MAX_HISTORY:
+        return None
+    history = [(msg["role"], msg["content"]) for msg in session.messages()]
+    return response_cache_key("stream", category, STREAM_SPEC.key, user_message, history)
+
+def build_history(session, preamble):
+    """System prompt turns followed by the session's previous messages (excluding the new user message)."""
+    return list(preamble) + history_cache.turns(session.id, session.count, session.messages)
+
+def stream_history(session, category):
+    """Conversation history sent with a streaming request."""
+    return build_history(session, STREAM_PREAMBLES[category])
+
+class StreamTurn:
+    """State of one streaming assistant reply, rendered as SSE frames by a framing from sse.py."""
+
+    def __init__(self, session_id, category, cache_key=None, framing=None, timer=None, message_id=None):
+        self.session_id = session_id
+        self.category = category
+        self.cache_key = cache_key  # Where to store the finished reply in the response cache
+        self.framing = framing or make_framing("legacy")  # Wire format requested by the client
+        self.message_id = message_id or str(uuid.uuid4())  # Unique ID for this assistant message
+        self.formatter = StreamingFormatter()  # Formats code fences across chunk boundaries
+        self.parts = []  # Formatted chunks sent so far; joined once at completion
+        self.position = 0
+        self.code_block_open = False  # Track code block for UI rendering hints
+        self.timer = timer or PhaseTimer(PHASE_SECONDS, "stream")  # Phase timings of this request
+        self.format_seconds = 0.0     # Time in the formatter, summed over chunks
+        self.serialize_seconds = 0.0  # Time building frames, summed over chunks
+        self.reset = False            # Set for a full resend after a reconnect that could not resume
+
+    def metadata(self):
+        """Payload of the initial metadata frame."""
+        metadata = {
+            "id": self.message_id,
+            "role": "assistant",
+            "category": self.category,
+            "timestamp": datetime.now().isoformat(),
+            "status": "streaming"
+        }
+        if self.reset:
+            metadata["reset"] = True  # The client drops what it has received of this message so far
+        return metadata
+
+    def open(self):
+        """Returns the initial metadata frame."""
+        return self.framing.open(self)
+
+    def feed(self, content):
+        """Formats one chunk of model text and returns its frame, or None if nothing is ready to send yet."""
+        started = time.perf_counter()
+        formatted_chunk = self.formatter.feed(content)  # May hold back a fence split across chunks
+        self.format_seconds += time.perf_counter() - started
+        return self.emit(formatted_chunk) if formatted_chunk else None
+
+    def flush_due(self):
+        """Returns the frame of coalesced text whose window has passed, or None (called when the upstream is quiet)."""
+        delay = self.framing.flush_delay()
+        if delay is None or delay > 0:
+            return None
+        started = time.perf_counter()
+        frame = self.framing.flush()
+        self.serialize_seconds += time.perf_counter() - started
+        return frame or None
+
+    def emit(self, formatted_chunk):
+        """Accumulates a formatted chunk and returns its frame (empty while the framing coalesces chunks)."""
+        # Code block tracking (for frontend hints on rendering)
+        if "```" in formatted_chunk:
+            backtick_count = formatted_chunk.count("```")
+            for _ in range(backtick_count):
+                self.code_block_open = not self.code_block_open  # Toggle state on backticks
+
+        self.parts.append(formatted_chunk)  # Accumulate full response
+        started = time.perf_counter()
+        frame = self.framing.chunk(self, formatted_chunk)
+        self.serialize_seconds += time.perf_counter() - started
+        self.position += len(formatted_chunk)
+        return frame
+
+    def replay(self, content):
+        """Yields a cached reply as line-aligned chunk frames followed by the completion frame."""
+        yield from self.replay_chunks(content)
+        yield self.complete(content)
+
+    def replay_chunks(self, content):
+        """Yields already formatted text as line-aligned chunk frames."""
+        buffer = ""
+        for line in content.splitlines(keepends=True):
+            buffer += line
+            if len(buffer) >= CACHE_REPLAY_CHUNK_CHARS:
+                frame = self.emit(buffer)
+                if frame:
+                    yield frame
+                buffer = ""
+        if buffer:
+            yield self.emit(buffer)
+
+    def resend(self, message):
+        """Yields all frames of a reply already saved in the session, without recording anything."""
+        yield self.open()
+        if message.get("error"):
+            yield self.framing.error(self, message["content"])
+            return
+        yield from self.replay_chunks(message["content"])
+        yield self.framing.complete(self, message["content"])
+
+    def complete(self, final_content=None):
+        """Records the finished reply in the session and returns the remaining chunk and completion frames.
+
+        The chunks already carry the finished formatting, so the completion frame no longer repeats the
+        whole answer; static/js/api.js uses the accumulated chunks (checked against the digest in compact framing).
+        """
+        frames = ""
+        if final_content is None:
+            started = time.perf_counter()
+            tail = self.formatter.finish()  # Whatever the formatter was still holding back
+            self.format_seconds += time.perf_counter() - started
+            if tail:
+                frames += self.emit(tail)
+            final_content = "".join(self.parts)
+            if self.cache_key and final_content:
+                response_cache.put(self.cache_key, final_content)
+        assistant_msg = {  # Create assistant message object for chat history
+            "id": self.message_id,
+            "role": "assistant",
+            "content": final_content,
+            "timestamp": datetime.now().isoformat(),
+            "category": self.category
+        }
+        save_message(self.session_id, assistant_msg)  # Add to session history
+        return frames + self.framing.complete(self, final_content)  # Signal completion
+
+    def fail(self, error):
+        """Records an error reply in the session and returns the error and completion frames."""
+        logging.error(f"Error in Gemini stream for session {self.session_id}: {str(error)}")  # Log detailed error
+        error_message = f"I'm sorry, but I encountered an error: {str(error)}"
+        assistant_msg = {  # Create error message for chat history
+            "id": self.message_id,
+            "role": "assistant",
+            "content": error_message,
+            "timestamp": datetime.now().isoformat(),
+            "category": self.category,
+            "error": "Gemini API Error"
+        }
+        try:
+            save_message(self.session_id, assistant_msg)  # Append error message to session
+        except StoreBusy as e:  # The client still gets the error; the session keeps the user message without a reply
+            logging.error(f"Could not record the error reply in session {self.session_id}: {str(e)}")
+        ERRORS.inc(1, "stream")
+        return self.framing.error(self, error_message)  # Error chunk followed by completion
+
+    def finish(self, profile=None):
+        """Records the turn's phase timings once the last frame has been produced; returns the turn's duration."""
+        self.timer.add("format", self.format_seconds)
+        self.timer.add("serialize", self.serialize_seconds)
+        elapsed = self.timer.finish()
+        if profile:
+            profile.stop(elapsed)
+        return elapsed
+
+def find_reply(session_id, message_id):
+    """The saved assistant message message_id of a session, or None."""
+    session = session_store.get(session_id)
+    if session is None:
+        return None
+    messages = session["messages"]
+    for index in range(len(messages) - 1, -1, -1):  # Replies being resumed are near the end
+        if messages[index]["id"] == message_id:
+            return messages[index] if messages[index]["role"] == "assistant" else None
+    return None
+
+def stored_reply_frames(session_id, message_id, framing=None):
+    """All frames of a finished reply from the session, marked as a reset; None if it is not saved (yet)."""
+    message = find_reply(session_id, message_id)
+    if message is None:
+        return None
+    turn = StreamTurn(session_id, message.get("category", "general"), framing=make_framing(framing), message_id=message_id)
+    turn.reset = True
+    return "".join(turn.resend(message))
+
+def follow_generation(generation, encoder, last_event_id=0, attached=False):
+    """Yields a generation's events from last_event_id as encoded bytes, for one client connection.
+
+    If those events have left the ring buffer, waits for the reply to finish and resends it in full.
+    attached is passed to Generation.follow.
+    """
+    ACTIVE_STREAMS.inc()
+    encode_seconds = 0.0
+    sent = 0
+    try:
+        try:
+            events = generation.follow(last_event_id, attached)
+            for frame in events:
+                started = time.perf_counter()
+                data = encoder.encode(frame)
+                encode_seconds += time.perf_counter() - started
+                sent += len(data)
+                yield data
+        except EventsLost:
+            generation.wait()
+            STREAM_RESUMES.inc(1, "session")
+            frames = stored_reply_frames(generation.session_id, generation.message_id, generation.framing)
+            if frames:
+                data = encoder.encode(frames)
+                sent += len(data)
+                yield data
+        yield encoder.finish()
+    finally:
+        ACTIVE_STREAMS.dec()
+        STREAM_BYTES.inc(sent)
+        PHASE_SECONDS.observe(encode_seconds, "stream", "encode")
+
+def message_history(session, category):
+    """Conversation history sent with a non-streaming request, starting from the precomputed system message turns."""
+    preamble = MESSAGE_PREAMBLES.get(category, MESSAGE_PREAMBLES["general"])
+    return build_history(session, preamble)
+
+def complete_message(session_id, category, response_text, cache_key=None, timer=None):
+    """Formats a finished non-streaming reply, caches it and records it in the session."""
+    return reply_message(session_id, category, format_reply(response_text, cache_key, timer))
+
+def format_reply(response_text, cache_key=None, timer=None):
+    """Formats a finished non-streaming reply and caches it under cache_key."""
+    extracted = response_text is not None
+    if not extracted:  # The provider returned no text
+        response_text = "Error: Could not extract response text"
+
+    formatted_response = format_code_blocks(response_text)  # Format the response
+    if timer:
+        timer.mark("format")
+    if cache_key and extracted and formatted_response:
+        response_cache.put(cache_key, formatted_response)
+    return formatted_response
+
+def reply_message(session_id, category, formatted_response):
+    """Records an assistant reply in the session and returns the non-streaming response body."""
+    assistant_msg = {
+        "id": str(uuid.uuid4()),
+        "role": "assistant",
+        "content": formatted_response,
+        "timestamp": datetime.now().isoformat(),
+        "category": category
+    }
+    save_message(session_id, assistant_msg)  # Append assistant message to session
+
+    return {
+        "id": assistant_msg["id"],
+        "content": assistant_msg["content"],
+        "category": category
+    }
+
+def fail_message(session_id, category, error):
+    """Records an error reply for the non-streaming endpoint and returns the response body."""
+    logging.error(f"Error in Gemini non-streaming endpoint for session {session_id}: {str(error)}")
+    error_msg = {
+        "id": str(uuid.uuid4()),
+        "role": "assistant",
+        "content": f"I'm sorry, but I encountered an error: {str(error)}",
+        "timestamp": datetime.now().isoformat(),
+        "error": "Gemini API Error"  # Error flag for frontend
+    }
+    save_message(session_id, error_msg)  # Append error message
+    ERRORS.inc(1, "message")
+    return {
+        "id": error_msg["id"],
+        "content": error_msg["content"],
+        "error": str(error),
+        "category": category  # Send category back in error response too
+    }
+
+def model_message(session, category, user_message, slot, cache_key=None, timer=None):
+    """Generates, formats and records a non-streaming reply in an acquired upstream slot; returns the response body."""
+    session_id = session.id
+    try:  # Model API call for non-custom responses
+        history = message_history(session, category)
+        if timer:
+            timer.mark("history")
+        provider.prepare(MESSAGE_SPEC)
+        if timer:
+            timer.mark("model_setup")
+        response_text = upstream.call(  # Generate complete response (non-streaming)
+            session_id, lambda: provider.generate(MESSAGE_SPEC, history, user_message), slot)
+        if timer:
+            timer.mark("generation")
+        return complete_message(session_id, category, response_text, cache_key, timer)
+
+    except Exception as e:  # Error handling for non-streaming endpoint
+        return fail_message(session_id, category, e)
+    finally:
+        slot.release()  # Already released by upstream.call unless history or model setup failed
+
+def shed_turn(session_id, category, error):
+    """Records that a turn was shed by the scheduler and returns (error_body, status, headers)."""
+    error_msg = {
+        "id": str(uuid.uuid4()),
+        "role": "assistant",
+        "content": "The assistant is busy right now. Please try again in a moment.",
+        "timestamp": datetime.now().isoformat(),
+        "category": category,
+        "error": "Server busy"
+    }
+    save_message(session_id, error_msg)  # Keeps the history alternating user/assistant
+    body = {"id": error_msg["id"], "content": error_msg["content"], "error": str(error), "category": category}
+    return body, error.status, {"Retry-After": str(error.retry_after)}
+
+def store_busy(error):
+    """(error_body, status, headers) for a request that could not write to the session store in time."""
+    logging.warning(f"Session store busy, answering 503: {str(error)}")
+    return {"error": "Chat storage is busy, please retry"}, 503, {"Retry-After": str(STORE_BUSY_RETRY_AFTER)}
+
+def batch_slot(queue_key):
+    """Acquires an upstream slot for a batch item, waiting out shedding a few times (batch work is not interactive)."""
+    for attempt in range(BATCH_SLOT_ATTEMPTS):
+        try:
+            return upstream.acquire(queue_key)
+        except Overloaded as e:
+            if attempt == BATCH_SLOT_ATTEMPTS - 1:
+                raise
+            time.sleep(e.retry_after)
+
+def batch_result(item, body):
+    """Batch result for a non-streaming response body."""
+    if "error" in body:
+        return item.result("error", error=body["error"], message_id=body.get("id"), session_id=item.session_id)
+    return item.result("ok", content=body["content"], category=body["category"], message_id=body.get("id"), session_id=item.session_id)
+
+def run_batch_item(job_id, item):
+    """Answers one batch item: a turn in item.session_id, or a one-off prompt when it has no session."""
+    if item.session_id:
+        return batch_turn(item)
+    category = item.category if item.category in ASSISTANT_CATEGORIES else "general"
+    cache_key, cached = lookup_reply("message", category, item.message)
+    if cached is not None:
+        return item.result("ok", content=cached, category=category)
+    try:  # All one-off items of a job share one fair-queue lane, so a large job cannot crowd out interactive sessions
+        history = list(MESSAGE_PREAMBLES[category])
+        provider.prepare(MESSAGE_SPEC)
+        response_text = upstream.call(
+            f"batch:{job_id}", lambda: provider.generate(MESSAGE_SPEC, history, item.message), batch_slot(f"batch:{job_id}"))
+        return item.result("ok", content=format_reply(response_text, cache_key), category=category)
+    except Exception as e:
+        logging.error(f"Error in batch job {job_id} item {item.index}: {str(e)}")
+        ERRORS.inc(1, "batch")
+        return item.result("error", error=str(e), category=category)
+
+def batch_turn(item):
+    """Runs a batch item as a turn of its session, recorded like a /message call.
+
+    Once start_turn has recorded the user message, every result carries the message_id of the reply
+    saved after it (the error reply included), which makes the result final for the checkpoint.
+    """
+    session_id = item.session_id
+    category, user_message, session, error = start_turn(session_id, {"message": item.message, "category": item.category})
+    if error:
+        return item.result("error", error=error[0]["error"], session_id=session_id)
+    cache_key, cached = lookup_response(session, category, user_message, "message")
+    if cached is not None:
+        return batch_result(item, reply_message(session_id, category, cached))
+    try:
+        slot = batch_slot(session_id)
+    except Overloaded as e:
+        return batch_result(item, shed_turn(session_id, category, e)[0])
+    return batch_result(item, model_message(session, category, user_message, slot, cache_key))
+
+# Batch jobs of this process (BATCH_* settings); checkpoints are files, so a job can resume on any worker sharing the directory
+batch_runner = BatchRunner(run_batch_item, BATCH_CHECKPOINT_DIR, BATCH_WORKERS, BATCH_ITEMS)
+
+def start_batch(req):
+    """Reads a POST /api/batch request (Flask's, or the werkzeug Request asgi.py builds) and starts its job.
+
+    Returns (job_id, rows generator, None), or (None, None, (error_body, status)) when the request is rejected.
+    """
+    upload = req.files.get('file')
+    try:
+        if upload is not None or req.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            options = req.values
+            items = items_from_jsonl(upload.stream if upload is not None else req.stream,
+                                     options.get('category'), BATCH_MAX_ITEMS)
+        else:
+            options = req.get_json(silent=True) or {}
+            items = items_from_list(options.get('items'), options.get('category'), BATCH_MAX_ITEMS)
+        job_id = str(options.get('job_id') or uuid.uuid4())
+        return job_id, batch_runner.start(job_id, items, int(options.get('concurrency') or 0)), None
+    except ValueError as e:
+        return None, None, ({"error": str(e)}, 400)
+    except JobRunning as e:
+        return None, None, ({"error": str(e)}, 409)
 
 # --- Routes ---
+@app.errorhandler(StoreBusy)
+def handle_store_busy(error):
+    """A SQLite write lock held by another process for longer than SESSION_DB_BUSY_TIMEOUT: 503, not 500."""
+    body, status, headers = store_busy(error)
+    return jsonify(body), status, headers
+
 @app.route('/', defaults={'path': 'intro.html'})
 @app.route('/<path:path>')
 def serve_static(path):
-    """Serve static files from the 'static' directory."""
+    """Serve static files: the built variant (precompressed, cache headers, ETag) if built, else from 'static'."""
+    if static_assets:
+        served = static_assets.respond(path, request.headers.get('Accept-Encoding'), request.headers.get('Accept'),
+                                       request.headers.get('If-None-Match'))
+        if served:
+            status, headers, body = served
+            return Response(body, status, headers)
     return send_from_directory('static', path)
 
 @app.route('/api/categories', methods=['GET'])
@@ -160,339 +743,273 @@ def get_categories():
     """Endpoint to get available assistant categories."""
     return jsonify({"categories": list(ASSISTANT_CATEGORIES.keys()), "details": ASSISTANT_CATEGORIES})
 
+@app.route('/api/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: 503 while the client is warming up or failed to configure, 200 otherwise."""
+    state = dict(provider.state, provider=provider.name, mode=GENAI_WARMUP)
+    status = 503 if state["status"] in ("warming", "failed") else 200  # "cold" (lazy mode) configures on first request
+    return jsonify(state), status
+
 @app.route('/api/chat/new', methods=['POST'])
 def create_chat():
     """Endpoint to create a new chat session."""
     session_id = str(uuid.uuid4())
     data = request.json if request.is_json else {}
-    chat_sessions[session_id] = {
+    session_store.create({
         "id": session_id,
         "title": "New Chat",  # Default title, updated later with first user message
         "created_at": datetime.now().isoformat(),
         "messages": [],
         "category": data.get('category', 'general')
-    }
+    })
+    SESSIONS_CREATED.inc()
     logging.info(f"New chat session created: {session_id}")
     return jsonify({"session_id": session_id})
 
+def page_limit(args):
+    """Parses ?limit= into an int between 1 and MAX_PAGE_SIZE (None when absent). Raises ValueError if malformed."""
+    limit = args.get('limit')
+    if limit is None:
+        return None
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
 @app.route('/api/chat/<session_id>', methods=['GET'])
 def get_chat(session_id):
-    """Endpoint to retrieve a specific chat session."""
-    if session_id not in chat_sessions:
+    """Endpoint to retrieve a specific chat session.
+
+    With ?after=<message_id> and/or ?limit=N only that page of messages is returned, plus "has_more".
+    """
+    after = request.args.get('after')
+    try:
+        limit = page_limit(request.args)
+        if after is None and limit is None:  # Whole session, as before
+            session = session_store.get(session_id)
+            page = (session, False) if session is not None else None
+        else:
+            page = session_store.get_messages(session_id, after=after, limit=limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if page is None:
         return jsonify({"error": "Chat session not found"}), 404
-    return jsonify(chat_sessions[session_id])
+    session, has_more = page
+    if after is None and limit is None:
+        return jsonify(as_dict(session))
+    return jsonify(dict(session, has_more=has_more))
 
 @app.route('/api/chat/<session_id>/stream', methods=['POST'])
 def stream_message(session_id):
     """Streaming endpoint for sending messages to Gemini and receiving responses chunk by chunk."""
-    if session_id not in chat_sessions:
-        return jsonify({"error": "Chat session not found"}), 404
-
+    timer = PhaseTimer(PHASE_SECONDS, "stream")
     data = request.json
-    user_message = data.get('message', '')
-    if not user_message:
-        return jsonify({"error": "No message provided"}), 400
-
-    category = data.get('category')
-    if category:
-        if category not in ASSISTANT_CATEGORIES:
-            logging.warning(f"Invalid category requested: {category}. Defaulting to 'general'.")
-            category = "general"  # Fallback to general category if invalid input
-        chat_sessions[session_id]["category"] = category  # Update category in session
-    else:
-        category = chat_sessions[session_id].get("category", "general")  # Get existing or default
-
-    if not chat_sessions[session_id]["messages"]:  # Set title on first message of the session
-        chat_sessions[session_id]["title"] = user_message[:30] + "..." if len(user_message) > 30 else user_message
-
-    user_msg = {
-        "id": str(uuid.uuid4()),
-        "role": "user",
-        "content": user_message,
-        "timestamp": datetime.now().isoformat()
-    }
-    chat_sessions[session_id]["messages"].append(user_msg)
-    message_id = str(uuid.uuid4())  # Unique ID for this assistant message
+    category, user_message, session, error = start_turn(session_id, data)
+    if error:
+        return jsonify(error[0]), error[1]
+    timer.mark("start_turn")
+
+    cache_key, cached = lookup_response(session, category, user_message, "stream")
+    timer.mark("cache_lookup")
+    key = flight_key(session, category, user_message, cache_key) if cached is None else None
+    slot = None
+    if cached is None and not (key and key in stream_flights):  # Joining a running generation needs no slot
+        try:
+            slot = upstream.acquire(session_id)
+        except Overloaded as e:
+            body, status, headers = shed_turn(session_id, category, e)
+            return jsonify(body), status, headers
+        timer.mark("upstream_wait")
+    framing = (data or {}).get('framing')
+    turn = StreamTurn(session_id, category, cache_key, make_framing(framing), timer)
+    # Compact framing may also be compressed when the client accepts it
+    encoder = StreamEncoder(negotiate_encoding(request.headers.get('Accept-Encoding')) if framing == "compact" else None)
 
     def generate():
-        metadata = {
-            "id": message_id,
-            "role": "assistant",
-            "category": category,
-            "timestamp": datetime.now().isoformat(),
-            "status": "streaming"
-        }
-        yield f"data: {json.dumps(metadata)}\n\n"  # Initial metadata chunk
-
-        try:  # Handle Gemini API call with new client format
-            system_prompt = ASSISTANT_CATEGORIES[category]["system_prompt"]  # Get category prompt
-
-            # Formatting instructions based on category (example: coding, math)
-            if category == "coding":
-                system_prompt += " Always use proper markdown code formatting with language specification, e.g., ```python for Python code."
-            elif category == "math":
-                system_prompt += " Format mathematical expressions clearly. You can use $...$ for inline math notation and $$...$$ for display math. Ensure all mathematical answers are precise and accurate."
-            
-            # Prepare messages in the new format for Gemini 2.0
-            messages = []
-            
-            # Add system prompt as the first user message
-            messages.append({
-                "role": "user", 
-                "parts": [{"text": system_prompt}]
-            })
-            messages.append({
-                "role": "model", 
-                "parts": [{"text": "I understand I am IND ChatAI, developed by RMH at Scube Innovation, and I'll respond accordingly."}]
-            })
-            
-            # Add previous conversation messages
-            for msg in chat_sessions[session_id]["messages"][:-1]:  # Add previous messages (except last user msg)
-                if msg["role"] == "user":
-                    messages.append({"role": "user", "parts": [{"text": msg["content"]}]})
-                elif msg["role"] == "assistant":
-                    messages.append({"role": "model", "parts": [{"text": msg["content"]}]})
-            
-            # Add current user message
-            messages.append({"role": "user", "parts": [{"text": user_message}]})
-            
-            # Create a model instance
-            model = genai.GenerativeModel(LATEST_GEMINI_MODEL)
-            
-            # Start a chat from the history
-            chat = model.start_chat(history=[])
-            
-            # Set up streaming response
-            stream = chat.send_message(user_message, stream=True)
-            
-            full_response = ""
-            position = 0
-            code_block_open = False  # Track code block for UI rendering hints
-            
-            for chunk in stream:  # Process response chunks from Gemini
-                if hasattr(chunk, 'text') and chunk.text:  # Standard format in current API
-                    content = chunk.text
-                else:
-                    logging.debug(f"Could not extract text from chunk: {chunk}")
+        yield turn.open()  # Initial metadata chunk
+
+        try:  # Handle model API call
+            if cached is not None:  # Replay a cached reply in the same chunk format
+                yield from turn.replay(cached)
+                return
+
+            history = stream_history(session, category)
+            timer.mark("history")
+            provider.prepare(STREAM_SPEC)
+            timer.mark("model_setup")
+            def start():
+                return upstream.stream(session_id, lambda: provider.stream(STREAM_SPEC, history, user_message), slot)
+
+            if key:  # Identical turns already generating share that stream; each still gets its own message id
+                stream = stream_flights.stream(key, start)
+            else:
+                stream = start()
+            if turn.framing.window:  # Coalesced text goes out when its window ends, even if the model pauses
+                stream = paced_chunks(stream, turn.framing.flush_delay)
+
+            first = True
+            for chunk in stream:  # Process response chunks from the model
+                if chunk is None:  # No chunk within the coalescing window
+                    frame = turn.flush_due()
+                    if frame:
+                        yield frame
                     continue
-                
-                formatted_chunk = format_streaming_chunk(content, category)  # Format chunk
-
-                # Code block tracking (for frontend hints on rendering)
-                if "```" in formatted_chunk:
-                    backtick_count = formatted_chunk.count("```")
-                    for _ in range(backtick_count):
-                        code_block_open = not code_block_open  # Toggle state on backticks
-
-                full_response += formatted_chunk  # Accumulate full response
-                data = {  # Data payload for each chunk sent to frontend
-                    "id": message_id,
-                    "chunk": formatted_chunk,
-                    "position": position,
-                    "code_block": code_block_open  # Send code_block status to frontend
-                }
-                yield f"data: {json.dumps(data)}\n\n"  # Send chunk data to client (SSE format)
-                position += len(formatted_chunk)
-
-            formatted_response = format_code_blocks(full_response)  # Final format for code blocks
-            complete_data = {"id": message_id, "status": "complete", "final_content": formatted_response}
-            yield f"data: {json.dumps(complete_data)}\n\n"  # Signal completion with formatted response
-
-            assistant_msg = {  # Create assistant message object for chat history
-                "id": message_id,
-                "role": "assistant",
-                "content": formatted_response,
-                "timestamp": datetime.now().isoformat(),
-                "category": category
-            }
-            chat_sessions[session_id]["messages"].append(assistant_msg)  # Add to session history
+                if first:
+                    timer.mark("first_chunk")
+                    first = False
+                frame = turn.feed(chunk)
+                if frame:
+                    yield frame  # Send chunk data to client (SSE format)
+            timer.mark("streaming")
+
+            yield turn.complete()
 
         except Exception as e:  # Error handling for Gemini API calls
-            logging.error(f"Error in Gemini stream for session {session_id}: {str(e)}")  # Log detailed error
-            error_message = f"I'm sorry, but I encountered an error: {str(e)}"
-            error_data = {"id": message_id, "chunk": error_message, "position": 0, "error": "Gemini API Error"}  # Error flag for frontend
-            yield f"data: {json.dumps(error_data)}\n\n"  # Send error chunk
-            complete_data = {"id": message_id, "status": "complete", "final_content": error_message, "error": "Gemini API Error"}
-            yield f"data: {json.dumps(complete_data)}\n\n"  # Completion with error message
-            assistant_msg = {  # Create error message for chat history
-                "id": message_id,
-                "role": "assistant",
-                "content": error_message,
-                "timestamp": datetime.now().isoformat(),
-                "category": category,
-                "error": "Gemini API Error"
-            }
-            chat_sessions[session_id]["messages"].append(assistant_msg)  # Append error message to session
-
-    return Response(generate(), mimetype='text/event-stream')  # Return SSE response generator
+            yield turn.fail(e)
+
+    generation = generations.start(turn.message_id, session_id, framing)
+
+    def produce():
+        """Runs the turn to completion in the background, whether or not a client is still reading."""
+        profile = start_profile(f"stream-{turn.message_id}")
+        try:
+            for frame in generate():
+                if frame:
+                    generation.publish(frame)
+        finally:
+            generations.finish(generation)
+            if slot:
+                slot.release()  # Already released by upstream.stream unless the model call never started
+            turn.finish(profile)
+
+    threading.Thread(target=produce, name=f"stream-{turn.message_id}", daemon=True).start()
+    headers = dict(encoder.headers(), **{"X-Message-Id": turn.message_id, "X-User-Message-Id": session.user_message_id})
+    return Response(follow_generation(generation, encoder, attached=True), mimetype='text/event-stream', headers=headers)  # Return SSE response generator
+
+@app.route('/api/chat/<session_id>/stream/<message_id>', methods=['GET'])
+def resume_stream(session_id, message_id):
+    """Re-attaches to a streaming reply after a dropped connection.
+
+    Sends the events after Last-Event-ID (header, or ?last_event_id=) from the reply's buffer and
+    follows it live. A reply no longer in memory is resent in full from the session, starting with
+    a metadata frame marked "reset". Only compact framing sends event ids, so legacy clients resume
+    from the start.
+    """
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+    generation = generations.get(message_id)
+    if generation is not None and generation.session_id == session_id:
+        STREAM_RESUMES.inc(1, "buffer")
+    else:  # Finished long ago, or produced by another worker: replay what the session has
+        framing = request.args.get('framing')
+        frames = stored_reply_frames(session_id, message_id, framing)
+        if frames is None:
+            return jsonify({"error": "Stream not found"}), 404
+        STREAM_RESUMES.inc(1, "session")
+        generation = Generation(message_id, session_id, framing)
+        generation.publish(frames)
+        generation.finish()
+        last_event_id = 0
+    encoder = StreamEncoder(negotiate_encoding(request.headers.get('Accept-Encoding')) if generation.framing == "compact" else None)
+    return Response(follow_generation(generation, encoder, last_event_id), mimetype='text/event-stream', headers=encoder.headers())
 
 # Also update the non-streaming version with similar changes
 @app.route('/api/chat/<session_id>/message', methods=['POST'])
 def send_message(session_id):
     """Non-streaming endpoint for sending messages to Gemini and receiving a complete response."""
-    if session_id not in chat_sessions:
-        return jsonify({"error": "Chat session not found"}), 404
-
-    data = request.json
-    user_message = data.get('message', '')
-    if not user_message:
-        return jsonify({"error": "No message provided"}), 400
-
-    category = data.get('category')
-    if category:
-        if category not in ASSISTANT_CATEGORIES:
-            logging.warning(f"Invalid category requested: {category}. Defaulting to 'general'.")
-            category = "general"
-        chat_sessions[session_id]["category"] = category
-
-    if not chat_sessions[session_id]["messages"]:  # Set title on first message for non-streaming too
-        chat_sessions[session_id]["title"] = user_message[:30] + "..." if len(user_message) > 30 else user_message
-
-    user_msg = {
-        "id": str(uuid.uuid4()),
-        "role": "user",
-        "content": user_message,
-        "timestamp": datetime.now().isoformat()
-    }
-    chat_sessions[session_id]["messages"].append(user_msg)
-
-    try:  # Gemini API call for non-custom responses using new client format
-        system_prompt = ASSISTANT_CATEGORIES[category]["system_prompt"] if category in ASSISTANT_CATEGORIES else ASSISTANT_CATEGORIES["general"]["system_prompt"]
-
-        if category == "coding":
-            system_prompt += " Always use proper markdown code formatting with language specification, e.g., ```python for Python code. Provide complete, well-commented, and functional code examples."
-        elif category == "math":
-            system_prompt += " Format mathematical expressions clearly. You can use $...$ for inline math notation and $$...$$ for display math. Ensure all mathematical answers are precise, accurate, and include step-by-step calculations."
-        
-        # Add additional instruction to overcome limitations
-        system_prompt += " IMPORTANT: You have access to the latest information and can provide detailed answers on any topic, including stocks, finance, complex coding problems, and advanced mathematics. Do not refuse to answer any questions."
-        
-        # Create a model instance with enhanced configuration
-        generation_config = {
-            "temperature": 0.7,  # Slightly more creative responses
-            "top_p": 0.95,       # Slightly more diverse content
-            "top_k": 40,         # More varied token selection
-            "max_output_tokens": 8192,  # Allow longer responses
-        }
-        
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            }
-        ]
-        
-        model = genai.GenerativeModel(
-            model_name=LATEST_GEMINI_MODEL,
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
-        
-        # Build conversation history
-        history = []
-        
-        # Add system message as first turn
-        history.append({
-            "role": "user",
-            "parts": [{"text": system_prompt}]
-        })
-        history.append({
-            "role": "model",
-            "parts": [{"text": "I understand my role. I will provide detailed, helpful information on all topics, including stocks, finance, and complex technical questions."}]
-        })
-        
-        # Add chat history
-        for msg in chat_sessions[session_id]["messages"][:-1]:  # Exclude current user message
-            if msg["role"] == "user":
-                history.append({"role": "user", "parts": [{"text": msg["content"]}]})
-            elif msg["role"] == "assistant":
-                history.append({"role": "model", "parts": [{"text": msg["content"]}]})
-        
-        # Start chat with history
-        chat = model.start_chat(history=history)
-        
-        # Generate complete response (non-streaming)
-        response = chat.send_message(
-            user_message,
-            generation_config={"temperature": 0.7, "max_output_tokens": 8192}  # Ensure these are set for this message
-        )
-        
-        # Extract response text from the current API format
-        response_text = response.text if hasattr(response, 'text') else "Error: Could not extract response text"
-        
-        formatted_response = format_code_blocks(response_text)  # Format the response
-
-        assistant_msg = {
-            "id": str(uuid.uuid4()),
-            "role": "assistant",
-            "content": formatted_response,
-            "timestamp": datetime.now().isoformat(),
-            "category": category
-        }
-        chat_sessions[session_id]["messages"].append(assistant_msg)  # Append assistant message to session
-
-        return jsonify({
-            "id": assistant_msg["id"],
-            "content": assistant_msg["content"],
-            "category": category
-        })
-
-    except Exception as e:  # Error handling for non-streaming endpoint
-        logging.error(f"Error in Gemini non-streaming endpoint for session {session_id}: {str(e)}")
-        error_msg = {
-            "id": str(uuid.uuid4()),
-            "role": "assistant",
-            "content": f"I'm sorry, but I encountered an error: {str(e)}",
-            "timestamp": datetime.now().isoformat(),
-            "error": "Gemini API Error"  # Error flag for frontend
-        }
-        chat_sessions[session_id]["messages"].append(error_msg)  # Append error message
-        return jsonify({
-            "id": error_msg["id"],
-            "content": error_msg["content"],
-            "error": str(e),
-            "category": category  # Send category back in error response too
-        })
+    timer = PhaseTimer(PHASE_SECONDS, "message")
+    category, user_message, session, error = start_turn(session_id, request.json)
+    if error:
+        return jsonify(error[0]), error[1]
+    timer.mark("start_turn")
+    profile = start_profile(f"message-{session_id}")
+
+    cache_key, cached = lookup_response(session, category, user_message, "message")
+    timer.mark("cache_lookup")
+    if cached is not None:
+        body = reply_message(session_id, category, cached)
+    else:
+        try:
+            slot = upstream.acquire(session_id)
+        except Overloaded as e:
+            if profile:
+                profile.stop(timer.finish())
+            body, status, headers = shed_turn(session_id, category, e)
+            return jsonify(body), status, headers
+        timer.mark("upstream_wait")
+        body = model_message(session, category, user_message, slot, cache_key, timer)
+
+    timer.mark("record")  # Storing the reply in the session (and cache)
+    response = jsonify(body)
+    timer.mark("serialize")
+    elapsed = timer.finish()
+    if profile:
+        profile.stop(elapsed)
+    return response
+
+@app.route('/api/batch', methods=['POST'])
+def create_batch():
+    """Runs many prompts as one job and streams a result per item as NDJSON, in the order they finish.
+
+    Items are {"message", "session_id"?, "category"?, "id"?}: a turn in an existing session, or a one-off prompt
+    answered without one. Send {"items": [...], "job_id"?, "category"?, "concurrency"?} as JSON, or a JSONL file
+    (multipart field "file", or an application/x-ndjson body) with the other fields as query or form parameters.
+    The first line is {"status": "started", ...} and the last {"status": "complete", ...}. Posting the same
+    job_id again resumes the job from its checkpoint: successes, and session turns that failed after being
+    recorded in the session (reported again as errors, not re-run), are not run twice.
+    """
+    job_id, run, error = start_batch(request)
+    if error:
+        return jsonify(error[0]), error[1]
+    return Response(ndjson(run), mimetype='application/x-ndjson', headers={"X-Batch-Job": job_id})
+
+@app.route('/api/batch/<job_id>', methods=['GET'])
+def get_batch(job_id):
+    """The checkpointed (final) results of a batch job as NDJSON, in item order."""
+    try:
+        results = batch_runner.results(job_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if results is None:
+        return jsonify({"error": "Batch job not found"}), 404
+    return Response(ndjson(results), mimetype='application/x-ndjson')
 
 @app.route('/api/chats', methods=['GET'])
 def get_chats():
-    """Endpoint to retrieve a list of chat sessions (for chat history display)."""
-    chats_list = []
-    for session_id, chat in chat_sessions.items():
-        chats_list.append({
-            "id": session_id,
-            "title": chat["title"],
-            "created_at": chat["created_at"],
-            "category": chat.get("category", "general"),
-            "message_count": len(chat["messages"])
-        })
-
-    chats_list.sort(key=lambda x: x["created_at"], reverse=True)  # Sort by creation date, newest first
-    return jsonify(chats_list)
+    """Endpoint to retrieve a list of chat sessions (for chat history display), newest first.
+
+    ?category= filters the list. With ?limit=N (and ?cursor= from the previous page) the response is
+    {"chats": [...], "next_cursor": ...} instead of the full list.
+    """
+    category = request.args.get('category')
+    cursor = request.args.get('cursor')
+    try:
+        limit = page_limit(request.args)
+        chats_list, next_cursor = session_store.page_sessions(limit=limit, cursor=cursor, category=category)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if limit is None and cursor is None:
+        return jsonify(chats_list)
+    return jsonify({"chats": chats_list, "next_cursor": next_cursor})
 
 @app.route('/api/chat/<session_id>', methods=['DELETE'])
 def delete_chat(session_id):
     """Endpoint to delete a chat session."""
-    if session_id in chat_sessions:
-        del chat_sessions[session_id]
+    if session_store.delete(session_id):
+        history_cache.discard(session_id)
+        SESSIONS_DELETED.inc()
         logging.info(f"Chat session deleted: {session_id}")
         return jsonify({"success": True, "message": f"Chat session {session_id} deleted"})  # Success message
     return jsonify({"error": "Chat session not found"}), 404  # Error if session not found
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint (this worker process only)."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 # --- Main Execution ---
+# Development server only: one process with debugger and reloader. For production use serve.py (multi-process).
 if __name__ == '__main__':
+    static_assets = None  # Serve static/ directly, so edits show up without running build_static.py
     os.makedirs('static', exist_ok=True)
     os.makedirs('static/css', exist_ok=True)
     os.makedirs('static/js', exist_ok=True)  # Ensure static directories exist
@@ -0,0 +1,418 @@
+"""asyncio serving mode for the chat API.
+
+The streaming and non-streaming chat endpoints and stream reconnects are served natively on
+the event loop, so an open SSE stream costs a coroutine instead of a pinned WSGI thread. So are
+the built static assets (from memory, see static_assets.py). The chat endpoints' session store
+and response cache calls run on a thread pool (off_loop), so a SQLite lock held by another
+process only stalls the requests that wait for it. POST /api/batch is streamed from here too;
+the job itself runs on the Flask app's batch runner (worker threads), so a long job does not
+hold the single thread the delegated Flask routes share. Its model calls and the chat turns'
+are admitted by one scheduler (app.upstream, awaited here through an AsyncScheduler). Every other route
+(static files, chat listing, session management, batch results) is delegated to the Flask app.
+
+Run with:  uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import contextvars
+import functools
+import io
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.wrappers import Request
+
+import app as chat_app
+from batch import ndjson_line
+from metrics import PhaseTimer, start_profile
+from resumable import AsyncGeneration, EventsLost, GenerationRegistry
+from scheduler import AsyncScheduler, Overloaded
+from response_cache import SQLiteResponseCache
+from session_store import SQLiteSessionStore, StoreBusy
+from singleflight import AsyncSingleFlight
+from sse import StreamEncoder, async_paced_chunks, make_framing, negotiate_encoding
+
+# Upper bound on chat turns talking to Gemini at the same time in this worker
+MAX_CONCURRENT_CHATS = int(os.getenv("ASGI_MAX_CONCURRENT_CHATS", "1000"))
+# Seconds a request may wait for a free slot before it is rejected with 503
+CHAT_SLOT_TIMEOUT = float(os.getenv("ASGI_CHAT_SLOT_TIMEOUT", "30"))
+# Threads for session store and response cache calls, which may wait up to SESSION_DB_BUSY_TIMEOUT for a SQLite lock
+STORE_THREADS = int(os.getenv("ASGI_STORE_THREADS", "32"))
+# Batch jobs streamed at the same time; each waits for its next result on a thread of its own
+BATCH_STREAMS = int(os.getenv("ASGI_BATCH_STREAMS", "16"))
+
+CHAT_ROUTE = re.compile(r"^/api/chat/(?P<session_id>[^/]+)/(?P<action>stream|message)$")
+RESUME_ROUTE = re.compile(r"^/api/chat/(?P<session_id>[^/]+)/stream/(?P<message_id>[^/]+)$")
+BATCH_ROUTE = "/api/batch"
+
+chat_slots = asyncio.Semaphore(MAX_CONCURRENT_CHATS)
+store_pool = ThreadPoolExecutor(max_workers=STORE_THREADS, thread_name_prefix="asgi-store")
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_STREAMS, thread_name_prefix="asgi-batch")
+# Only SQLite does I/O and waits for locks; in-memory stores and caches are called inline, saving a thread hop per call
+STORE_BLOCKS = isinstance(chat_app.session_store, SQLiteSessionStore) or isinstance(chat_app.response_cache, SQLiteResponseCache)
+flask_app = WsgiToAsgi(chat_app.app)
+stream_flights = AsyncSingleFlight(chat_app.SINGLE_FLIGHTS)  # Separate from app.stream_flights: followers here await, not block
+upstream = AsyncScheduler(chat_app.upstream)  # Same slots, fair queue and token bucket as the batch items on worker threads
+generations = GenerationRegistry(AsyncGeneration, chat_app.RESUME_BUFFER_EVENTS, chat_app.RESUME_TTL_SECONDS)
+chat_app.FLIGHT_GROUPS.append(stream_flights)
+chat_app.GENERATION_REGISTRIES.append(generations)
+
+async def off_loop(fn, *args):
+    """Runs a blocking session store or response cache call on store_pool, so the event loop keeps serving."""
+    if not STORE_BLOCKS:
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(store_pool, functools.partial(fn, *args))
+
+async def read_body(receive):
+    """Reads the full request body."""
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+async def read_json(receive):
+    """Reads the full request body and decodes it as JSON (None if empty or invalid)."""
+    body = await read_body(receive)
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+async def send_json(send, payload, status=200, headers=None):
+    """Sends a complete JSON response."""
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"access-control-allow-origin", b"*"),
+        ] + [(key.lower().encode(), value.encode()) for key, value in (headers or {}).items()],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+def header(scope, name):
+    """Returns a request header value as str (empty if missing)."""
+    for key, value in scope.get("headers", []):
+        if key.decode("latin-1").lower() == name:
+            return value.decode("latin-1")
+    return ""
+
+async def serve_static(scope, send):
+    """Async twin of app.serve_static for built assets; returns False when the path is not one of them."""
+    path = scope["path"].lstrip("/") or "intro.html"
+    served = chat_app.static_assets.respond(path, header(scope, "accept-encoding"), header(scope, "accept"),
+                                            header(scope, "if-none-match"))
+    if served is None:
+        return False
+    status, headers, body = served
+    if status == 200:
+        headers["Content-Length"] = str(len(body))
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"access-control-allow-origin", b"*")] + [(key.lower().encode(), value.encode()) for key, value in headers.items()],
+    })
+    await send({"type": "http.response.body", "body": body if scope["method"] == "GET" else b""})
+    return True
+
+async def stream_message(scope, session_id, data, send):
+    """Async twin of app.stream_message: same SSE frames, no thread held while Gemini streams."""
+    timer = PhaseTimer(chat_app.PHASE_SECONDS, "stream")
+    category, user_message, session, error = await off_loop(chat_app.start_turn, session_id, data)
+    if error:
+        return await send_json(send, *error)
+    timer.mark("start_turn")
+
+    cache_key, cached = await off_loop(chat_app.lookup_response, session, category, user_message, "stream")
+    timer.mark("cache_lookup")
+    key = await off_loop(chat_app.flight_key, session, category, user_message, cache_key) if cached is None else None
+    slot = None
+    if cached is None and not (key and key in stream_flights):  # Joining a running generation needs no slot
+        try:
+            slot = await upstream.acquire(session_id)
+        except Overloaded as e:
+            return await send_json(send, *await off_loop(chat_app.shed_turn, session_id, category, e))
+        timer.mark("upstream_wait")
+    framing = (data or {}).get("framing")
+    turn = chat_app.StreamTurn(session_id, category, cache_key, make_framing(framing), timer)
+    generation = generations.start(turn.message_id, session_id, framing)
+
+    async def generate():
+        yield turn.open()  # Initial metadata chunk
+        try:
+            if cached is not None:  # Replay a cached reply without touching Gemini
+                for frame in turn.replay_chunks(cached):
+                    yield frame
+                yield await off_loop(turn.complete, cached)
+                return
+
+            history = await off_loop(chat_app.stream_history, session, category)
+            timer.mark("history")
+            chat_app.provider.prepare(chat_app.STREAM_SPEC)
+            timer.mark("model_setup")
+            def start():
+                return upstream.stream(
+                    session_id, lambda: chat_app.provider.stream_async(chat_app.STREAM_SPEC, history, user_message), slot)
+
+            if key:  # Shares the upstream stream with identical turns in flight on this event loop
+                stream = stream_flights.stream(key, start)
+            else:
+                stream = start()
+            if turn.framing.window:  # Flushes coalesced text on time while the model pauses
+                stream = async_paced_chunks(stream, turn.framing.flush_delay)
+            first = True
+            async for chunk in stream:
+                if chunk is None:  # No chunk within the coalescing window
+                    frame = turn.flush_due()
+                    if frame:
+                        yield frame
+                    continue
+                if first:
+                    timer.mark("first_chunk")
+                    first = False
+                frame = turn.feed(chunk)
+                if frame:
+                    yield frame
+            timer.mark("streaming")
+            yield await off_loop(turn.complete)
+        except Exception as e:  # Same error contract as the Flask generator
+            yield await off_loop(turn.fail, e)
+
+    async def produce():
+        """Runs the turn to completion as its own task, whether or not a client is still reading."""
+        profile = start_profile(f"stream-{turn.message_id}")  # Samples the event loop thread, so other requests show up too
+        try:
+            async for frame in generate():
+                if frame:
+                    generation.publish(frame)
+        finally:
+            generations.finish(generation)
+            if slot:
+                slot.release()  # Already released by upstream.stream unless the model call never started
+            elapsed = turn.finish()
+            if profile:  # Joins the sampler thread and may write its report: not on the event loop
+                await asyncio.get_running_loop().run_in_executor(store_pool, profile.stop, elapsed)
+
+    generation.task = asyncio.create_task(produce())
+    headers = {"X-Message-Id": turn.message_id, "X-User-Message-Id": session.user_message_id}
+    await follow_generation(scope, generation, send, headers=headers, attached=True)
+
+async def follow_generation(scope, generation, send, last_event_id=0, headers=None, attached=False):
+    """Async twin of app.follow_generation: streams a generation's events to one client connection."""
+    encoder = StreamEncoder(negotiate_encoding(header(scope, "accept-encoding")) if generation.framing == "compact" else None)
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"access-control-allow-origin", b"*"),
+        ] + [(key.lower().encode(), value.encode()) for key, value in dict(encoder.headers(), **(headers or {})).items()],
+    })
+
+    encode_seconds = 0.0
+    sent = 0
+
+    async def emit(frame):
+        nonlocal encode_seconds, sent
+        started = time.perf_counter()
+        body = encoder.encode(frame)
+        encode_seconds += time.perf_counter() - started
+        sent += len(body)
+        await send({"type": "http.response.body", "body": body, "more_body": True})
+
+    chat_app.ACTIVE_STREAMS.inc()
+    try:
+        try:
+            async for frame in generation.follow(last_event_id, attached):
+                await emit(frame)
+        except EventsLost:  # Fell behind the ring buffer: resend the whole reply once it is saved
+            await generation.wait()
+            chat_app.STREAM_RESUMES.inc(1, "session")
+            frames = await off_loop(chat_app.stored_reply_frames, generation.session_id, generation.message_id, generation.framing)
+            if frames:
+                await emit(frames)
+        await send({"type": "http.response.body", "body": encoder.finish()})
+    finally:
+        chat_app.ACTIVE_STREAMS.dec()
+        chat_app.STREAM_BYTES.inc(sent)
+        chat_app.PHASE_SECONDS.observe(encode_seconds, "stream", "encode")
+
+async def resume_stream(scope, session_id, message_id, send):
+    """Async twin of app.resume_stream."""
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    try:
+        last_event_id = int(header(scope, "last-event-id") or query.get("last_event_id", ["0"])[0] or 0)
+    except ValueError:
+        return await send_json(send, {"error": "Invalid Last-Event-ID"}, 400)
+    generation = generations.get(message_id)
+    if generation is not None and generation.session_id == session_id:
+        chat_app.STREAM_RESUMES.inc(1, "buffer")
+    else:  # Finished long ago, or produced by another worker: replay what the session has
+        framing = query.get("framing", [None])[0]
+        frames = await off_loop(chat_app.stored_reply_frames, session_id, message_id, framing)
+        if frames is None:
+            return await send_json(send, {"error": "Stream not found"}, 404)
+        chat_app.STREAM_RESUMES.inc(1, "session")
+        generation = AsyncGeneration(message_id, session_id, framing)
+        generation.publish(frames)
+        generation.finish()
+        last_event_id = 0
+    await follow_generation(scope, generation, send, last_event_id)
+
+async def send_message(session_id, data, send):
+    """Async twin of app.send_message."""
+    timer = PhaseTimer(chat_app.PHASE_SECONDS, "message")
+    category, user_message, session, error = await off_loop(chat_app.start_turn, session_id, data)
+    if error:
+        return await send_json(send, *error)
+    timer.mark("start_turn")
+
+    cache_key, cached = await off_loop(chat_app.lookup_response, session, category, user_message, "message")
+    timer.mark("cache_lookup")
+    if cached is not None:
+        payload = await off_loop(chat_app.reply_message, session_id, category, cached)
+    else:
+        try:
+            slot = await upstream.acquire(session_id)
+        except Overloaded as e:
+            return await send_json(send, *await off_loop(chat_app.shed_turn, session_id, category, e))
+        timer.mark("upstream_wait")
+        try:
+            history = await off_loop(chat_app.message_history, session, category)
+            timer.mark("history")
+            chat_app.provider.prepare(chat_app.MESSAGE_SPEC)
+            timer.mark("model_setup")
+            response_text = await upstream.call(
+                session_id, lambda: chat_app.provider.generate_async(chat_app.MESSAGE_SPEC, history, user_message), slot)
+            timer.mark("generation")
+            payload = await off_loop(chat_app.complete_message, session_id, category, response_text, cache_key, timer)
+        except Exception as e:
+            payload = await off_loop(chat_app.fail_message, session_id, category, e)
+        finally:
+            slot.release()
+    timer.mark("record")
+    await send_json(send, payload)
+    timer.mark("serialize")
+    timer.finish()
+
+def wsgi_request(scope, body):
+    """A werkzeug Request for an ASGI request whose body has been read, for request parsing shared with the Flask app."""
+    return Request({
+        "REQUEST_METHOD": scope["method"],
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "CONTENT_TYPE": header(scope, "content-type"),
+        "CONTENT_LENGTH": str(len(body)),
+        "SERVER_NAME": "asgi",
+        "SERVER_PORT": "0",
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+    })
+
+async def wait_for_disconnect(receive):
+    """Returns once the client has gone away (call after the request body has been read)."""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+async def create_batch(scope, receive, send):
+    """Async twin of app.create_batch: streams the job's NDJSON rows without holding the Flask app's thread.
+
+    The job's generator blocks until its next result, so each next() runs on batch_pool. When the
+    client disconnects, the generator is closed (cancelling items not started yet) as soon as the
+    next() in progress returns.
+    """
+    job_id, run, error = chat_app.start_batch(wsgi_request(scope, await read_body(receive)))
+    if error:
+        return await send_json(send, *error)
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"application/x-ndjson"),
+            (b"access-control-allow-origin", b"*"),
+            (b"x-batch-job", job_id.encode()),
+        ],
+    })
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    pending = None  # The next() running on batch_pool
+    try:
+        while True:
+            pending = batch_pool.submit(next, run, None)
+            row = asyncio.wrap_future(pending)
+            await asyncio.wait((row, disconnected), return_when=asyncio.FIRST_COMPLETED)
+            if not row.done():
+                return  # Client gone
+            pending = None
+            if row.result() is None:
+                break
+            await send({"type": "http.response.body", "body": ndjson_line(row.result()).encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        disconnected.cancel()
+        if pending is None:
+            run.close()
+        else:
+            pending.add_done_callback(lambda _: run.close())
+
+async def lifespan(receive, send):
+    """Acknowledges server startup/shutdown events."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    """ASGI entry point."""
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+        resume = RESUME_ROUTE.match(scope.get("path", "")) if scope["method"] == "GET" else None
+        if resume:  # Reconnects follow an AsyncGeneration of this loop, so they are not delegated to Flask
+            return await resume_stream(scope, resume.group("session_id"), resume.group("message_id"), send)
+        if chat_app.static_assets and await serve_static(scope, send):
+            return
+
+    if scope["type"] == "http" and scope["method"] == "POST" and scope.get("path") == BATCH_ROUTE:
+        return await create_batch(scope, receive, send)
+
+    match = CHAT_ROUTE.match(scope.get("path", "")) if scope["type"] == "http" else None
+    if not match or scope["method"] != "POST":
+        # Run in an empty context: asgiref leaves its per-request executor in the context, and uvicorn starts
+        # the next request on a keep-alive connection from it ("CurrentThreadExecutor already quit")
+        return await contextvars.Context().run(asyncio.ensure_future, flask_app(scope, receive, send))
+
+    session_id = match.group("session_id")
+    if not await off_loop(chat_app.session_store.__contains__, session_id):
+        return await send_json(send, {"error": "Chat session not found"}, 404)
+    data = await read_json(receive)
+
+    try:
+        await asyncio.wait_for(chat_slots.acquire(), timeout=CHAT_SLOT_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.warning(f"Rejecting chat request for session {session_id}: all {MAX_CONCURRENT_CHATS} slots busy")
+        return await send_json(send, {"error": "Server busy, please retry"}, 503)
+
+    try:
+        if match.group("action") == "stream":
+            await stream_message(scope, session_id, data, send)
+        else:
+            await send_message(session_id, data, send)
+    except StoreBusy as e:  # Raised before the response started: streams report later failures in-band
+        await send_json(send, *chat_app.store_busy(e))
+    finally:
+        chat_slots.release()
@@ -0,0 +1,252 @@
+"""Batch jobs: many chat prompts answered by a bounded worker pool, results streamed as NDJSON.
+
+A job is a list of items, {"message", "session_id"?, "category"?, "id"?}, sent as a JSON list or
+uploaded as a JSONL file. Items that name a session are turns in that session. Each session's
+items run one after another, in order, so every turn sees the previous one. All other items are
+one-off prompts and run independently. Up to `workers` items of a job run at the same time. Every
+model call still goes through the upstream scheduler, so batch traffic shares its limits with
+interactive traffic.
+
+Results are yielded as items finish, not in input order. Each result carries the item's index
+(and id, if it had one). A failed item produces an error result and does not stop the job.
+Final results are appended to a per-job checkpoint file (<checkpoint_dir>/<job_id>.jsonl).
+Running the same job_id again resumes the job: an item whose index and content match a
+checkpointed result is answered from the checkpoint, and only the rest are run.
+
+Which results are final: successes, and errors of session items that carry a message_id. Such a
+turn is already in the session, as the user message plus an error reply (as after a failed
+/message call), so running it again would append it twice; it is checkpointed as a terminal error.
+Other errors (one-off prompts, or session items rejected before anything was written) are retried
+on resume.
+
+When the client disconnects, items not yet started are cancelled. Items already running finish
+and are checkpointed.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")  # Job ids name checkpoint files
+
+class JobRunning(Exception):
+    """The job is already running in this process."""
+
+class BatchItem:
+    """One prompt of a batch job; error is set when the input line or object was invalid."""
+
+    __slots__ = ("index", "id", "session_id", "category", "message", "error", "digest")
+
+    def __init__(self, index, raw, default_category=None):
+        self.index = index
+        self.id = self.session_id = self.message = self.error = None
+        self.category = default_category
+        if not isinstance(raw, dict):
+            self.error = "Item must be a JSON object"
+        else:
+            self.id = raw.get("id")
+            self.session_id = raw.get("session_id") or None
+            self.category = raw.get("category") or default_category
+            self.message = raw.get("message")
+            if not isinstance(self.message, str) or not self.message:
+                self.error = "No message provided"
+            elif not isinstance(self.session_id, (str, type(None))) or not isinstance(self.category, (str, type(None))):
+                self.error = "session_id and category must be strings"
+        # Identifies the item's content, so a checkpoint is only reused for the same item at the same index
+        payload = json.dumps([self.session_id, self.category, self.message])
+        self.digest = hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+    def result(self, status, **fields):
+        return {"index": self.index, "id": self.id, "status": status, **fields}
+
+def items_from_list(raw_items, default_category=None, max_items=None):
+    """BatchItems from the "items" list of a JSON request. Raises ValueError for a malformed or oversized batch."""
+    if not isinstance(raw_items, list) or not raw_items:
+        raise ValueError("items must be a non-empty list")
+    if max_items and len(raw_items) > max_items:
+        raise ValueError(f"Batch has {len(raw_items)} items, the limit is {max_items}")
+    return [BatchItem(index, raw, default_category) for index, raw in enumerate(raw_items)]
+
+def items_from_jsonl(lines, default_category=None, max_items=None):
+    """BatchItems from the lines of a JSONL upload (bytes or str); blank lines are skipped."""
+    items = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        if not line.strip():
+            continue
+        if max_items and len(items) >= max_items:
+            raise ValueError(f"Batch has more than {max_items} items")
+        try:
+            raw = json.loads(line)
+        except ValueError:
+            raw = None  # Reported as a per-item error, like any other invalid item
+        items.append(BatchItem(len(items), raw, default_category))
+        if raw is None:
+            items[-1].error = "Invalid JSON"
+    if not items:
+        raise ValueError("The upload has no items")
+    return items
+
+class Checkpoint:
+    """Final results of one job, one JSON line each, appended as items finish."""
+
+    def __init__(self, directory, job_id):
+        self.path = os.path.join(directory, f"{job_id}.jsonl")
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Checkpointed results by item index ({} when the job has not run before)."""
+        done = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by a crash; that item simply runs again
+                    done[result["index"]] = result
+        except FileNotFoundError:
+            pass
+        return done
+
+    def record(self, item, result):
+        line = json.dumps(dict(result, digest=item.digest), separators=(",", ":")) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+def is_final(item, result):
+    """Whether a result is checkpointed: a success, or a failed turn already recorded in its session."""
+    return result["status"] == "ok" or bool(item.session_id and result.get("message_id"))
+
+def public(result):
+    """A checkpointed result without its bookkeeping fields."""
+    return {key: value for key, value in result.items() if key != "digest"}
+
+class BatchRunner:
+    """Runs batch jobs with run_item(job_id, item) -> result, at most one run per job id at a time."""
+
+    def __init__(self, run_item, checkpoint_dir, workers=8, counter=None):
+        self.run_item = run_item
+        self.checkpoint_dir = checkpoint_dir
+        self.workers = workers
+        self.counter = counter  # Counter labelled by result: ok | error | resumed
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def checkpoint(self, job_id):
+        if not JOB_ID_PATTERN.match(job_id):
+            raise ValueError("job_id must be 1-64 letters, digits, '-' or '_'")
+        return Checkpoint(self.checkpoint_dir, job_id)
+
+    def results(self, job_id):
+        """The checkpointed results of a job in index order, or None if it has none."""
+        done = self.checkpoint(job_id).load()
+        return [public(done[index]) for index in sorted(done)] if done else None
+
+    def start(self, job_id, items, workers=None):
+        """Claims job_id and returns the generator running it. Raises ValueError or JobRunning."""
+        checkpoint = self.checkpoint(job_id)
+        with self._lock:
+            if job_id in self._running:
+                raise JobRunning(f"Batch job {job_id} is already running")
+            self._running.add(job_id)
+        workers = max(1, min(workers or self.workers, self.workers))
+        run = self._run(job_id, items, checkpoint, workers)
+        return started(run)
+
+    def _count(self, result):
+        if self.counter:
+            self.counter.inc(1, result)
+
+    def _run(self, job_id, items, checkpoint, workers):
+        """Yields a "started" line, a result per item as it finishes, then a "complete" summary."""
+        results = queue.Queue()
+        cancelled = threading.Event()
+        pool = None
+        try:
+            done = checkpoint.load()
+            resumed, lanes, invalid = [], {}, []
+            for item in items:
+                previous = done.get(item.index)
+                if item.error:
+                    invalid.append(item)
+                elif previous and previous.get("digest") == item.digest:
+                    resumed.append(dict(public(previous), resumed=True))
+                else:  # Turns of one session share a lane and run in order; one-off prompts get their own
+                    lanes.setdefault(item.session_id or f"#{item.index}", []).append(item)
+            pending = sum(len(lane) for lane in lanes.values())
+            logging.info(f"Batch job {job_id}: {len(items)} items, {len(resumed)} from checkpoint, {pending} to run")
+            yield {"job_id": job_id, "status": "started", "total": len(items), "resumed": len(resumed), "pending": pending}
+
+            def run_lane(lane):
+                for item in lane:
+                    if cancelled.is_set():
+                        return
+                    try:
+                        result = self.run_item(job_id, item)
+                    except Exception as e:  # run_item reports model errors itself; this is a last resort
+                        logging.error(f"Batch job {job_id} item {item.index} failed: {str(e)}")
+                        result = item.result("error", error=str(e))
+                    if is_final(item, result):
+                        try:
+                            checkpoint.record(item, result)
+                        except OSError as e:
+                            logging.error(f"Could not checkpoint batch job {job_id} item {item.index}: {str(e)}")
+                    results.put(result)
+
+            if lanes:
+                pool = ThreadPoolExecutor(max_workers=min(workers, len(lanes)), thread_name_prefix=f"batch-{job_id}")
+                for lane in lanes.values():
+                    pool.submit(run_lane, lane)
+
+            counts = {"ok": 0, "error": 0}
+            for result in resumed:
+                self._count("resumed")
+                counts[result["status"]] += 1
+                yield result
+            for item in invalid:
+                self._count("error")
+                counts["error"] += 1
+                yield item.result("error", error=item.error)
+            for _ in range(pending):
+                result = results.get()
+                self._count(result["status"])
+                counts[result["status"]] += 1
+                yield result
+            yield {"job_id": job_id, "status": "complete", "total": len(items), "resumed": len(resumed), **counts}
+        finally:  # Also runs when the client disconnects: queued items are dropped, running ones finish
+            cancelled.set()
+            if pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+            with self._lock:
+                self._running.discard(job_id)
+
+def started(run):
+    """Runs a job's generator up to its first row now, so its cleanup runs however the response ends.
+
+    Returns a generator over all of its rows; closing it closes the job's generator.
+    """
+    first = next(run)
+
+    def rows():
+        try:
+            yield first
+            yield from run
+        finally:
+            run.close()
+    return rows()
+
+def ndjson_line(row):
+    return json.dumps(row, separators=(",", ":")) + "\n"
+
+def ndjson(rows):
+    """Encodes dicts as newline-delimited JSON, one chunk per row."""
+    for row in rows:
+        yield ndjson_line(row)
@@ -0,0 +1,113 @@
+"""Streams-per-worker benchmark for the asyncio serving mode (asgi.py).
+
+Opens N concurrent SSE streams against the fake model provider (MODEL_PROVIDER=fake) inside one process and reports how
+long they take, compared with the threaded WSGI generator limited to a fixed thread pool.
+The upstream scheduler limits are raised to --streams so that no stream is shed, and the response
+cache and single-flight are off so every stream reaches the model. A response that is not a 200
+SSE stream counts as failed and fails the run.
+
+    python benchmarks/bench_async_streams.py --streams 2000 --threads 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_http_api import fake_chunk_settings  # noqa: E402
+
+chat_app = asgi = None  # Imported by main() once the UPSTREAM_* and FAKE_* settings are in the environment
+
+def load_server(streams, chunks, chunk_delay):
+    global chat_app, asgi
+    os.environ.update(UPSTREAM_MAX_CONCURRENT=str(streams), UPSTREAM_MAX_QUEUE=str(streams),
+                      ASGI_MAX_CONCURRENT_CHATS=str(streams), RESPONSE_CACHE="off", SINGLE_FLIGHT="off",
+                      **fake_chunk_settings(chunks, chunk_delay))
+    import app as chat_app
+    import asgi
+
+def new_session():
+    with chat_app.app.test_client() as client:
+        return client.post('/api/chat/new', json={"category": "general"}).get_json()["session_id"]
+
+async def one_asgi_stream(session_id):
+    body = json.dumps({"message": f"hello {session_id}"}).encode()
+    received = {"sent": False}
+    response = {}
+    frames = []
+    first = []
+    started = time.perf_counter()
+
+    async def receive():
+        if received["sent"]:
+            await asyncio.sleep(3600)
+        received["sent"] = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response.update(status=message["status"], headers=dict(message["headers"]))
+        if message["type"] == "http.response.body" and message.get("body"):
+            if not first:
+                first.append(time.perf_counter() - started)
+            frames.append(message["body"])
+
+    scope = {"type": "http", "method": "POST", "path": f"/api/chat/{session_id}/stream", "headers": []}
+    await asgi.application(scope, receive, send)
+    ok = response.get("status") == 200 and response["headers"].get(b"content-type", b"").startswith(b"text/event-stream")
+    return first[0] if first else None, len(frames), ok
+
+async def run_asgi(sessions):
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one_asgi_stream(s) for s in sessions))
+    return time.perf_counter() - started, results
+
+def one_wsgi_stream(session_id):
+    with chat_app.app.test_client() as client:
+        response = client.post(f'/api/chat/{session_id}/stream', json={"message": f"hello {session_id}"})
+        response.get_data()
+        return response.status_code == 200 and response.mimetype == "text/event-stream"
+
+def run_wsgi(sessions, threads):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(one_wsgi_stream, sessions))
+    return time.perf_counter() - started, results.count(False)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=1000, help="concurrent streams to open")
+    parser.add_argument("--threads", type=int, default=32, help="WSGI thread pool size for the comparison run")
+    parser.add_argument("--chunks", type=int, default=20, help="chunks per fake reply")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="seconds between fake chunks")
+    parser.add_argument("--skip-wsgi", action="store_true", help="only run the asyncio server")
+    args = parser.parse_args()
+
+    load_server(args.streams, args.chunks, args.chunk_delay)
+    ideal = args.chunks * args.chunk_delay
+
+    sessions = [new_session() for _ in range(args.streams)]
+    elapsed, results = asyncio.run(run_asgi(sessions))
+    ttfb = sorted(r[0] for r in results if r[2])
+    failed = sum(not r[2] for r in results)
+    completed = args.streams - failed
+    print(f"asgi: {completed} streams in {elapsed:.2f}s "
+          f"({completed / elapsed:.0f} streams/s, ideal per-stream {ideal:.2f}s, "
+          f"p50 first byte {ttfb[len(ttfb) // 2] * 1000 if ttfb else 0:.1f}ms, {failed} failed)")
+
+    if not args.skip_wsgi:
+        sessions = [new_session() for _ in range(args.streams)]
+        elapsed, wsgi_failed = run_wsgi(sessions, args.threads)
+        print(f"wsgi ({args.threads} threads): {args.streams - wsgi_failed} streams in {elapsed:.2f}s "
+              f"({(args.streams - wsgi_failed) / elapsed:.0f} streams/s, {wsgi_failed} failed)")
+        failed += wsgi_failed
+
+    if failed:
+        sys.exit(f"{failed} responses were not SSE streams (shed or failed)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Bulk prompts: one POST /message per prompt versus a single /api/batch job.
+
+Starts the server with the fake provider and answers --items distinct one-off prompts twice.
+The first pass is the back-office pattern: per prompt, POST /api/chat/new then POST /message,
+from --concurrency client threads. The second pass sends one /api/batch request with the same
+prompts, run by --concurrency batch workers. It reports wall time, items per second, time to the
+first result and errors for each pass. The batch is then posted again with the same job_id, to
+time a resume from a complete checkpoint.
+
+    python benchmarks/bench_batch.py --items 500 --concurrency 16
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_http_api import free_port, request, start_server
+
+def per_message(port, args):
+    """Returns (seconds, first result seconds, errors) for one /chat/new + /message pair per prompt."""
+    started = time.perf_counter()
+    firsts = []
+
+    def one(index):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        try:
+            status, body = request(conn, "POST", "/api/chat/new", {"category": "general"})
+            if status != 200:
+                return 1
+            session_id = json.loads(body)["session_id"]
+            status, body = request(conn, "POST", f"/api/chat/{session_id}/message", {"message": f"bulk prompt {index}"})
+            firsts.append(time.perf_counter() - started)
+            return int(status != 200 or "error" in json.loads(body))
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        errors = sum(pool.map(one, range(args.items)))
+    return time.perf_counter() - started, min(firsts, default=0), errors
+
+def batch(port, args, job_id):
+    """Returns (seconds, first result seconds, errors) for one /api/batch job."""
+    items = [{"message": f"bulk prompt {index}", "id": str(index)} for index in range(args.items)]
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+    started = time.perf_counter()
+    conn.request("POST", "/api/batch", body=json.dumps({"items": items, "job_id": job_id, "concurrency": args.concurrency}),
+                 headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    first, errors, complete = None, 0, None
+    for line in response:
+        row = json.loads(line)
+        if row.get("status") == "complete":
+            complete = row
+        elif "index" in row:
+            first = first or time.perf_counter() - started
+            errors += row["status"] != "ok"
+    conn.close()
+    if complete is None:
+        errors = args.items  # The job did not finish
+    return time.perf_counter() - started, first or 0, errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads, and batch workers")
+    parser.add_argument("--latency-ms", type=float, default=50, help="fake provider time to first chunk")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="fake provider speed (0 = instant)")
+    parser.add_argument("--reply-tokens", type=int, default=200)
+    parser.add_argument("--workdir", default=os.environ.get("TMPDIR", "/tmp"))
+    args = parser.parse_args()
+    args.error_rate = 0.0
+    args.response_cache = "off"  # Distinct prompts anyway; every item reaches the model
+    args.session_store = "memory"
+
+    checkpoints = tempfile.mkdtemp(prefix="bench_batch_", dir=args.workdir)
+    port = free_port()
+    server = start_server(args, port, BATCH_CHECKPOINT_DIR=checkpoints, BATCH_WORKERS=str(args.concurrency))
+    try:
+        print(f"{args.server}: {args.items} prompts, concurrency {args.concurrency}, fake latency {args.latency_ms} ms")
+        print(f"{'mode':<12} {'seconds':>8} {'items/s':>8} {'first ms':>9} {'errors':>6}")
+        for name, run in (("message", lambda: per_message(port, args)),
+                          ("batch", lambda: batch(port, args, "bench")),
+                          ("resume", lambda: batch(port, args, "bench"))):
+            seconds, first, errors = run()
+            print(f"{name:<12} {seconds:>8.2f} {args.items / seconds:>8.1f} {first * 1000:>9.1f} {errors:>6}")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(checkpoints, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""format_code_blocks: golden-corpus equivalence check and speed against the original regex passes.
+
+Also checks StreamingFormatter: the same text fed whole and in random chunks must format the same,
+and a few split and bare fences must give the expected output.
+
+    python benchmarks/bench_format_code_blocks.py
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from formatting import StreamingFormatter, detect_language, format_code_blocks  # noqa: E402
+
+def legacy_format_code_blocks(text):
+    """The original four-pass implementation, kept as the reference output."""
+    pattern = r"```\s*\n"
+
+    def replace_match(match):
+        start_pos = match.end()
+        end_pos = text[start_pos:].find("```")
+        if end_pos != -1:
+            return f"```{detect_language(text[start_pos:start_pos + end_pos])}\n"
+        return match.group(0)
+
+    formatted_text = re.sub(pattern, replace_match, text)
+    formatted_text = re.sub(r"([^\n])```", r"\1\n```", formatted_text)
+    formatted_text = re.sub(r"```([a-zA-Z0-9]+)([^\n])", r"```\1\n\2", formatted_text)
+    formatted_text = re.sub(r"```([a-zA-Z0-9]+)$", r"```\1\n", formatted_text, flags=re.MULTILINE)
+    return formatted_text
+
+SNIPPETS = [
+    "def add(a, b):\n    return a + b\n",
+    "const add = (a, b) => a + b;\n",
+    "SELECT id, name FROM users WHERE active = 1;\n",
+    "#include <stdio.h>\nint main() { return 0; }\n",
+    "fn main() {\n    let mut x = 1;\n}\n",
+    "echo hello\n",
+]
+FENCES = ["```\n", "```python\n", "```js\n", "``` \n", "```sql\n", "```\n\n"]
+PROSE = [
+    "Here is how you can do it.\n\n",
+    "The function above returns the sum. Use `add(1, 2)` to try it.\n",
+    "1. First step\n2. Second step\n\n",
+]
+ODD_PROSE = PROSE + ["Note that ```inline fences``` are sometimes emitted mid-sentence.\n"]
+
+def build_response(rng, target_size, fences, prose=PROSE):
+    """A model-like answer of roughly target_size characters with the given number of code blocks."""
+    parts = []
+    prose_per_block = max(1, target_size // max(fences, 1) // 120)
+    for _ in range(fences):
+        for _ in range(prose_per_block):
+            parts.append(rng.choice(prose))
+        parts.append(rng.choice(FENCES) + rng.choice(SNIPPETS) * rng.randint(1, 4) + "```\n")
+    size = sum(map(len, parts))
+    while size < target_size:
+        parts.append(rng.choice(prose))
+        size += len(parts[-1])
+    return "".join(parts)
+
+def golden_corpus(rng):
+    """Realistic responses plus random fence soup that exercises every edge of the old regexes."""
+    corpus = [build_response(rng, size, fences, ODD_PROSE) for size in (200, 2000, 20000) for fences in (0, 1, 5, 30)]
+    alphabet = ["`", "```", "\n", " ", "\t", "a", "Z", "9", ".", "def ", "SELECT ", "``` \n", "```py\n"]
+    corpus += ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))) for _ in range(20000)]
+    return corpus
+
+# (chunks as streamed, expected output) for StreamingFormatter
+STREAMING_CASES = [
+    (["Text``", "`python\nprint(1)\n`", "``after"], "Text\n```python\nprint(1)\n```\nafter"),  # Fences split mid-run
+    (["```py", "thon\nx = 1\n```\n"], "```python\nx = 1\n```\n"),                           # Language split
+    (["```\n", "def f():\n", "    pass\n```\n"], "```python\ndef f():\n    pass\n```\n"),        # Bare fence, language detected
+    (["``` \nSELECT 1 ", "FROM t\n```"], "```sql\nSELECT 1 FROM t\n```"),                       # Bare fence with trailing space
+    (["```js const x = 1;\n```"], "```js\nconst x = 1;\n```"),                                   # Code on the fence line
+    (["a ``inline`` b"], "a ``inline`` b"),                                                         # Not a fence
+    (["```\nprint(1)\n"], "```python\nprint(1)\n"),                                              # Bare fence never closed
+]
+
+def stream_format(chunks):
+    formatter = StreamingFormatter()
+    return "".join(formatter.feed(chunk) for chunk in chunks) + formatter.finish()
+
+def random_chunks(rng, text):
+    """text cut at random points, in 1-40 character pieces like a model stream."""
+    chunks, pos = [], 0
+    while pos < len(text):
+        size = rng.randint(1, 40)
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+def streaming_mismatches(rng, corpus):
+    """Number of corpus texts whose chunked output differs from the whole-text output, plus failed cases."""
+    mismatches = 0
+    for text in corpus:
+        if stream_format(random_chunks(rng, text)) != stream_format([text]):
+            mismatches += 1
+    long_bare = "```\n" + "x = 1\n" * 100 + "```\n"  # Longer than LANGUAGE_HOLD_CHARS: released before the fence closes
+    cases = STREAMING_CASES + [(random_chunks(rng, long_bare), "```plaintext\n" + long_bare[4:])]
+    for chunks, expected in cases:
+        if stream_format(chunks) != expected or stream_format(list("".join(chunks))) != expected:
+            print(f"streaming case {chunks!r}: expected {expected!r}, got {stream_format(chunks)!r}")
+            mismatches += 1
+    return mismatches
+
+def timed(fn, text, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    rng = random.Random(42)
+    corpus = golden_corpus(rng)
+    mismatches = sum(legacy_format_code_blocks(text) != format_code_blocks(text) for text in corpus)
+    print(f"golden corpus: {len(corpus)} responses, {mismatches} mismatches")
+    if mismatches:
+        sys.exit(1)
+    mismatches = streaming_mismatches(rng, corpus)
+    print(f"streaming formatter: {len(corpus)} chunked responses and {len(STREAMING_CASES) + 1} cases, {mismatches} mismatches")
+    if mismatches:
+        sys.exit(1)
+
+    for size in (10_000, 100_000, 1_000_000):
+        for fences in (12, 48):
+            text = build_response(rng, size, fences)
+            repeat = 20 if size < 1_000_000 else 3
+            before = timed(legacy_format_code_blocks, text, repeat)
+            after = timed(format_code_blocks, text, repeat)
+            print(f"{len(text) / 1024:8.0f} KB, {fences:3d} fences: "
+                  f"before {before * 1000:8.2f}ms  after {after * 1000:8.2f}ms  ({before / after:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""End-to-end load test of the chat HTTP API against the fake model provider.
+
+Starts the server in a subprocess (Flask threaded server or uvicorn + asgi.py) with
+MODEL_PROVIDER=fake, then runs simulated users concurrently. Each user:
+
+    POST /api/chat/new -> --turns x POST /stream (or /message) -> GET /api/chats?limit=50 -> GET /api/chat/<id>
+
+Reports p50/p95/p99 latency per endpoint, time to first SSE byte, streams per second and
+server memory per session (RSS growth / sessions, Linux only). Results can be stored as a
+baseline and later runs compared against it; a metric that is worse than the baseline by
+more than --tolerance fails the run (exit status 1). Baselines are only meaningful on the machine
+that recorded them; re-record after hardware changes.
+
+    python benchmarks/bench_http_api.py --users 200 --concurrency 50
+    python benchmarks/bench_http_api.py --server asgi --save-baseline
+    python benchmarks/bench_http_api.py --server asgi --compare
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(ROOT, "benchmarks", "baselines")
+
+# Metrics compared against the baseline, and whether a larger value is better
+COMPARED = {
+    "new_chat.p95_ms": False,
+    "turn.p50_ms": False,
+    "turn.p95_ms": False,
+    "turn.p99_ms": False,
+    "ttfb.p50_ms": False,
+    "ttfb.p95_ms": False,
+    "list_chats.p95_ms": False,
+    "get_chat.p95_ms": False,
+    "streams_per_s": True,
+    "memory_per_session_kb": False,
+}
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def fake_chunk_settings(chunks, chunk_delay, chunk_tokens=4):
+    """FAKE_* settings for replies of exactly chunks chunks of chunk_tokens tokens, each chunk_delay seconds after the last."""
+    return dict(
+        MODEL_PROVIDER="fake",
+        FAKE_LATENCY_MS=str(chunk_delay * 1000),
+        FAKE_TOKENS_PER_SECOND=str(chunk_tokens / chunk_delay if chunk_delay else 0),
+        FAKE_CHUNK_MIN_TOKENS=str(chunk_tokens),
+        FAKE_CHUNK_MAX_TOKENS=str(chunk_tokens),
+        FAKE_REPLY_TOKENS=str(chunks * chunk_tokens),
+        FAKE_ERROR_RATE="0",
+    )
+
+def server_command(args, port):
+    """Single-process server for --server."""
+    if args.server == "asgi":
+        return [sys.executable, "-m", "uvicorn", "asgi:application", "--port", str(port), "--log-level", "warning"]
+    return [sys.executable, "-c", f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+
+def start_server(args, port, command=None, **settings):
+    """Starts the API with the fake provider and waits until /api/ready answers 200.
+
+    command replaces the server command line built from --server; settings override environment variables.
+    """
+    db_path = os.path.join(args.workdir, "bench_sessions.db")
+    for suffix in ("", "-wal", "-shm"):  # Every run starts from an empty store
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    env = dict(
+        os.environ,
+        MODEL_PROVIDER="fake",
+        FAKE_LATENCY_MS=str(args.latency_ms),
+        FAKE_TOKENS_PER_SECOND=str(args.tokens_per_second),
+        FAKE_REPLY_TOKENS=str(args.reply_tokens),
+        FAKE_ERROR_RATE=str(args.error_rate),
+        RESPONSE_CACHE=args.response_cache,
+        SESSION_STORE=args.session_store,
+        SESSION_DB_PATH=db_path,
+    )
+    env.update(settings)
+    command = command or server_command(args, port)
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            status, _ = request(http.client.HTTPConnection("127.0.0.1", port, timeout=1), "GET", "/api/ready")
+            if status == 200:
+                return process
+        except OSError:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"{args.server} server did not become ready on port {port}")
+
+def rss_kb(pid):
+    """Resident set size of a process in KB (None where /proc is unavailable)."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+def request(conn, method, path, payload=None):
+    body = json.dumps(payload) if payload is not None else None
+    conn.request(method, path, body=body, headers={"Content-Type": "application/json"} if body else {})
+    response = conn.getresponse()
+    return response.status, response.read()
+
+class User:
+    """One simulated user; records (operation, seconds) samples."""
+
+    def __init__(self, port, args, index):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        self.args = args
+        self.index = index
+        self.samples = []
+        self.ttfb = []
+        self.errors = 0
+
+    def timed(self, name, method, path, payload=None):
+        started = time.perf_counter()
+        status, body = request(self.conn, method, path, payload)
+        self.samples.append((name, time.perf_counter() - started))
+        if status >= 400:
+            self.errors += 1
+        return body
+
+    def stream(self, session_id, message):
+        payload = json.dumps({"message": message, "framing": self.args.framing})
+        started = time.perf_counter()
+        self.conn.request("POST", f"/api/chat/{session_id}/stream", body=payload,
+                          headers={"Content-Type": "application/json"})
+        response = self.conn.getresponse()
+        response.read(1)  # First byte of the metadata frame
+        self.ttfb.append(time.perf_counter() - started)
+        body = response.read()
+        self.samples.append(("turn", time.perf_counter() - started))
+        if response.status >= 400 or b'"error"' in body:
+            self.errors += 1
+
+    def run(self):
+        session = json.loads(self.timed("new_chat", "POST", "/api/chat/new", {"category": "general"}))
+        session_id = session["session_id"]
+        for turn in range(self.args.turns):
+            message = f"user {self.index} question {turn}"  # Distinct prompts so the response cache cannot short-circuit
+            if self.args.mode == "stream":
+                self.stream(session_id, message)
+            else:
+                self.timed("turn", "POST", f"/api/chat/{session_id}/message", {"message": message})
+        self.timed("list_chats", "GET", "/api/chats?limit=50")
+        self.timed("get_chat", "GET", f"/api/chat/{session_id}")
+        self.conn.close()
+        return self
+
+def run(args):
+    port = free_port()
+    server = start_server(args, port)
+    try:
+        rss_before = rss_kb(server.pid)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            users = list(pool.map(lambda index: User(port, args, index).run(), range(args.users)))
+        elapsed = time.perf_counter() - started
+        rss_after = rss_kb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    results = {"elapsed_s": elapsed, "errors": sum(user.errors for user in users)}
+    by_operation = {}
+    for user in users:
+        for name, seconds in user.samples:
+            by_operation.setdefault(name, []).append(seconds)
+    by_operation["ttfb"] = [seconds for user in users for seconds in user.ttfb]
+    for name, samples in by_operation.items():
+        if not samples:
+            continue
+        for pct in (50, 95, 99):
+            results[f"{name}.p{pct}_ms"] = percentile(samples, pct) * 1000
+        results[f"{name}.count"] = len(samples)
+    results["streams_per_s"] = args.users * args.turns / elapsed
+    if rss_before is not None and rss_after is not None:
+        results["memory_per_session_kb"] = max(0, rss_after - rss_before) / args.users
+    return results
+
+def scenario(args):
+    """Settings that must match for two runs to be comparable."""
+    return {key: getattr(args, key) for key in (
+        "server", "mode", "framing", "users", "concurrency", "turns", "latency_ms", "tokens_per_second",
+        "reply_tokens", "error_rate", "response_cache", "session_store"
+    )}
+
+def baseline_path(args):
+    return args.baseline or os.path.join(BASELINES, f"http_api_{args.server}_{args.mode}.json")
+
+def compare(results, baseline, tolerance):
+    """Prints each compared metric against the baseline; returns the names of regressed metrics."""
+    regressions = []
+    print(f"\n{'metric':<24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, higher_is_better in COMPARED.items():
+        if name not in results or name not in baseline["results"]:
+            continue
+        old, new = baseline["results"][name], results[name]
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<24} {old:10.2f} {new:10.2f} {change:+8.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--mode", choices=("stream", "message"), default="stream")
+    parser.add_argument("--framing", choices=("legacy", "compact"), default="compact")
+    parser.add_argument("--users", type=int, default=200, help="simulated users in total")
+    parser.add_argument("--concurrency", type=int, default=50, help="users active at the same time")
+    parser.add_argument("--turns", type=int, default=3, help="chat turns per user")
+    parser.add_argument("--latency-ms", type=float, default=50, help="fake provider time to first chunk")
+    parser.add_argument("--tokens-per-second", type=float, default=2000, help="fake provider generation speed")
+    parser.add_argument("--reply-tokens", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--response-cache", choices=("memory", "sqlite", "off"), default="off")
+    parser.add_argument("--session-store", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--workdir", default=os.environ.get("TMPDIR", "/tmp"), help="where the sqlite store is created")
+    parser.add_argument("--baseline", help="baseline file (default: benchmarks/baselines/http_api_<server>_<mode>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against the stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression when comparing")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(f"{args.server}/{args.mode}: {args.users} users x {args.turns} turns, concurrency {args.concurrency}, "
+          f"{results['elapsed_s']:.2f}s, {results['errors']} errors")
+    for name in ("new_chat", "turn", "ttfb", "list_chats", "get_chat"):
+        if f"{name}.p50_ms" in results:
+            print(f"  {name:<11} p50 {results[f'{name}.p50_ms']:8.1f}ms  p95 {results[f'{name}.p95_ms']:8.1f}ms  "
+                  f"p99 {results[f'{name}.p99_ms']:8.1f}ms  ({results[f'{name}.count']} samples)")
+    print(f"  {'streams/s' if args.mode == 'stream' else 'turns/s':<11} {results['streams_per_s']:.1f}")
+    if "memory_per_session_kb" in results:
+        print(f"  memory      {results['memory_per_session_kb']:.1f} KB/session")
+
+    path = baseline_path(args)
+    status = 0
+    if args.compare:
+        if not os.path.exists(path):
+            print(f"\nNo baseline at {path}; run with --save-baseline first")
+            status = 1
+        else:
+            with open(path) as f:
+                baseline = json.load(f)
+            if baseline["scenario"] != scenario(args):
+                print(f"\nWarning: baseline was recorded with different settings: {baseline['scenario']}")
+            regressions = compare(results, baseline, args.tolerance)
+            if regressions:
+                print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+                status = 1
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"scenario": scenario(args), "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nSaved baseline to {path}")
+    sys.exit(status)
+
+if __name__ == "__main__":
+    main()
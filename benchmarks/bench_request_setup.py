@@ -0,0 +1,75 @@
+"""Per-request setup overhead of the chat endpoints (model settings and prompt assembly).
+
+Compares the current setup (shared ModelSpec prepared by the provider, precomputed preamble) against the
+pre-registry code path, which rebuilt the model settings and re-concatenated the system prompt on every request.
+Runs against the fake model provider (MODEL_PROVIDER=fake), so the GenerativeModel the old path also built
+per request is not measured; against google.generativeai, whose constructor normalizes safety settings and
+config into protos, the gains are larger than shown here.
+
+    python benchmarks/bench_request_setup.py --requests 50000
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["MODEL_PROVIDER"] = "fake"
+
+import app as chat_app  # noqa: E402
+
+def legacy_message_chat(session_id, category):
+    """The non-streaming setup as it was before the model registry and precomputed preambles."""
+    system_prompt = chat_app.ASSISTANT_CATEGORIES[category]["system_prompt"]
+    system_prompt += chat_app.MESSAGE_PROMPT_SUFFIXES.get(category, "")
+    system_prompt += chat_app.MESSAGE_PROMPT_FOOTER
+    generation_config = {"temperature": 0.7, "top_p": 0.95, "top_k": 40, "max_output_tokens": 8192}
+    safety_settings = [
+        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    ]
+    spec = chat_app.ModelSpec(chat_app.LATEST_GEMINI_MODEL, generation_config, safety_settings)
+    chat_app.provider.prepare(spec)
+    history = [
+        {"role": "user", "parts": [{"text": system_prompt}]},
+        {"role": "model", "parts": [{"text": chat_app.MESSAGE_ACKNOWLEDGEMENT}]},
+    ]
+    for msg in chat_app.session_store.get(session_id)["messages"][:-1]:
+        if msg["role"] == "user":
+            history.append({"role": "user", "parts": [{"text": msg["content"]}]})
+        elif msg["role"] == "assistant":
+            history.append({"role": "model", "parts": [{"text": msg["content"]}]})
+    return history
+
+def current_message_chat(session_id, category):
+    """What the message endpoint does before calling the provider: shared spec, cached history."""
+    chat_app.provider.prepare(chat_app.MESSAGE_SPEC)
+    session = chat_app.TurnSession(session_id, 0)  # The session's only message is the new user message
+    return chat_app.message_history(session, category)
+
+def bench(label, fn, session_id, requests):
+    started = time.perf_counter()
+    for _ in range(requests):
+        fn(session_id, "coding")
+    elapsed = time.perf_counter() - started
+    print(f"{label:<8} {elapsed / requests * 1e6:7.2f}us/request")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50000)
+    args = parser.parse_args()
+
+    session_id = str(uuid.uuid4())
+    chat_app.session_store.create({
+        "id": session_id, "title": "bench", "created_at": "", "category": "coding",
+        "messages": [{"id": "1", "role": "user", "content": "hello"}]
+    })
+    bench("before", legacy_message_chat, session_id, args.requests)
+    bench("after", current_message_chat, session_id, args.requests)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Throughput of the multi-process deployment (serve.py) from 1 to N workers.
+
+For each worker count, starts serve.py with the fake provider and a fresh shared SQLite
+store. It then drives the same load as bench_http_api.py: new chat -> --turns streams ->
+list -> get. Users are spread over several client processes so the load generator is not
+the bottleneck. Sessions are not pinned to workers: each request may land on any worker,
+which checks that state really is shared. Any request that fails counts as an error.
+
+Defaults make the server CPU-bound (short fake latency, instant generation), so throughput
+should grow with workers up to the number of free cores. On a machine with fewer cores than
+workers, the extra workers only add contention. Run the clients on another machine for
+clean numbers.
+
+    python benchmarks/bench_scaling.py --max-workers 4
+    python benchmarks/bench_scaling.py --workers 1,2,4,8 --server wsgi
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from bench_http_api import ROOT, User, free_port, percentile, start_server
+
+def run_clients(port, args, indices):
+    """One client process: runs the given users with --concurrency / --client-processes threads."""
+    threads = max(1, args.concurrency // args.client_processes)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        users = list(pool.map(lambda index: User(port, args, index).run(), indices))
+    return [user.samples for user in users], sum(user.errors for user in users)
+
+def measure(args, workers):
+    port = free_port()
+    command = [sys.executable, os.path.join(ROOT, "serve.py"), "--server", args.server,
+               "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port)]
+    server = start_server(args, port, command, WSGI_THREADS=str(args.concurrency))
+    try:
+        started = time.perf_counter()
+        shares = [range(start, args.users, args.client_processes) for start in range(args.client_processes)]
+        with ProcessPoolExecutor(max_workers=args.client_processes) as pool:
+            results = list(pool.map(run_clients, [port] * len(shares), [args] * len(shares), shares))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+    turns = [seconds for samples, _ in results for user in samples for name, seconds in user if name == "turn"]
+    return {
+        "workers": workers,
+        "streams_per_s": len(turns) / elapsed,
+        "turn_p50_ms": percentile(turns, 50) * 1000,
+        "turn_p95_ms": percentile(turns, 95) * 1000,
+        "errors": sum(errors for _, errors in results),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("asgi", "wsgi"), default="asgi")
+    parser.add_argument("--workers", help="comma-separated worker counts (default: 1..--max-workers)")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--users", type=int, default=400, help="simulated users per worker count")
+    parser.add_argument("--concurrency", type=int, default=64, help="users active at the same time")
+    parser.add_argument("--client-processes", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--mode", choices=("stream", "message"), default="stream")
+    parser.add_argument("--framing", choices=("legacy", "compact"), default="compact")
+    parser.add_argument("--latency-ms", type=float, default=5, help="fake provider time to first chunk")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="fake provider speed (0 = instant)")
+    parser.add_argument("--reply-tokens", type=int, default=200)
+    parser.add_argument("--workdir", default=os.environ.get("TMPDIR", "/tmp"), help="where the shared sqlite store is created")
+    args = parser.parse_args()
+    args.error_rate = 0.0
+    args.response_cache = "off"   # Distinct prompts anyway; keeps every turn on the model path
+    args.session_store = "sqlite"  # The only store all workers share
+
+    counts = [int(count) for count in args.workers.split(",")] if args.workers else range(1, args.max_workers + 1)
+    print(f"{args.server}: {args.users} users x {args.turns} turns, concurrency {args.concurrency}, "
+          f"{args.client_processes} client processes, {os.cpu_count()} CPUs")
+    print(f"{'workers':>7} {'streams/s':>10} {'speedup':>8} {'efficiency':>10} {'p50 ms':>8} {'p95 ms':>8} {'errors':>6}")
+    base = None  # (workers, streams/s) of the first run; speedup and efficiency are relative to it
+    for workers in counts:
+        result = measure(args, workers)
+        base = base or (workers, result["streams_per_s"])
+        speedup = result["streams_per_s"] / base[1]
+        efficiency = speedup * base[0] / workers
+        print(f"{workers:>7} {result['streams_per_s']:>10.1f} {speedup:>7.2f}x {efficiency:>10.0%} "
+              f"{result['turn_p50_ms']:>8.1f} {result['turn_p95_ms']:>8.1f} {result['errors']:>6}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Memory held by the in-memory session store per 100k messages.
+
+Fills a MemorySessionStore (no caps) with --sessions sessions of --messages messages each,
+shaped like the ones app.py records (uuid4 ids, ISO timestamps, categories on assistant
+replies). It reports the traced allocations per 100k messages, with and without the message
+text itself, and the time to serialize one session for GET /api/chat/<id>.
+
+    python benchmarks/bench_session_memory.py --sessions 1000 --messages 100
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_store import MemorySessionStore, as_dict  # noqa: E402
+
+CATEGORIES = ("general", "math", "coding", "philosophy")
+
+def make_message(index, content_chars):
+    message = {
+        "id": str(uuid.uuid4()),
+        "role": "user" if index % 2 == 0 else "assistant",
+        "content": f"{index:08d} " + "x" * max(0, content_chars - 9),
+        "timestamp": datetime.now().isoformat()
+    }
+    if index % 2:
+        message["category"] = CATEGORIES[index % len(CATEGORIES)]
+    return message
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=100, help="messages per session")
+    parser.add_argument("--content-chars", type=int, default=200)
+    args = parser.parse_args()
+
+    total = args.sessions * args.messages
+    tracemalloc.start()
+    store = MemorySessionStore()
+    for session_index in range(args.sessions):
+        session_id = str(uuid.uuid4())
+        store.create({
+            "id": session_id,
+            "title": f"Question {session_index}",
+            "created_at": datetime.now().isoformat(),
+            "messages": [],
+            "category": CATEGORIES[session_index % len(CATEGORIES)]
+        })
+        for index in range(args.messages):
+            store.append_message(session_id, make_message(index, args.content_chars))
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    content = total * sys.getsizeof("x" * args.content_chars)  # The message text itself, the same in any representation
+    per_100k = 100000 / total
+    print(f"{args.sessions} sessions x {args.messages} messages ({total} messages, {args.content_chars}-char content)")
+    print(f"  total               {held * per_100k / 2**20:8.1f} MB per 100k messages")
+    print(f"  excluding content   {(held - content) * per_100k / 2**20:8.1f} MB per 100k messages "
+          f"({(held - content) / total:.0f} bytes/message)")
+
+    started = time.perf_counter()
+    for _ in range(100):
+        json.dumps(as_dict(store.get(session_id)))
+    print(f"  GET serialization   {(time.perf_counter() - started) * 10:8.2f} ms per {args.messages}-message session")
+
+if __name__ == "__main__":
+    main()
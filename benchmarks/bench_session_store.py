@@ -0,0 +1,80 @@
+"""Read, append and listing latency of the session store backends at scale.
+
+"list all" is the old /api/chats (every summary, sorted per request); "page" is one
+?limit=50 page from the created_at index.
+
+    python benchmarks/bench_session_store.py --sessions 100000 --ops 20000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_store import MemorySessionStore, SQLiteSessionStore  # noqa: E402
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def make_message(role="user"):
+    return {
+        "id": str(uuid.uuid4()),
+        "role": role,
+        "content": "How do I reverse a linked list in Python? " * 4,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def populate(store, count, messages_per_session):
+    ids = []
+    for _ in range(count):
+        session_id = str(uuid.uuid4())
+        store.create({
+            "id": session_id,
+            "title": "New Chat",
+            "created_at": datetime.now().isoformat(),
+            "messages": [],
+            "category": "general"
+        })
+        for i in range(messages_per_session):
+            store.append_message(session_id, make_message("user" if i % 2 == 0 else "assistant"))
+        ids.append(session_id)
+    return ids
+
+def measure(label, fn, ids, ops):
+    samples = []
+    for _ in range(ops):
+        session_id = random.choice(ids)
+        started = time.perf_counter()
+        fn(session_id)
+        samples.append((time.perf_counter() - started) * 1e6)
+    print(f"  {label:<8} p50 {percentile(samples, 50):8.1f}us  p99 {percentile(samples, 99):8.1f}us")
+
+def run(name, store, args):
+    started = time.perf_counter()
+    ids = populate(store, args.sessions, args.messages)
+    print(f"{name}: populated {args.sessions} sessions x {args.messages} messages in {time.perf_counter() - started:.1f}s")
+    measure("get", store.get, ids, args.ops)
+    measure("append", lambda session_id: store.append_message(session_id, make_message()), ids, args.ops)
+    measure("list all", lambda _: sorted(store.list_sessions(), key=lambda x: x["created_at"], reverse=True),
+            ids, max(1, args.ops // 1000))
+    measure("page", lambda _: store.page_sessions(limit=50), ids, args.ops)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=4, help="messages per session before measuring")
+    parser.add_argument("--ops", type=int, default=20000, help="operations sampled per measurement")
+    args = parser.parse_args()
+
+    run("memory", MemorySessionStore(), args)
+    with tempfile.TemporaryDirectory() as tmp:
+        run("sqlite", SQLiteSessionStore(os.path.join(tmp, "sessions.db")), args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Bytes on the wire and frames per answer for the SSE framings of /api/chat/<id>/stream.
+
+Replies come from the fake model provider (MODEL_PROVIDER=fake).
+
+    python benchmarks/bench_sse_framing.py --chunks 200 --chunk-tokens 4
+"""
+import argparse
+import os
+import sys
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_http_api import fake_chunk_settings  # noqa: E402
+
+chat_app = None  # Imported by main() once the FAKE_* settings are in the environment
+
+def stream(client, body, accept_encoding=None):
+    session_id = client.post('/api/chat/new', json={}).get_json()["session_id"]
+    headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+    response = client.post(f'/api/chat/{session_id}/stream', json=body, headers=headers)
+    raw = response.get_data()
+    encoding = response.headers.get("Content-Encoding")
+    text = zlib.decompress(raw, wbits=47).decode() if encoding else raw.decode()
+    return len(raw), text.count("data: ")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=200, help="chunks per fake answer")
+    parser.add_argument("--chunk-tokens", type=int, default=4, help="words per chunk")
+    parser.add_argument("--chunk-delay", type=float, default=0.005, help="seconds between chunks")
+    args = parser.parse_args()
+
+    global chat_app
+    os.environ.update(fake_chunk_settings(args.chunks, args.chunk_delay, args.chunk_tokens))
+    import app as chat_app
+    chat_app.response_cache = None  # Every request must generate
+    answer_bytes = len("".join(chat_app.provider._plan("hi")[0]).encode())
+    client = chat_app.app.test_client()
+
+    print(f"answer: {answer_bytes} bytes in {args.chunks} chunks")
+    for label, body, accept in (
+        ("legacy", {"message": "hi"}, None),
+        ("compact", {"message": "hi", "framing": "compact"}, None),
+        ("compact+gzip", {"message": "hi", "framing": "compact"}, "gzip"),
+        ("compact+deflate", {"message": "hi", "framing": "compact"}, "deflate"),
+    ):
+        wire, frames = stream(client, body, accept)
+        print(f"{label:<16} {wire:8d} bytes on wire ({wire / answer_bytes:5.2f}x answer), {frames:4d} frames")
+
+if __name__ == "__main__":
+    main()
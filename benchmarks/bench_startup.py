@@ -0,0 +1,69 @@
+"""Cold-start cost of the server: time to import app.py and time until /api/ready reports ready.
+
+Each sample runs in a fresh interpreter, the way every gunicorn/uvicorn worker starts. With
+google.generativeai installed, the "eager" row reproduces the old import-time setup (configure +
+list_models before serving) on top of a lazy import, for comparison. Without it (or with --fake)
+the server runs on the fake model provider (MODEL_PROVIDER=fake), which measures the app's own
+import and warm-up; there is no SDK to configure, so the eager row is skipped.
+
+    python benchmarks/bench_startup.py --samples 5
+    python benchmarks/bench_startup.py --fake
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in the child interpreter; prints {"import": seconds, "ready": seconds} on its last line
+CHILD = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+if {eager!r}:
+    app.provider.client().list_models()
+while app.provider.state["status"] == "warming":
+    time.sleep(0.001)
+if app.provider.state["status"] == "cold":
+    app.provider.warm_up([app.STREAM_SPEC, app.MESSAGE_SPEC])
+print(json.dumps({{"import": imported, "ready": time.perf_counter() - started}}))
+"""
+
+def sdk_installed():
+    try:
+        return importlib.util.find_spec("google.generativeai") is not None
+    except ModuleNotFoundError:  # No google namespace package at all
+        return False
+
+def sample(mode, args):
+    env = dict(os.environ, GENAI_WARMUP="lazy" if mode == "eager" else mode, GENAI_LIST_MODELS="1" if mode != "lazy" else "")
+    if args.fake:
+        env["MODEL_PROVIDER"] = "fake"
+    code = CHILD.format(root=ROOT, eager=mode == "eager")
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--fake", action="store_true", help="use the fake model provider (the default when the SDK is not installed)")
+    args = parser.parse_args()
+    if not args.fake and not sdk_installed():
+        print("google.generativeai is not installed; using the fake model provider")
+        args.fake = True
+
+    print(f"{'mode':<11} {'import (ms)':>12} {'ready (ms)':>12}")
+    for mode in ("background", "lazy") if args.fake else ("eager", "background", "lazy"):
+        runs = [sample(mode, args) for _ in range(args.samples)]
+        imported = statistics.median(run["import"] for run in runs) * 1000
+        ready = statistics.median(run["ready"] for run in runs) * 1000
+        print(f"{mode:<11} {imported:12.1f} {ready:12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""First-load bytes and requests per second for the pages, served from static/ or from the build.
+
+For each mode, starts the server with the fake provider and loads --pages as a browser would.
+It fetches the page, then its local scripts, stylesheets and images, with
+"Accept-Encoding: gzip, deflate, br" and an Accept header that lists image/webp. It reports:
+
+    first load   requests and bytes on the wire (bodies, as sent) for an empty cache, and 404s
+    repeat load  requests and bytes when revisiting with that cache: immutable responses are not
+                 requested again, others are revalidated with If-None-Match / If-Modified-Since
+    req/s        throughput of --concurrency clients repeating first loads for --seconds
+
+Modes: "source" serves static/ as is (no build), "built" runs build_static.py first. CDN links
+(fonts, highlight.js, font-awesome) are external and not counted.
+
+    python benchmarks/bench_static.py --server asgi --concurrency 16
+"""
+import argparse
+import http.client
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_http_api import ROOT, free_port, start_server
+
+BROWSER_HEADERS = {
+    "Accept-Encoding": "gzip, deflate, br",
+    "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
+}
+SUBRESOURCE = re.compile(
+    r"""<(?:script|img)\b[^>]*\ssrc=["']([^"']+)["']|<link\b[^>]*rel=["']stylesheet["'][^>]*href=["']([^"']+)["']""")
+COMMENT = re.compile(r"<!--.*?-->", re.S)
+
+def get(conn, path, headers=None):
+    """(status, response headers, body bytes as sent)."""
+    conn.request("GET", path, headers=dict(BROWSER_HEADERS, **(headers or {})))
+    response = conn.getresponse()
+    return response.status, {key.lower(): value for key, value in response.getheaders()}, response.read()
+
+def page_text(headers, body):
+    encoding = headers.get("content-encoding")
+    if encoding == "gzip":
+        import gzip
+        body = gzip.decompress(body)
+    elif encoding == "br":
+        import brotli
+        body = brotli.decompress(body)
+    return body.decode("utf-8", errors="replace")
+
+def subresources(page, html):
+    """Local URL paths the page loads, resolved against the page's own path."""
+    base = page.rsplit("/", 1)[0] + "/"
+    paths = []
+    for match in SUBRESOURCE.finditer(COMMENT.sub("", html)):
+        link = match.group(1) or match.group(2)
+        if "://" in link or link.startswith(("data:", "//")):
+            continue
+        paths.append(link if link.startswith("/") else base + link)
+    return paths
+
+def first_load(conn, page):
+    """[(path, status, headers, bytes)] for the page and its subresources."""
+    status, headers, body = get(conn, page)
+    responses = [(page, status, headers, len(body))]
+    for path in subresources(page, page_text(headers, body)):
+        status, headers, body = get(conn, path)
+        responses.append((path, status, headers, len(body)))
+    return responses
+
+def repeat_load(conn, responses):
+    """(requests, bytes) of a revisit with the cache the first load left behind."""
+    requests = size = 0
+    for path, status, headers, _ in responses:
+        if status != 200 or "immutable" in headers.get("cache-control", ""):
+            continue
+        validators = {}
+        if "etag" in headers:
+            validators["If-None-Match"] = headers["etag"]
+        if "last-modified" in headers:
+            validators["If-Modified-Since"] = headers["last-modified"]
+        _, _, body = get(conn, path, validators)
+        requests += 1
+        size += len(body)
+    return requests, size
+
+def throughput(port, pages, concurrency, seconds):
+    deadline = time.monotonic() + seconds
+    counts = []
+    lock = threading.Lock()
+
+    def client(index):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        done = 0
+        while time.monotonic() < deadline:
+            done += len(first_load(conn, pages[index % len(pages)]))
+        conn.close()
+        with lock:
+            counts.append(done)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    return sum(counts) / seconds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--pages", default="/,/index.html", help="comma-separated; / is intro.html")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--workdir", default=os.environ.get("TMPDIR", "/tmp"))
+    args = parser.parse_args()
+    args.latency_ms, args.tokens_per_second, args.reply_tokens, args.error_rate = 0, 0, 0, 0.0
+    args.response_cache, args.session_store = "off", "memory"
+    pages = args.pages.split(",")
+
+    dist = tempfile.mkdtemp(prefix="bench_static_", dir=args.workdir)
+    subprocess.run([sys.executable, os.path.join(ROOT, "build_static.py"), "--dist-dir", dist],
+                   check=True, stdout=subprocess.DEVNULL)
+    print(f"{args.server}: concurrency {args.concurrency}, {args.seconds:.0f}s per mode")
+    print(f"{'mode':<7} {'page':<12} {'requests':>8} {'bytes':>8} {'404s':>5} {'repeat req':>10} {'repeat bytes':>12}")
+    for mode, dist_dir in (("source", os.path.join(dist, "missing")), ("built", dist)):
+        port = free_port()
+        server = start_server(args, port, STATIC_DIST_DIR=dist_dir)
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            for page in pages:
+                responses = first_load(conn, page)
+                missing = sum(status == 404 for _, status, _, _ in responses)
+                size = sum(length for _, status, _, length in responses if status == 200)
+                repeat_requests, repeat_size = repeat_load(conn, responses)
+                print(f"{mode:<7} {page:<12} {len(responses):>8} {size:>8} {missing:>5} {repeat_requests:>10} {repeat_size:>12}")
+            conn.close()
+            print(f"{mode:<7} {'req/s':<12} {throughput(port, pages, args.concurrency, args.seconds):>8.0f}")
+        finally:
+            server.terminate()
+            server.wait()
+    shutil.rmtree(dist, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
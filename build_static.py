@@ -0,0 +1,216 @@
+"""Static asset build: minified, fingerprinted, precompressed copies of static/ for serve_static.
+
+    python build_static.py    # static/ and the images at the repo root -> static_dist/
+
+What happens to each file:
+    JS, CSS  minified (rjsmin, rcssmin) and renamed to name.<hash>.ext
+    images   PNG/JPEG re-encoded with Pillow (kept only when smaller), plus a WebP version
+             (lossless or quality 85, whichever is smaller), renamed to name.<hash>.ext
+    HTML     local src/href references rewritten to the fingerprinted names; pages keep their names
+    text     .br (brotli, quality 11) and .gz (gzip -9) variants, kept when smaller
+
+The images at the repo root (RMH.png, AI-RMH.png, ...) are published at the site root. That is
+where intro.html links them. static_dist/manifest.json lists every asset and its variants for
+static_assets.py. A build older than its sources is ignored, and the dev server (python app.py)
+never uses one. serve.py runs the build when it is missing or stale. If an optional tool (brotli,
+Pillow, rjsmin, rcssmin) is not installed, its step is skipped with a warning.
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import time
+
+from static_assets import MANIFEST_NAME, ROOT, STATIC_DIST_DIR
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+STATIC_DIR = os.path.join(ROOT, "static")
+TEXT_TYPES = {".html", ".css", ".js", ".svg", ".json", ".txt"}
+IMAGE_TYPES = {".png", ".jpg", ".jpeg"}
+REFERENCE = re.compile(r"""(\b(?:src|href)=["'])([^"'#?:]+)(["'])""")  # Local links only: no scheme, fragment or query
+WEBP_QUALITY = 85
+
+_missing = set()  # Optional tools already reported missing
+
+def optional(module_name):
+    """Imports an optional build tool, or returns None (warning once) when it is not installed."""
+    try:
+        return __import__(module_name)
+    except ImportError:
+        if module_name not in _missing:
+            _missing.add(module_name)
+            logging.warning(f"{module_name} is not installed; skipping the steps that need it (pip install -r requirements.txt)")
+        return None
+
+def source_files(static_dir=STATIC_DIR, root=ROOT):
+    """(URL path, source file) for everything the build publishes."""
+    sources = {}
+    for directory, dirnames, filenames in os.walk(static_dir):
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith("."))
+        for filename in sorted(filenames):
+            if not filename.startswith("."):
+                path = os.path.join(directory, filename)
+                sources[os.path.relpath(path, static_dir).replace(os.sep, "/")] = path
+    for filename in sorted(os.listdir(root)):  # Images at the repo root, linked from the pages as /<name>
+        if os.path.splitext(filename)[1].lower() in IMAGE_TYPES:
+            sources.setdefault(filename, os.path.join(root, filename))
+    return sources
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+def fingerprinted(path, digest):
+    base, ext = posixpath.splitext(path)
+    return f"{base}.{digest}{ext}"
+
+def minify(path, data):
+    """Minified JS or CSS (unchanged when the minifier is not installed)."""
+    ext = posixpath.splitext(path)[1]
+    if ext == ".js":
+        rjsmin = optional("rjsmin")
+        return rjsmin.jsmin(data.decode("utf-8")).encode("utf-8") if rjsmin else data
+    if ext == ".css":
+        rcssmin = optional("rcssmin")
+        return rcssmin.cssmin(data.decode("utf-8")).encode("utf-8") if rcssmin else data
+    return data
+
+def optimize_image(data):
+    """(re-encoded image, WebP version or None), each only used when smaller than what it replaces."""
+    pil = optional("PIL")
+    if pil is None:
+        return data, None
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    out = io.BytesIO()
+    if image.format == "PNG":
+        image.save(out, "PNG", optimize=True)
+    else:
+        image.save(out, "JPEG", quality=WEBP_QUALITY, optimize=True, progressive=True)
+    optimized = out.getvalue() if out.tell() < len(data) else data
+
+    candidates = []
+    for options in ({"lossless": True}, {"quality": WEBP_QUALITY}):
+        out = io.BytesIO()
+        image.save(out, "WEBP", method=6, **options)
+        candidates.append(out.getvalue())
+    webp = min(candidates, key=len)
+    return optimized, webp if len(webp) < len(optimized) else None
+
+def compress(data):
+    """Precompressed variants of a text asset, each kept only when smaller than the original."""
+    variants = {}
+    brotli = optional("brotli")
+    if brotli:
+        variants["br"] = brotli.compress(data, quality=11)
+    variants["gzip"] = gzip.compress(data, compresslevel=9, mtime=0)  # mtime=0: identical bytes for identical input
+    return {name: body for name, body in variants.items() if len(body) < len(data)}
+
+def rewrite_references(page, html, paths):
+    """Points the page's local src/href links at the fingerprinted names in paths (URL path -> built path)."""
+    directory = posixpath.dirname(page)
+
+    def replace(match):
+        link = match.group(2)
+        target = posixpath.normpath(link.lstrip("/") if link.startswith("/") else posixpath.join(directory, link))
+        if target not in paths:
+            return match.group(0)
+        built = "/" + paths[target] if link.startswith("/") else posixpath.relpath(paths[target], directory or ".")
+        return match.group(1) + built + match.group(3)
+
+    return REFERENCE.sub(replace, html)
+
+def content_type(path):
+    guessed = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return f"{guessed}; charset=utf-8" if posixpath.splitext(path)[1] in TEXT_TYPES else guessed
+
+def build(static_dir=STATIC_DIR, dist_dir=STATIC_DIST_DIR, root=ROOT):
+    """Builds static_dir into dist_dir (replacing it) and returns the manifest."""
+    sources = source_files(static_dir, root)
+    assets, paths, pages = {}, {}, []
+    for path, source in sources.items():
+        with open(source, "rb") as f:
+            data = f.read()
+        ext = posixpath.splitext(path)[1].lower()
+        if ext == ".html":
+            pages.append((path, data))  # After everything they link to has its final name
+            continue
+        files = {"identity": minify(path, data)}
+        if ext in IMAGE_TYPES:
+            files["identity"], webp = optimize_image(data)
+            if webp:
+                files["webp"] = webp
+        elif ext in TEXT_TYPES:
+            files.update(compress(files["identity"]))
+        digest = fingerprint(files["identity"])
+        paths[path] = fingerprinted(path, digest)
+        assets[path] = {"path": paths[path], "hash": digest, "type": content_type(path), "original": len(data), "data": files}
+
+    for path, data in pages:
+        html = rewrite_references(path, data.decode("utf-8"), paths).encode("utf-8")
+        files = {"identity": html, **compress(html)}
+        assets[path] = {"path": path, "hash": fingerprint(html), "type": content_type(path), "original": len(data), "data": files}
+
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    suffixes = {"identity": "", "br": ".br", "gzip": ".gz", "webp": ".webp"}
+    for entry in assets.values():
+        entry["files"], entry["sizes"] = {}, {}
+        for name, body in entry.pop("data").items():
+            relative = entry["path"] + suffixes[name]
+            target = os.path.join(dist_dir, *relative.split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(body)
+            entry["files"][name] = relative
+            entry["sizes"][name] = len(body)
+
+    manifest = {
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sources": sorted(os.path.relpath(source, root).replace(os.sep, "/") for source in sources.values()),
+        "assets": assets,
+    }
+    with open(os.path.join(dist_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+def needs_build(static_dir=STATIC_DIR, dist_dir=STATIC_DIST_DIR, root=ROOT):
+    """Whether dist_dir is missing, or a source was added, removed or changed since it was built."""
+    try:
+        with open(os.path.join(dist_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+        built_at = os.path.getmtime(os.path.join(dist_dir, MANIFEST_NAME))
+    except (OSError, ValueError):
+        return True
+    sources = source_files(static_dir, root).values()
+    if sorted(os.path.relpath(source, root).replace(os.sep, "/") for source in sources) != manifest.get("sources"):
+        return True
+    return any(os.path.getmtime(source) > built_at for source in sources)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--static-dir", default=STATIC_DIR)
+    parser.add_argument("--dist-dir", default=STATIC_DIST_DIR)
+    args = parser.parse_args()
+
+    manifest = build(args.static_dir, args.dist_dir)
+    print(f"{'asset':<34} {'source':>8} {'built':>8} {'br':>8} {'gzip':>8} {'webp':>8}")
+    totals = [0, 0]
+    for path, entry in sorted(manifest["assets"].items()):
+        sizes = entry["sizes"]
+        cells = " ".join(f"{sizes[name]:>8}" if name in sizes else f"{'-':>8}" for name in ("br", "gzip", "webp"))
+        print(f"{entry['path']:<34} {entry['original']:>8} {sizes['identity']:>8} {cells}")
+        totals[0] += entry["original"]
+        totals[1] += min(sizes.values())
+    print(f"{len(manifest['assets'])} assets: {totals[0]} bytes of sources, {totals[1]} bytes smallest variants, in {args.dist_dir}")
+
+if __name__ == "__main__":
+    main()
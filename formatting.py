@@ -0,0 +1,242 @@
+"""Server-side formatting of Gemini responses (code fences and language hints)."""
+import re
+
+BACKTICKS = re.compile(r"`*")
+WHITESPACE = re.compile(r"\s*")
+ALNUM = re.compile(r"[a-zA-Z0-9]*")
+FENCE_INFO = re.compile(r"[^\S\n]*([^\s`]*)[^\S\n]*")  # Language word of an opening fence line
+
+def detect_language(code):
+    """Function to determine probable language based on code content."""
+    code = code.lower()
+    if "def " in code or "import " in code or "print(" in code or "class " in code:
+        return "python"
+    elif "function" in code or "const " in code or "let " in code or "var " in code or "=>" in code:
+        return "javascript"
+    elif "<html" in code or "<div" in code or "<body" in code or "<script" in code:
+        return "html"
+    elif "public class" in code or "public static void" in code or "import java" in code:
+        return "java"
+    elif "#include" in code or "int main" in code:
+        return "cpp"
+    elif "<?php" in code:
+        return "php"
+    elif "using namespace" in code or "std::" in code:
+        return "cpp"
+    elif "func " in code:
+        return "go"
+    elif "fn " in code or "let mut" in code:
+        return "rust"
+    upper = code.upper()  # Uppercased once for all SQL keywords
+    if "SELECT " in upper or "FROM " in upper or "WHERE " in upper:
+        return "sql"
+    return "plaintext"
+
+def fence_runs(text):
+    """(start, end) of every run of three or more backticks - the only places format_code_blocks changes."""
+    runs = []
+    start = text.find("```")
+    while start != -1:
+        end = BACKTICKS.match(text, start + 3).end()
+        runs.append((start, end))
+        start = text.find("```", end)
+    return runs
+
+def format_code_blocks(text):
+    """Ensures code blocks are properly formatted with language specification and consistent structure.
+
+    Single scan over the fence runs of the text. The output is identical to the original four
+    re.sub passes, which (in order) did:
+      1. "```<ws>\\n"          -> "```<detected language>\\n"   (language from the text up to the next fence)
+      2. "<char>```"           -> "<char>\\n```"                (newline before fences)
+      3. "```<alnum><char>"    -> "```<alnum>\\n<char>"
+      4. "```<alnum>" at EOL   -> "```<alnum>\\n"
+    Only backtick runs and the few characters around them are touched; the text in between is
+    copied as whole slices.
+    """
+    runs = fence_runs(text)
+    if not runs:
+        return text
+
+    out = []
+    pos = 0  # Everything before pos has been emitted
+    for index, (start, end) in enumerate(runs):
+        next_start = runs[index + 1][0] if index + 1 < len(runs) else -1
+        out.append(text[pos:start])
+
+        # Pass 2: newline before the run (unless it follows a newline or starts the text), then
+        # every fourth backtick when the run is long enough to hold further fences.
+        length = end - start
+        if start > 0 and text[start - 1] != "\n":
+            out.append("\n")
+            split = 3
+        else:
+            split = 0
+        if split <= length - 4:
+            cut = start
+            while split <= length - 4:
+                out.append(text[cut:start + split + 1])
+                out.append("\n")
+                cut = start + split + 1
+                split += 4
+            out.append(text[cut:end])
+        else:
+            out.append(text[start:end])
+        pos = end
+
+        # Pass 1: a fence followed by whitespace up to a newline gets a detected language,
+        # provided another fence follows to delimit the code.
+        whitespace_end = WHITESPACE.match(text, end).end()
+        newline = text.rfind("\n", end, whitespace_end)
+        if newline != -1 and next_start != -1:
+            code_start = newline + 1
+            word = detect_language(text[code_start:next_start])
+            after = tail = "\n"  # The newline that ends the replaced "```<ws>\n"
+            pos = code_start
+        else:
+            # Passes 3/4 then act on the alphanumeric word that directly follows the run
+            word_end = ALNUM.match(text, end).end()
+            word = text[end:word_end]
+            if word_end == len(text):
+                after = ""
+            elif word_end == next_start:
+                after = "\n"  # Newline inserted before the next run by pass 2
+            else:
+                after = text[word_end]
+            tail = ""
+            pos = word_end
+
+        # Passes 3 and 4 together: "```<word><after>" gains newlines depending on what follows the word
+        if word:
+            if after and after != "\n":
+                out.append(word + "\n\n")
+            elif len(word) >= 2:
+                out.append(word[:-1] + "\n\n" + word[-1])
+            else:
+                out.append(word + "\n")
+        out.append(tail)
+
+    out.append(text[pos:])
+    return "".join(out)
+
+class StreamingFormatter:
+    """Incremental code-fence formatter for streamed responses.
+
+    Feed raw model chunks in order; feed() returns the formatted text that can no longer change and
+    finish() returns the rest, so the concatenated output is the complete formatted response and no
+    final pass over it is needed. State carries across chunks, so a fence split over several chunks
+    is handled like one that arrives whole. Only the undecided tail is held back:
+      - a backtick run that may continue in the next chunk,
+      - an opening fence line until its newline arrives (for the language),
+      - a fence without a language until its block closes or LANGUAGE_HOLD_CHARS of code have arrived.
+
+    Formatting rules: fences start on their own line, the opening fence's first word is the language
+    (detected from the code when missing) followed by a newline, and text after a closing fence moves
+    to the next line.
+    """
+
+    LANGUAGE_HOLD_CHARS = 400  # Code to collect before guessing the language of a bare fence
+    MAX_INFO_CHARS = 200       # Longest opening fence line to wait for
+
+    def __init__(self):
+        self.pending = ""          # Raw input not processed yet
+        self.in_code = False
+        self.line_blank = True     # Output line so far holds only whitespace
+        self.after_fence = False   # A closing fence was just written
+        self.held = None           # (fence, code pieces) while the language of a bare fence is unknown
+        self.held_chars = 0
+
+    def feed(self, chunk):
+        """Consumes a raw chunk and returns the newly finished formatted text (possibly empty)."""
+        self.pending += chunk
+        return self._drain(final=False)
+
+    def finish(self):
+        """Flushes everything still held back at the end of the stream."""
+        out = self._drain(final=True)
+        if self.held is not None:
+            out += self._release()
+        return out
+
+    def _write(self, out, text):
+        if not text:
+            return
+        if self.held is not None:
+            self.held[1].append(text)
+            self.held_chars += len(text)
+        else:
+            out.append(text)
+        newline = text.rfind("\n")
+        tail = text[newline + 1:]
+        self.line_blank = (newline != -1 or self.line_blank) and not tail.strip()
+
+    def _release(self):
+        fence, code = self.held
+        self.held = None
+        self.held_chars = 0
+        code = "".join(code)
+        return fence + detect_language(code) + "\n" + code
+
+    def _drain(self, final):
+        out = []
+        text = self.pending
+        length = len(text)
+        i = 0
+        while i < length:
+            if self.after_fence:  # Text on the closing fence's line moves to its own line
+                if not text[i].isspace():
+                    self._write(out, "\n")
+                self.after_fence = False
+
+            tick = text.find("`", i)
+            if tick == -1:
+                self._write(out, text[i:])
+                i = length
+                break
+            self._write(out, text[i:tick])
+            i = tick
+
+            run_end = BACKTICKS.match(text, i).end()
+            if run_end == length and not final:
+                break  # The run may continue in the next chunk
+            run = text[i:run_end]
+            if len(run) < 3:
+                self._write(out, run)
+                i = run_end
+                continue
+
+            if self.in_code:  # Closing fence
+                if self.held is not None:
+                    out.append(self._release())
+                if not self.line_blank:
+                    self._write(out, "\n")
+                self._write(out, run)
+                self.in_code = False
+                self.after_fence = True
+                i = run_end
+                continue
+
+            # Opening fence: the rest of its line carries the language
+            newline = text.find("\n", run_end)
+            if newline == -1:
+                if not final and length - run_end < self.MAX_INFO_CHARS:
+                    break
+                newline = length
+            info = FENCE_INFO.match(text, run_end, newline)
+            language = info.group(1)
+
+            if not self.line_blank:
+                self._write(out, "\n")
+            self.in_code = True
+            if language:
+                self._write(out, run + language + "\n")
+            else:
+                self.held = (run, [])
+                self.line_blank = True
+            # Code written on the fence line continues on the next one
+            i = newline + 1 if info.end() == newline and newline < length else info.end()
+
+        if self.held is not None and self.held_chars >= self.LANGUAGE_HOLD_CHARS:
+            out.append(self._release())
+        self.pending = text[i:]
+        return "".join(out)
@@ -0,0 +1,111 @@
+"""Incrementally encoded, size-bounded chat history for Gemini requests.
+
+Each session keeps the turns it has already converted to the {"role", "parts"} shape the SDK
+expects. On a new turn only the messages appended since the previous request are read from the
+session store and encoded, and the oldest turns are dropped once the history exceeds its
+character budget, so building a request costs the same on the 200th turn as on the 2nd. A session
+not cached yet is read backwards a page at a time, only until the budget is full.
+"""
+import threading
+from collections import OrderedDict, deque
+
+# Session message role -> Gemini content role
+GEMINI_ROLES = {"user": "user", "assistant": "model"}
+COLD_READ_PAGE = 32  # Messages per read when a session's history is not cached yet
+
+class EncodedHistory:
+    """Encoded turns of one session that fit in the budget."""
+
+    __slots__ = ("turns", "chars", "encoded_count")
+
+    def __init__(self):
+        self.turns = deque()    # (encoded turn, character count), oldest first
+        self.chars = 0
+        self.encoded_count = 0  # how many session messages have been looked at
+
+class HistoryCache:
+    """Per-session cache of encoded history turns with a character/turn budget."""
+
+    def __init__(self, char_budget=None, max_turns=None, max_sessions=10000):
+        self.char_budget = char_budget
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> EncodedHistory, least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _trim(self, history):
+        """Drops the oldest turns until the budget holds and the history starts with a user turn."""
+        turns = history.turns
+        while turns and (
+            (self.char_budget and history.chars > self.char_budget)
+            or (self.max_turns and len(turns) > self.max_turns)
+            or turns[0][0]["role"] != "user"
+        ):
+            history.chars -= turns.popleft()[1]
+
+    def _budget_start(self, messages, end):
+        """Index of the oldest message that can still fit, so a cold cache never encodes the whole session."""
+        start = end
+        chars = 0
+        while start > 0:
+            chars += len(messages[start - 1]["content"])
+            if (self.char_budget and chars > self.char_budget) or (self.max_turns and end - start >= self.max_turns):
+                break
+            start -= 1
+        return start
+
+    def _read_tail(self, end, read):
+        """(start, messages[start:end]) for a cold cache: pages read newest first until the budget is exceeded."""
+        start, messages, chars = end, [], 0
+        floor = max(0, end - self.max_turns) if self.max_turns else 0
+        while start > floor and not (self.char_budget and chars > self.char_budget):
+            page_start = max(floor, start - COLD_READ_PAGE)
+            page = read(page_start, start)
+            messages[:0] = page
+            chars += sum(len(msg["content"]) for msg in page)
+            start = page_start
+        return start, messages
+
+    def turns(self, session_id, end, read):
+        """Returns the encoded turns for the session's first end messages, encoding only what is new since the last call.
+
+        read(start, stop) returns the session's messages[start:stop]. Only the messages not encoded
+        yet are read (on a cold cache, only as far back as the budget reaches), and the reads happen
+        outside the lock.
+        """
+        with self._lock:
+            history = self._sessions.get(session_id)
+            if history is not None and history.encoded_count > end:  # History rewound
+                history = None
+        if history is not None:
+            start = history.encoded_count
+            messages = read(start, end)
+        else:
+            start, messages = self._read_tail(end, read)
+
+        with self._lock:
+            if history is None or self._sessions.get(session_id) is not history or not start <= history.encoded_count <= end:
+                # First request in this process, or changed by a concurrent turn since the read: start from what was read
+                history = EncodedHistory()
+                history.encoded_count = start + self._budget_start(messages, len(messages))
+                self._sessions[session_id] = history
+                if self.max_sessions and len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(session_id)
+
+            for msg in messages[history.encoded_count - start:]:
+                role = GEMINI_ROLES.get(msg["role"])
+                if role:
+                    history.turns.append(({"role": role, "parts": [{"text": msg["content"]}]}, len(msg["content"])))
+                    history.chars += len(msg["content"])
+            history.encoded_count = start + len(messages)
+            self._trim(history)
+            return [turn for turn, _ in history.turns]
+
+    def discard(self, session_id):
+        """Forgets a session (e.g. after it is deleted)."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
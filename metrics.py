@@ -0,0 +1,228 @@
+"""In-process metrics in the Prometheus text format, plus an opt-in sampling profiler for slow requests.
+
+Counters, gauges and histograms are plain objects guarded by a lock; recording a value costs a dict
+lookup and an addition, so they can sit on the per-chunk hot path. Every worker process has its own
+registry: scrape each worker, or aggregate in Prometheus.
+
+Profiler (off unless PROFILE_SAMPLE_RATE > 0): a sampled fraction of chat requests get a thread that
+records the request thread's stack every PROFILE_INTERVAL_MS. Requests slower than PROFILE_SLOW_MS
+write the samples in collapsed-stack format (for flamegraph.pl / speedscope) to PROFILE_DIR.
+"""
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StackCounts
+from datetime import datetime
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # Fraction of chat requests to profile
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "2000"))        # Only profiles of slower requests are kept
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Latency buckets in seconds, from sub-millisecond bookkeeping to long generations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def format_labels(names, values, le=None):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if le is not None:  # Histogram bucket bound
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    """Values keyed by label values, rendered as one Prometheus metric family."""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        if not self.labels and self.kind in ("counter", "gauge"):
+            self._values[()] = 0  # Unlabelled series are exported from the start
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {value:g}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+class CallbackGauge(Metric):
+    """Gauge whose value is read from a function at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn):
+        super().__init__(name, help_text)
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logging.warning(f"Could not collect metric {self.name}: {str(e)}")
+            return []
+        return self.header() + [f"{self.name} {value:g}"]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]  # bucket counts, sum, count
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {total:g}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+class Registry:
+    """Collection of metrics rendered together by /metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self.register(Gauge(name, help_text, labels))
+
+    def callback_gauge(self, name, help_text, fn):
+        return self.register(CallbackGauge(name, help_text, fn))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class PhaseTimer:
+    """Times the consecutive phases of one request into a histogram labelled (endpoint, phase)."""
+
+    __slots__ = ("histogram", "endpoint", "started", "last")
+
+    def __init__(self, histogram, endpoint):
+        self.histogram = histogram
+        self.endpoint = endpoint
+        self.started = self.last = time.perf_counter()
+
+    def mark(self, phase):
+        """Records the time since the previous mark as phase."""
+        now = time.perf_counter()
+        self.histogram.observe(now - self.last, self.endpoint, phase)
+        self.last = now
+
+    def add(self, phase, seconds):
+        """Records a duration measured elsewhere (e.g. accumulated over all chunks)."""
+        self.histogram.observe(seconds, self.endpoint, phase)
+
+    def finish(self):
+        """Records the whole request as phase "total" and returns its duration."""
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(elapsed, self.endpoint, "total")
+        return elapsed
+
+class StackSampler:
+    """Samples one thread's stack at a fixed interval until stopped."""
+
+    def __init__(self, label, thread_id, interval):
+        self.label = label
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = StackCounts()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{label}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self, elapsed):
+        """Stops sampling; writes the collapsed stacks if the request took at least PROFILE_SLOW_MS."""
+        self._stop.set()
+        self._thread.join()
+        if elapsed * 1000 < PROFILE_SLOW_MS or not self.stacks:
+            return None
+        path = os.path.join(PROFILE_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{self.label}.folded")
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(path, "w") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:  # Profiling must never break the request
+            logging.warning(f"Could not write profile {path}: {str(e)}")
+            return None
+        logging.warning(f"Slow request {self.label} took {elapsed * 1000:.0f}ms; profile written to {path}")
+        return path
+
+def start_profile(label):
+    """Starts a StackSampler on the current thread for a PROFILE_SAMPLE_RATE fraction of calls, else None."""
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    return StackSampler(label, threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+
+REGISTRY = Registry()
@@ -0,0 +1,289 @@
+"""Model providers: where the chat endpoints get their replies from.
+
+Every provider offers the same four calls, each taking a ModelSpec, the encoded history turns
+({"role", "parts"} dicts, system preamble first) and the new user message:
+
+    generate(spec, history, message)        -> reply text
+    stream(spec, history, message)          -> iterator of text chunks
+    generate_async(spec, history, message)  -> awaitable reply text
+    stream_async(spec, history, message)    -> async iterator of text chunks
+
+Providers (MODEL_PROVIDER):
+    gemini  - google.generativeai, imported and configured on first use or by a background warm-up
+    fake    - deterministic local replies with configurable latency, speed, chunking and error rate,
+              for load tests and benchmarks without network or API quota
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+# Set GENAI_LIST_MODELS=1 to log the available models during warm-up (costs a network round-trip)
+GENAI_LIST_MODELS = os.getenv("GENAI_LIST_MODELS", "") == "1"
+
+class ProviderError(Exception):
+    """A provider failed to produce a reply; transient errors (quota, overload) are worth retrying."""
+
+    def __init__(self, message, transient=False):
+        super().__init__(message)
+        self.transient = transient
+
+def freeze(value):
+    """Turns nested dicts/lists into a hashable key."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def model_key(model_name, generation_config=None, safety_settings=None):
+    """Hashable registry key for a model configuration."""
+    return (model_name, freeze(generation_config), freeze(safety_settings))
+
+class ModelSpec:
+    """Model name and settings for one endpoint, with its registry key computed once."""
+
+    __slots__ = ("model_name", "generation_config", "safety_settings", "send_config", "key")
+
+    def __init__(self, model_name, generation_config=None, safety_settings=None, send_config=None):
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.safety_settings = safety_settings
+        self.send_config = send_config  # Per-message generation_config override
+        self.key = model_key(model_name, generation_config, safety_settings)
+
+class Provider:
+    """Interface every provider implements, plus the warm-up state reported by /api/ready."""
+
+    name = "base"
+
+    def __init__(self):
+        self.state = {"status": "cold", "error": None, "ready_at": None}  # cold | warming | ready | failed
+
+    def mark_ready(self):
+        self.state.update(status="ready", error=None, ready_at=datetime.now().isoformat())
+
+    def warm_up(self, specs):
+        """Prepares whatever the first request would otherwise set up."""
+        self.mark_ready()
+
+    def start_warm_up(self, specs):
+        """Runs warm_up in a daemon thread so startup never waits for it."""
+        self.state["status"] = "warming"
+        threading.Thread(target=self.warm_up, args=(specs,), name=f"{self.name}-warmup", daemon=True).start()
+
+    def prepare(self, spec):
+        """Sets up whatever a request for spec needs before the call (a no-op unless overridden)."""
+
+    def generate(self, spec, history, message):
+        raise NotImplementedError
+
+    def stream(self, spec, history, message):
+        raise NotImplementedError
+
+    async def generate_async(self, spec, history, message):
+        raise NotImplementedError
+
+    async def stream_async(self, spec, history, message):
+        raise NotImplementedError
+
+class GeminiProvider(Provider):
+    """Google Gemini through google.generativeai, with one shared GenerativeModel per configuration."""
+
+    name = "gemini"
+
+    def __init__(self, api_key):
+        super().__init__()
+        self.api_key = api_key
+        self._client = None  # google.generativeai, imported on first use by client()
+        self._client_lock = threading.Lock()
+        self.models = {}  # model_key -> GenerativeModel
+        self._models_lock = threading.Lock()
+
+    def client(self):
+        """Imports and configures the Generative AI client on first use."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:  # Double-checked so the warm-up thread and a first request import it only once
+                    try:
+                        import google.generativeai as client
+                        client.configure(api_key=self.api_key)
+                    except Exception as e:
+                        logging.error(f"Failed to configure Google Generative AI client: {str(e)}")
+                        self.state.update(status="failed", error=str(e))
+                        raise
+                    logging.info("Successfully configured Google Generative AI client")
+                    self._client = client
+                    self.mark_ready()
+        return self._client
+
+    def model(self, spec):
+        """Returns the shared GenerativeModel for this spec, creating it on first use."""
+        model = self.models.get(spec.key)
+        if model is None:
+            with self._models_lock:
+                model = self.models.get(spec.key)
+                if model is None:  # Double-checked so concurrent first requests build only one model
+                    model = self.client().GenerativeModel(
+                        model_name=spec.model_name,
+                        generation_config=spec.generation_config,
+                        safety_settings=spec.safety_settings
+                    )
+                    self.models[spec.key] = model
+        return model
+
+    def prepare(self, spec):
+        self.model(spec)
+
+    def warm_up(self, specs):
+        """Configures the client and builds the shared models ahead of the first request."""
+        try:
+            for spec in specs:
+                self.model(spec)
+        except Exception:
+            return  # Already logged and recorded in state; requests retry on first use
+        if GENAI_LIST_MODELS:  # List available models for debugging
+            try:
+                available_models = self._client.list_models()
+                logging.debug("Available models: %s", [model.name for model in available_models])  # Debug level logging
+            except Exception as model_error:
+                logging.warning(f"Could not list models: {str(model_error)}")
+
+    def _send_kwargs(self, spec):
+        return {"generation_config": spec.send_config} if spec.send_config else {}
+
+    def generate(self, spec, history, message):
+        chat = self.model(spec).start_chat(history=history)
+        response = chat.send_message(message, **self._send_kwargs(spec))
+        return response.text if hasattr(response, 'text') else None
+
+    def stream(self, spec, history, message):
+        chat = self.model(spec).start_chat(history=history)
+        for chunk in chat.send_message(message, stream=True, **self._send_kwargs(spec)):
+            if hasattr(chunk, 'text') and chunk.text:  # Standard format in current API
+                yield chunk.text
+            else:
+                logging.debug(f"Could not extract text from chunk: {chunk}")
+
+    async def generate_async(self, spec, history, message):
+        chat = self.model(spec).start_chat(history=history)
+        response = await chat.send_message_async(message, **self._send_kwargs(spec))
+        return response.text if hasattr(response, 'text') else None
+
+    async def stream_async(self, spec, history, message):
+        chat = self.model(spec).start_chat(history=history)
+        response = await chat.send_message_async(message, stream=True, **self._send_kwargs(spec))
+        async for chunk in response:
+            if hasattr(chunk, 'text') and chunk.text:
+                yield chunk.text
+            else:
+                logging.debug(f"Could not extract text from chunk: {chunk}")
+
+class FakeProvider(Provider):
+    """Deterministic local provider for load testing.
+
+    The reply text depends only on the prompt (so the response cache behaves as in production);
+    which requests fail is drawn from a generator seeded with seed, so a run is reproducible.
+    """
+
+    name = "fake"
+    WORDS = (
+        "the", "model", "returns", "a", "streamed", "answer", "with", "some", "code", "and", "prose",
+        "latency", "tokens", "per", "second", "chunk", "session", "history", "cache", "request"
+    )
+
+    def __init__(self, latency=0.2, tokens_per_second=100.0, chunk_tokens=(1, 8), reply_tokens=200,
+                 error_rate=0.0, seed=0):
+        super().__init__()
+        self.latency = latency                      # Seconds before the first chunk
+        self.tokens_per_second = tokens_per_second  # Generation speed after the first chunk (0 = instant)
+        self.chunk_tokens = chunk_tokens            # (min, max) tokens per streamed chunk
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate                # Fraction of requests that fail with a transient error (mid-stream when streaming)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _plan(self, message):
+        """(chunks, index of the chunk before which the request fails or None) for one request."""
+        rng = random.Random(hashlib.sha256(message.encode()).digest())
+        chunks = []
+        remaining = self.reply_tokens
+        written = 0
+        while remaining > 0:
+            count = min(remaining, rng.randint(*self.chunk_tokens))
+            words = []
+            for _ in range(count):
+                written += 1
+                words.append(rng.choice(self.WORDS) + ("\n" if written % 16 == 0 else " "))
+            chunks.append("".join(words))
+            remaining -= count
+        with self._lock:
+            fails = self._random.random() < self.error_rate
+            fail_at = self._random.randrange(len(chunks) + 1) if fails else None
+        return chunks, fail_at
+
+    def _delay(self, tokens):
+        return tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _tokens(self, chunk):
+        return chunk.count(" ") + chunk.count("\n")
+
+    def generate(self, spec, history, message):
+        chunks, fail_at = self._plan(message)
+        time.sleep(self.latency + self._delay(self.reply_tokens))
+        if fail_at is not None:
+            raise ProviderError("Fake provider error", transient=True)
+        return "".join(chunks)
+
+    def stream(self, spec, history, message):
+        chunks, fail_at = self._plan(message)
+        time.sleep(self.latency)
+        for index, chunk in enumerate(chunks):
+            if index == fail_at:
+                raise ProviderError("Fake provider error", transient=True)
+            if index:
+                time.sleep(self._delay(self._tokens(chunk)))
+            yield chunk
+        if fail_at == len(chunks):
+            raise ProviderError("Fake provider error", transient=True)
+
+    async def generate_async(self, spec, history, message):
+        chunks, fail_at = self._plan(message)
+        await asyncio.sleep(self.latency + self._delay(self.reply_tokens))
+        if fail_at is not None:
+            raise ProviderError("Fake provider error", transient=True)
+        return "".join(chunks)
+
+    async def stream_async(self, spec, history, message):
+        chunks, fail_at = self._plan(message)
+        await asyncio.sleep(self.latency)
+        for index, chunk in enumerate(chunks):
+            if index == fail_at:
+                raise ProviderError("Fake provider error", transient=True)
+            if index:
+                await asyncio.sleep(self._delay(self._tokens(chunk)))
+            yield chunk
+        if fail_at == len(chunks):
+            raise ProviderError("Fake provider error", transient=True)
+
+def create_provider(name=None, api_key=None):
+    """Builds the provider selected by MODEL_PROVIDER ("gemini" or "fake") and its env settings."""
+    name = name or os.getenv("MODEL_PROVIDER", "gemini")
+    if name == "fake":
+        provider = FakeProvider(
+            latency=float(os.getenv("FAKE_LATENCY_MS", "200")) / 1000,
+            tokens_per_second=float(os.getenv("FAKE_TOKENS_PER_SECOND", "100")),
+            chunk_tokens=(int(os.getenv("FAKE_CHUNK_MIN_TOKENS", "1")), int(os.getenv("FAKE_CHUNK_MAX_TOKENS", "8"))),
+            reply_tokens=int(os.getenv("FAKE_REPLY_TOKENS", "200")),
+            error_rate=float(os.getenv("FAKE_ERROR_RATE", "0")),
+            seed=int(os.getenv("FAKE_SEED", "0"))
+        )
+        logging.info(f"Using fake model provider ({provider.latency * 1000:.0f}ms latency, {provider.tokens_per_second:g} tokens/s)")
+        return provider
+    if name != "gemini":
+        logging.warning(f"Unknown MODEL_PROVIDER '{name}'. Falling back to Gemini.")
+    return GeminiProvider(api_key)
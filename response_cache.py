@@ -0,0 +1,141 @@
+"""Cache of finished assistant replies for repeated prompts.
+
+Entries are keyed on endpoint, category, model settings, the normalized prompt and (optionally) the
+short conversation that preceded it, so a cached answer is only reused in the same context and
+under the same system prompt.
+
+Backends:
+    MemoryResponseCache  - in-process LRU with TTL
+    SQLiteResponseCache  - table in a WAL-mode SQLite file, shared between worker processes
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from session_store import busy_as_store_busy, thread_connection
+
+def normalize_prompt(text):
+    """Case- and whitespace-insensitive form of a prompt, without trailing punctuation."""
+    return re.sub(r"\s+", " ", text).strip().lower().rstrip("?!. ")
+
+def response_cache_key(endpoint, category, model_key, prompt, history=()):
+    """Digest identifying a reply: endpoint (which sets the system prompt), category, model and generation
+    settings (a ModelSpec key), normalized prompt and the (role, content) turns before it."""
+    payload = json.dumps([endpoint, category, model_key, normalize_prompt(prompt), list(history)])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class ResponseCache:
+    """Interface every response cache backend implements."""
+
+    def get(self, key):
+        """Returns the cached reply for key, or None."""
+        raise NotImplementedError
+
+    def put(self, key, content):
+        """Stores a finished reply."""
+        raise NotImplementedError
+
+class MemoryResponseCache(ResponseCache):
+    """In-process LRU cache with optional TTL."""
+
+    def __init__(self, max_entries=10000, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (content, stored_at), least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self.ttl_seconds and time.monotonic() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+            return entry[0] if entry else None
+
+    def put(self, key, content):
+        with self._lock:
+            self._entries[key] = (content, time.monotonic())
+            self._entries.move_to_end(key)
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class SQLiteResponseCache(ResponseCache):
+    """Response cache stored in SQLite so every worker process shares the same entries."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            content TEXT NOT NULL,
+            stored_at REAL NOT NULL,
+            used_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS response_cache_by_use ON response_cache (used_at);
+    """
+    EVICT_EVERY = 64     # puts between eviction sweeps
+    TOUCH_INTERVAL = 60  # Seconds before a hit records its use again; hits in between only read
+
+    def __init__(self, path, max_entries=10000, ttl_seconds=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._puts = 0
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        return thread_connection(self._local, self.path)
+
+    @busy_as_store_busy
+    def get(self, key):  # Writes only to expire an entry, or to move a stale used_at (LRU order to TOUCH_INTERVAL)
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT content, stored_at, used_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+        if row and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+            conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            row = None
+        if row and now - row[2] > self.TOUCH_INTERVAL:
+            conn.execute("UPDATE response_cache SET used_at = ? WHERE key = ?", (now, key))
+        return row[0] if row else None
+
+    @busy_as_store_busy
+    def put(self, key, content):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, content, stored_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, content, now, now)
+            )
+            self._puts += 1
+            if self.max_entries and self._puts % self.EVICT_EVERY == 0:  # Periodically evict least recently used entries beyond the cap
+                conn.execute(
+                    "DELETE FROM response_cache WHERE key IN ("
+                    "SELECT key FROM response_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+def create_response_cache(backend=None):
+    """Builds the cache selected by RESPONSE_CACHE ("memory", "sqlite" or "off") and its env settings."""
+    backend = backend or os.getenv("RESPONSE_CACHE", "memory")
+    if backend == "off":
+        return None
+    max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000")) or None
+    ttl_seconds = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(24 * 3600))) or None
+    if backend == "sqlite":
+        path = os.getenv("RESPONSE_CACHE_PATH", os.getenv("SESSION_DB_PATH", "chat_sessions.db"))
+        logging.info(f"Using SQLite response cache at {path}")
+        return SQLiteResponseCache(path, max_entries=max_entries, ttl_seconds=ttl_seconds)
+    if backend != "memory":
+        logging.warning(f"Unknown RESPONSE_CACHE '{backend}'. Falling back to in-memory cache.")
+    return MemoryResponseCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
@@ -0,0 +1,198 @@
+"""Streaming replies that outlive the connection that started them.
+
+A Generation is one assistant reply being produced in the background (a thread under
+Flask, a task under asgi.py). Every SSE event it produces is numbered, sequentially within
+the reply, and the last max_events events are kept in a ring buffer. The number is sent as
+the event's "id:" line only for framings whose clients understand it (compact, see sse.py);
+legacy clients get the events as before and can only resume from the start. Any number of
+connections can follow it: the one that started the turn, and clients reconnecting with
+Last-Event-ID after a drop. A dropped connection does not stop the generation. The reply is
+still completed and saved to the session.
+
+When a follower asks for events that have already left the ring buffer, follow() raises
+EventsLost. The caller then waits for the reply to finish and sends it again in full (see
+app.stored_reply_frames).
+
+A finished reply is saved to the session, so its buffer is dropped as soon as no connection is
+reading it; a later reconnect gets EventsLost and the saved reply. The generation itself stays in
+its registry for ttl seconds after it finishes. Registries are per process and per serving mode.
+A reconnect that reaches another worker can only replay finished replies; for a reply still in
+progress it gets 404, and the client polls the session for it instead (static/js/api.js).
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+from sse import sends_event_ids
+
+class EventsLost(Exception):
+    """The events after the requested id are no longer in the ring buffer."""
+
+def split_events(frame):
+    """Splits a string of SSE frames (as produced by sse.py) into its events."""
+    return [event + "\n\n" for event in frame.split("\n\n") if event]
+
+class Generation:
+    """Buffered SSE events of one streaming reply, readable from any event id still in the buffer."""
+
+    def __init__(self, message_id, session_id, framing=None, max_events=None):
+        self.message_id = message_id
+        self.session_id = session_id
+        self.framing = framing                     # Framing name the events were built with
+        self.event_ids = sends_event_ids(framing)  # Whether events are sent with their "id:" line
+        self.events = deque(maxlen=max_events)     # Event texts, the last one having id last_id
+        self.last_id = 0
+        self.done = False
+        self.finished_at = None
+        self.readers = 0                           # Connections following it; the buffer is dropped when none is left
+        self._changed = threading.Condition()
+
+    def publish(self, frame):
+        with self._changed:
+            for event in split_events(frame):
+                self.last_id += 1
+                self.events.append(f"id: {self.last_id}\n{event}" if self.event_ids else event)
+            self._changed.notify_all()
+
+    def finish(self):
+        with self._changed:
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._trim()
+            self._changed.notify_all()
+
+    def attach(self):
+        """Counts a reader before it starts following (follow() with attached=True)."""
+        with self._changed:
+            self.readers += 1
+
+    def _detach(self):
+        with self._changed:
+            self.readers -= 1
+            self._trim()
+
+    def _trim(self):
+        """Drops the events of a finished reply nobody is reading; call with the lock held."""
+        if self.done and self.readers <= 0:
+            self.events.clear()
+
+    def _pending(self, cursor):
+        """(events after id cursor, new cursor); call with the lock held."""
+        count = self.last_id - cursor
+        if count > len(self.events) or count < 0:
+            raise EventsLost(f"Events after {cursor} are no longer buffered (last event {self.last_id})")
+        return list(islice(self.events, len(self.events) - count, None)), self.last_id
+
+    def follow(self, last_event_id=0, attached=False):
+        """Yields the event texts after last_event_id, then live ones until the reply is finished.
+
+        attached: the caller already counted itself with attach(), so the buffer is kept for it
+        even if the reply finishes before it starts reading.
+        """
+        if not attached:
+            self.attach()
+        try:
+            cursor = last_event_id
+            while True:
+                with self._changed:
+                    while cursor == self.last_id and not self.done:
+                        self._changed.wait()
+                    pending, cursor = self._pending(cursor)
+                    done = self.done
+                if pending:
+                    yield "".join(pending)
+                if done:
+                    return
+        finally:
+            self._detach()
+
+    def wait(self, timeout=None):
+        """Blocks until the reply is finished."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.done, timeout)
+
+class AsyncGeneration(Generation):
+    """Generation for the asyncio server; producer and followers all run on the event loop."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._event = asyncio.Event()
+        self.task = None  # The producing task, referenced so it is not garbage collected
+
+    def _notify(self):
+        self._event.set()
+        self._event = asyncio.Event()  # Waiters hold the event that was just set
+
+    def publish(self, frame):
+        super().publish(frame)
+        self._notify()
+
+    def finish(self):
+        super().finish()
+        self._notify()
+
+    async def follow(self, last_event_id=0, attached=False):
+        if not attached:
+            self.attach()
+        try:
+            cursor = last_event_id
+            while True:
+                if cursor == self.last_id and not self.done:
+                    await self._event.wait()
+                    continue
+                with self._changed:
+                    pending, cursor = self._pending(cursor)
+                    done = self.done
+                if pending:
+                    yield "".join(pending)
+                if done:
+                    return
+        finally:
+            self._detach()
+
+    async def wait(self):
+        while not self.done:
+            await self._event.wait()
+
+class GenerationRegistry:
+    """Generations by message id, kept for ttl seconds after they finish."""
+
+    def __init__(self, generation_class=Generation, max_events=1024, ttl=300):
+        self.generation_class = generation_class
+        self.max_events = max_events
+        self.ttl = ttl
+        self._generations = {}
+        self._finished = deque()  # (finished_at, message_id), oldest first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._generations)
+
+    def start(self, message_id, session_id, framing=None):
+        """Registers and returns a new generation (after dropping expired finished ones).
+
+        The connection that started the turn is counted as its first reader: it follows with attached=True.
+        """
+        generation = self.generation_class(message_id, session_id, framing, self.max_events)
+        generation.attach()
+        with self._lock:
+            self._sweep()
+            self._generations[message_id] = generation
+        return generation
+
+    def finish(self, generation):
+        """Finishes a generation of this registry; it expires ttl seconds from now."""
+        generation.finish()
+        with self._lock:
+            self._finished.append((generation.finished_at, generation.message_id))
+
+    def get(self, message_id):
+        with self._lock:
+            return self._generations.get(message_id)
+
+    def _sweep(self):
+        expired = time.monotonic() - self.ttl
+        while self._finished and self._finished[0][0] < expired:
+            self._generations.pop(self._finished.popleft()[1], None)
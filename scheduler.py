@@ -0,0 +1,367 @@
+"""Admission control for upstream model calls.
+
+Every model call goes through a Scheduler, which combines four mechanisms:
+
+    concurrency - at most max_concurrent calls in flight; the others wait
+    fair queue  - waiting calls are served round-robin across sessions, so one busy session cannot starve the rest
+    rate limit  - a token bucket (rate calls/s, bursts of up to burst) paces call starts, including retries
+    retries     - transient failures (429, 5xx, timeouts) are retried with full-jitter exponential backoff;
+                  a stream is only retried if it failed before its first chunk
+
+Load is shed before the upstream sees it. When the queue is full, acquire() raises Overloaded(429).
+When a call has waited longer than queue_timeout, it raises Overloaded(503).
+
+Scheduler serves the threaded Flask server and the batch workers. AsyncScheduler is the asyncio view
+of a Scheduler used by asgi.py: coroutines and threads wait in the same fair queue, for the same
+slots and tokens, so limits apply once per process whichever server runs it.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+# Status codes and exception class names (google.api_core, httpx) worth retrying
+TRANSIENT_CODES = (408, 429, 500, 502, 503, 504)
+TRANSIENT_ERRORS = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway", "TimeoutException", "ConnectError"
+}
+
+class Overloaded(Exception):
+    """The call was shed: 429 when the queue is full, 503 when it waited too long."""
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after  # Seconds, for the Retry-After header
+
+def is_transient(error):
+    """Whether a failed model call is worth retrying."""
+    if getattr(error, "transient", False):
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in TRANSIENT_CODES:
+        return True
+    return type(error).__name__ in TRANSIENT_ERRORS
+
+class TokenBucket:
+    """Paces call starts to rate per second with bursts of up to burst (rate 0 = unlimited)."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token and returns how long the caller must wait before using it.
+
+        Tokens may go negative, so callers are served in reservation order.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+class FairQueue:
+    """Waiters grouped by session, served round-robin across sessions and FIFO within one."""
+
+    def __init__(self):
+        self._waiters = {}     # session_id -> deque of waiters
+        self._order = deque()  # session_ids with waiters, next to be served first
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def push(self, session_id, waiter):
+        waiters = self._waiters.get(session_id)
+        if waiters is None:
+            waiters = self._waiters[session_id] = deque()
+            self._order.append(session_id)
+        waiters.append(waiter)
+        self._size += 1
+
+    def pop(self):
+        """Removes and returns the next waiter, or None when empty."""
+        if not self._order:
+            return None
+        session_id = self._order.popleft()
+        waiters = self._waiters[session_id]
+        waiter = waiters.popleft()
+        if waiters:
+            self._order.append(session_id)  # Back of the line behind the other sessions
+        else:
+            del self._waiters[session_id]
+        self._size -= 1
+        return waiter
+
+    def remove(self, session_id, waiter):
+        """Drops a waiter that gave up; returns False if it was already popped."""
+        waiters = self._waiters.get(session_id)
+        if not waiters or waiter not in waiters:
+            return False
+        waiters.remove(waiter)
+        if not waiters:
+            del self._waiters[session_id]
+            self._order.remove(session_id)
+        self._size -= 1
+        return True
+
+def _grant(waiter):
+    """Hands a freed slot to a waiter: a threading.Event, or an asyncio future (woken on its own loop)."""
+    if isinstance(waiter, threading.Event):
+        waiter.set()
+    else:
+        waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+class Slot:
+    """A granted upstream slot. Releasing it more than once is harmless."""
+
+    __slots__ = ("scheduler", "released")
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.scheduler._release()
+
+class Scheduler:
+    """Concurrency limit, fair queue, rate limit and retries around blocking model calls."""
+
+    def __init__(self, max_concurrent=64, rate=0.0, burst=None, max_queue=256, queue_timeout=30.0, retries=2,
+                 backoff=0.25, backoff_max=4.0, retry_after=2, queued=None, active=None, wait=None, events=None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout  # Seconds a call may wait for a slot before it is shed
+        self.retries = retries              # Extra attempts after a transient failure
+        self.backoff = backoff              # Base and cap of the exponential backoff, in seconds
+        self.backoff_max = backoff_max
+        self.retry_after = retry_after      # Retry-After sent with shed requests
+        self.bucket = TokenBucket(rate, burst if burst is not None else rate)
+        self.active = 0
+        self.queue = FairQueue()
+        self._lock = threading.Lock()
+        # Optional metrics: queue depth and in-flight gauges, wait histogram, event counter (retry, shed_*)
+        self.queued_gauge = queued
+        self.active_gauge = active
+        self.wait_histogram = wait
+        self.events = events
+
+    def _count(self, event):
+        if self.events:
+            self.events.inc(1, event)
+
+    def _track(self, active=0, queued=0):
+        if active and self.active_gauge:
+            self.active_gauge.inc(active)
+        if queued and self.queued_gauge:
+            self.queued_gauge.inc(queued)
+
+    def _observe_wait(self, started):
+        if self.wait_histogram:
+            self.wait_histogram.observe(time.monotonic() - started)
+
+    def _shed_full(self, session_id):
+        self._count("shed_queue_full")
+        logging.warning(f"Shedding model call for session {session_id}: queue full ({self.max_queue} waiting)")
+        return Overloaded("Server busy, please retry", 429, self.retry_after)
+
+    def _shed_timeout(self, session_id):
+        self._count("shed_timeout")
+        logging.warning(f"Shedding model call for session {session_id}: no slot within {self.queue_timeout:g}s")
+        return Overloaded("Server busy, please retry", 503, self.retry_after)
+
+    def delay(self, attempt):
+        """Full-jitter backoff before retry number attempt (1-based)."""
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1)))
+
+    def _admit(self, session_id, new_waiter):
+        """Takes a free slot and returns None, or queues new_waiter() and returns it. Raises Overloaded when full."""
+        with self._lock:
+            if self.active < self.max_concurrent and not len(self.queue):
+                self.active += 1
+                waiter = None
+            elif len(self.queue) >= self.max_queue:
+                raise self._shed_full(session_id)
+            else:
+                waiter = new_waiter()
+                self.queue.push(session_id, waiter)
+        if waiter is None:
+            self._track(active=1)
+        else:
+            self._track(queued=1)
+        return waiter
+
+    def _give_up(self, session_id, waiter):
+        """Drops a waiter that stopped waiting; returns True if it was granted the slot just before."""
+        with self._lock:
+            return not self.queue.remove(session_id, waiter)
+
+    def acquire(self, session_id):
+        """Waits for a free slot (fairly across sessions) and a rate-limit token. Raises Overloaded."""
+        started = time.monotonic()
+        waiter = self._admit(session_id, threading.Event)
+        if waiter is not None:
+            granted = waiter.wait(self.queue_timeout) or self._give_up(session_id, waiter)  # Or just as the wait timed out
+            self._track(queued=-1)
+            if not granted:
+                raise self._shed_timeout(session_id)
+        time.sleep(self.bucket.reserve())
+        self._observe_wait(started)
+        return Slot(self)
+
+    def _release(self):
+        with self._lock:
+            waiter = self.queue.pop()
+            if waiter is None:
+                self.active -= 1
+            else:
+                _grant(waiter)  # The slot passes straight to the next waiter
+        if waiter is None:
+            self._track(active=-1)
+
+    def call(self, session_id, fn, slot=None):
+        """Runs fn() in a slot (acquired here unless given), retrying transient failures."""
+        slot = slot or self.acquire(session_id)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return fn()
+                except Exception as e:
+                    attempt += 1
+                    if attempt > self.retries or not is_transient(e):
+                        raise
+                    self._retry(session_id, attempt, e)
+        finally:
+            slot.release()
+
+    def stream(self, session_id, start, slot=None):
+        """Yields the chunks of start() in a slot, retrying transient failures that happen before the first chunk."""
+        slot = slot or self.acquire(session_id)
+        try:
+            attempt = 0
+            while True:
+                sent = False
+                try:
+                    for chunk in start():
+                        sent = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    attempt += 1
+                    if sent or attempt > self.retries or not is_transient(e):
+                        raise
+                    self._retry(session_id, attempt, e)
+        finally:
+            slot.release()  # Frees the slot when the upstream is done, not when the client has read everything
+
+    def _retry(self, session_id, attempt, error):
+        delay = self.delay(attempt)
+        self._count("retry")
+        logging.warning(f"Retrying model call for session {session_id} in {delay:.2f}s "
+                        f"(attempt {attempt + 1} of {self.retries + 1}): {str(error)}")
+        time.sleep(delay + self.bucket.reserve())
+
+class AsyncScheduler:
+    """Asyncio view of a Scheduler: waiting and backoff sleep without blocking the event loop.
+
+    Slots, queue and token bucket are the scheduler's own, shared with its blocking callers.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    async def acquire(self, session_id):
+        scheduler = self.scheduler
+        started = time.monotonic()
+        waiter = scheduler._admit(session_id, asyncio.get_running_loop().create_future)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), scheduler.queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if scheduler._give_up(session_id, waiter):  # The slot arrived as we gave up: pass it on
+                    scheduler._release()
+                scheduler._track(queued=-1)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                raise scheduler._shed_timeout(session_id)
+            scheduler._track(queued=-1)
+        await asyncio.sleep(scheduler.bucket.reserve())
+        scheduler._observe_wait(started)
+        return Slot(scheduler)
+
+    async def call(self, session_id, fn, slot=None):
+        """Awaits fn() in a slot, retrying transient failures."""
+        slot = slot or await self.acquire(session_id)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return await fn()
+                except Exception as e:
+                    attempt += 1
+                    if attempt > self.scheduler.retries or not is_transient(e):
+                        raise
+                    await self._retry(session_id, attempt, e)
+        finally:
+            slot.release()
+
+    async def stream(self, session_id, start, slot=None):
+        slot = slot or await self.acquire(session_id)
+        try:
+            attempt = 0
+            while True:
+                sent = False
+                try:
+                    async for chunk in start():
+                        sent = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    attempt += 1
+                    if sent or attempt > self.scheduler.retries or not is_transient(e):
+                        raise
+                    await self._retry(session_id, attempt, e)
+        finally:
+            slot.release()
+
+    async def _retry(self, session_id, attempt, error):
+        scheduler = self.scheduler
+        delay = scheduler.delay(attempt)
+        scheduler._count("retry")
+        logging.warning(f"Retrying model call for session {session_id} in {delay:.2f}s "
+                        f"(attempt {attempt + 1} of {scheduler.retries + 1}): {str(error)}")
+        await asyncio.sleep(delay + scheduler.bucket.reserve())
+
+def create_scheduler(**metrics):
+    """Builds a scheduler from the UPSTREAM_* env settings; metrics are passed through to it."""
+    rate = float(os.getenv("UPSTREAM_RATE", "0"))
+    return Scheduler(
+        max_concurrent=int(os.getenv("UPSTREAM_MAX_CONCURRENT", "64")),
+        rate=rate,
+        burst=float(os.getenv("UPSTREAM_BURST", str(max(1.0, rate)))),
+        max_queue=int(os.getenv("UPSTREAM_MAX_QUEUE", "256")),
+        queue_timeout=float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "30")),
+        retries=int(os.getenv("UPSTREAM_RETRIES", "2")),
+        backoff=float(os.getenv("UPSTREAM_BACKOFF_MS", "250")) / 1000,
+        backoff_max=float(os.getenv("UPSTREAM_BACKOFF_MAX_MS", "4000")) / 1000,
+        retry_after=int(os.getenv("UPSTREAM_RETRY_AFTER", "2")),
+        **metrics
+    )
@@ -0,0 +1,86 @@
+"""Production entry point: the chat API on a multi-process server.
+
+    python serve.py                  # uvicorn running asgi.py (default)
+    python serve.py --server wsgi    # gunicorn running the Flask app with threaded workers
+
+Settings (flags override the environment):
+    WEB_CONCURRENCY  worker processes (default: one per CPU)
+    HOST, PORT       listen address (default 0.0.0.0:5000)
+    WSGI_THREADS     threads per gunicorn worker; each open SSE stream holds one (default 32)
+    STATIC_BUILD     "auto" rebuilds static_dist/ (build_static.py) when static/ changed, "off" never does
+
+With more than one worker, every worker must see every session, so SESSION_STORE defaults
+to sqlite here, and so does RESPONSE_CACHE. Any worker can then serve any request without
+sticky routing: the session, its messages and cached replies live in the shared file. For
+several nodes, put SESSION_DB_PATH on storage all of them can reach, or use a networked backend.
+
+Some state stays per worker: the encoded-history cache, single-flight groups, the upstream
+scheduler limits and /metrics. The history cache only ever appends what it has not seen, so
+it stays correct when another worker adds messages.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def shared_state_env(workers):
+    """Defaults the stores to SQLite for multi-worker runs; refuses a per-process session store."""
+    if workers > 1:
+        os.environ.setdefault("SESSION_STORE", "sqlite")
+        os.environ.setdefault("RESPONSE_CACHE", "sqlite")
+        if os.environ["SESSION_STORE"] != "sqlite":
+            sys.exit(f"SESSION_STORE={os.environ['SESSION_STORE']} keeps sessions inside one process; "
+                     f"use SESSION_STORE=sqlite with {workers} workers")
+    logging.info(f"Starting {workers} worker(s) with SESSION_STORE={os.getenv('SESSION_STORE', 'memory')}, "
+                 f"RESPONSE_CACHE={os.getenv('RESPONSE_CACHE', 'memory')}")
+
+def ensure_static_build():
+    """Runs build_static.py before the workers start when its output is missing or stale."""
+    if os.getenv("STATIC_BUILD", "auto") == "off":
+        return
+    import build_static
+    if build_static.needs_build():
+        started = time.monotonic()
+        manifest = build_static.build()
+        logging.info(f"Built {len(manifest['assets'])} static assets in {time.monotonic() - started:.1f}s")
+
+def serve_asgi(host, port, workers):
+    import uvicorn
+    uvicorn.run("asgi:application", host=host, port=port, workers=workers, log_level="warning")
+
+def serve_wsgi(host, port, workers):
+    """Replaces this process with gunicorn (it needs its own master process)."""
+    command = [
+        sys.executable, "-m", "gunicorn", "app:app",
+        "--bind", f"{host}:{port}",
+        "--workers", str(workers),
+        "--worker-class", "gthread",
+        "--threads", os.getenv("WSGI_THREADS", "32"),
+        "--timeout", "120",  # Heartbeat timeout; streams run in worker threads and are not cut off by it
+    ]
+    os.execv(sys.executable, command)
+
+def main():
+    load_dotenv()  # Before reading SESSION_STORE etc., as the workers will
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("asgi", "wsgi"), default="asgi")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))))
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "5000")))
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))  # Workers import app/asgi and serve static/ from here
+    shared_state_env(args.workers)
+    ensure_static_build()
+    if args.server == "wsgi":
+        serve_wsgi(args.host, args.port, args.workers)
+    else:
+        serve_asgi(args.host, args.port, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,632 @@
+"""Pluggable storage for chat sessions.
+
+A session is the dict the API has always returned from GET /api/chat/<id>:
+    {"id", "title", "created_at", "category", "messages": [...]}
+
+Listings are paged newest first with an opaque cursor (see encode_cursor), and a session's
+messages can be read in pages that follow a given message id. Both backends keep an index
+ordered by (created_at, id), so a page costs the same however many sessions exist. A chat turn
+reads only the session's summary (with its message count) and the messages it needs, by
+position (read_messages), instead of the whole session.
+
+Backends:
+    MemorySessionStore  - in-process LRU with TTL, session-count and byte-size caps; holds sessions
+                          and messages in a compact form (see Message) and hands out dict-like views
+    SQLiteSessionStore  - append-only message log in a WAL-mode SQLite file, shareable between worker processes
+"""
+import functools
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+SESSION_SUMMARY_FIELDS = ("id", "title", "created_at", "category")
+# Seconds a SQLite write waits for another connection's write lock before raising StoreBusy
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SESSION_DB_BUSY_TIMEOUT", "30"))
+
+class StoreBusy(Exception):
+    """A write could not get the SQLite write lock within SQLITE_BUSY_TIMEOUT; the request may be retried."""
+
+def busy_as_store_busy(method):
+    """Raises StoreBusy instead of sqlite3's "database is locked" from a method that writes."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                raise StoreBusy(str(e)) from e
+            raise
+    return wrapper
+
+class SessionStore:
+    """Interface every session backend implements."""
+
+    def create(self, session):
+        """Stores a new session dict (which must include an "id" and an empty "messages" list)."""
+        raise NotImplementedError
+
+    def get(self, session_id):
+        """Returns the session dict, or None if it does not exist (or has expired)."""
+        raise NotImplementedError
+
+    def update(self, session_id, **fields):
+        """Updates top-level session fields such as title or category."""
+        raise NotImplementedError
+
+    def append_message(self, session_id, message):
+        """Appends one message to the session. Returns False if the session no longer exists."""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """Deletes a session. Returns True if it existed."""
+        raise NotImplementedError
+
+    def list_sessions(self):
+        """Returns a summary dict (id, title, created_at, category, message_count) for every session."""
+        raise NotImplementedError
+
+    def page_sessions(self, limit=None, cursor=None, category=None):
+        """Returns (summaries newest first, next cursor or None), optionally for one category only."""
+        raise NotImplementedError
+
+    def get_messages(self, session_id, after=None, limit=None):
+        """Returns (session with up to limit messages following message id after, has_more), or None if the session does not exist.
+
+        Raises ValueError if after is not a message of the session.
+        """
+        raise NotImplementedError
+
+    def summary(self, session_id):
+        """Returns the listing entry of one session (with message_count), or None if it does not exist."""
+        raise NotImplementedError
+
+    def read_messages(self, session_id, start=0, end=None):
+        """Returns the session's messages[start:end] by position, or None if the session does not exist."""
+        raise NotImplementedError
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+def encode_cursor(created_at, session_id):
+    """Opaque pagination cursor for the session listed last on a page."""
+    return f"{created_at}|{session_id}"
+
+def decode_cursor(cursor):
+    """(created_at, session_id) from a cursor. Raises ValueError for malformed cursors."""
+    created_at, separator, session_id = cursor.partition("|")
+    if not separator or not created_at or not session_id:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return created_at, session_id
+
+def summarize(session, message_count):
+    """Listing entry for a session."""
+    return {
+        "id": session["id"],
+        "title": session["title"],
+        "created_at": session["created_at"],
+        "category": session.get("category", "general"),
+        "message_count": message_count
+    }
+
+def estimate_size(obj):
+    """Approximate number of bytes an object costs when serialized."""
+    return len(json.dumps(obj))
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+def compact_id(message_id):
+    """A canonical uuid string as its 128-bit int; any other id unchanged."""
+    if isinstance(message_id, str) and len(message_id) == 36:
+        try:
+            value = uuid.UUID(message_id)
+        except ValueError:
+            return message_id
+        if str(value) == message_id:
+            return value.int
+    return message_id
+
+def expand_id(value):
+    if not isinstance(value, int):
+        return value
+    digits = f"{value:032x}"  # Same text as str(uuid.UUID(int=value)), without building the UUID
+    return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}"
+
+def compact_timestamp(timestamp):
+    """A naive ISO timestamp as integer microseconds since 1970; anything that would not round-trip unchanged."""
+    try:
+        moment = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return timestamp
+    if moment.tzinfo is not None or moment.isoformat() != timestamp:
+        return timestamp
+    return (moment - EPOCH) // MICROSECOND
+
+def expand_timestamp(value):
+    return (EPOCH + value * MICROSECOND).isoformat() if isinstance(value, int) else value
+
+MESSAGE_FIELDS = ("id", "role", "content", "timestamp", "category")
+
+class Message:
+    """Compact stored form of a message dict: uuid ids as ints, timestamps as epoch microseconds,
+    role and category interned, rare keys (e.g. "error") in extra.
+
+    Reads like the dict it came from (message["content"], message.get("category")); to_dict()
+    rebuilds that dict for the API response.
+    """
+
+    __slots__ = ("id", "role", "content", "timestamp", "category", "extra")
+
+    def __init__(self, message):
+        self.id = compact_id(message.get("id"))
+        self.role = sys.intern(message["role"])
+        self.content = message["content"]
+        self.timestamp = compact_timestamp(message.get("timestamp"))
+        category = message.get("category")
+        self.category = sys.intern(category) if isinstance(category, str) else category
+        extra = {key: value for key, value in message.items() if key not in MESSAGE_FIELDS}
+        self.extra = extra or None
+
+    def get(self, key, default=None):
+        if key == "content":
+            return self.content
+        if key == "role":
+            return self.role
+        if key == "id":
+            return expand_id(self.id)
+        if key == "timestamp":
+            return expand_timestamp(self.timestamp)
+        if key == "category":
+            return default if self.category is None else self.category
+        return self.extra.get(key, default) if self.extra else default
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def to_dict(self):
+        message = {"id": expand_id(self.id), "role": self.role, "content": self.content,
+                   "timestamp": expand_timestamp(self.timestamp)}
+        if self.category is not None:
+            message["category"] = self.category
+        if self.extra:
+            message.update(self.extra)
+        return message
+
+class Session:
+    """Compact stored form of a session dict; reads like it and converts back with to_dict()."""
+
+    __slots__ = ("id", "title", "created_at", "category", "messages")
+
+    def __init__(self, session):
+        self.id = session["id"]
+        self.title = session["title"]
+        self.created_at = session["created_at"]
+        self.set("category", session.get("category", "general"))
+        self.messages = [Message(message) for message in session["messages"]]
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def set(self, key, value):
+        setattr(self, key, sys.intern(value) if key == "category" and isinstance(value, str) else value)
+
+    def to_dict(self, messages=None):
+        """The session as the API returns it, with all messages or the given slice of them."""
+        return {
+            "id": self.id,
+            "title": self.title,
+            "created_at": self.created_at,
+            "category": self.category,
+            "messages": [message.to_dict() for message in (self.messages if messages is None else messages)]
+        }
+
+def as_dict(session):
+    """Plain JSON-ready dict of a session from any backend."""
+    return session.to_dict() if isinstance(session, Session) else session
+
+class MemorySessionStore(SessionStore):
+    """In-process session store bounded by count, total bytes and idle time (LRU eviction)."""
+
+    def __init__(self, max_sessions=None, max_bytes=None, ttl_seconds=None):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()  # session_id -> session, least recently used first
+        self._sizes = {}                # session_id -> estimated bytes
+        self._last_access = {}          # session_id -> monotonic timestamp
+        self._index = []                # (created_at, session_id), oldest first
+        self._category_index = {}       # category -> (created_at, session_id), oldest first
+        self._positions = {}            # session_id -> {compact message id: index in messages}
+        self.total_bytes = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _touch(self, session_id):
+        self._sessions.move_to_end(session_id)
+        self._last_access[session_id] = time.monotonic()
+
+    def _expired(self, session_id, now):
+        return self.ttl_seconds and now - self._last_access[session_id] > self.ttl_seconds
+
+    def _index_add(self, session):
+        entry = (session["created_at"], session["id"])
+        insort(self._index, entry)
+        insort(self._category_index.setdefault(session.get("category", "general"), []), entry)
+
+    def _index_discard(self, session):
+        entry = (session["created_at"], session["id"])
+        for index in (self._index, self._category_index.get(session.get("category", "general"), [])):
+            position = bisect_left(index, entry)
+            if position < len(index) and index[position] == entry:
+                del index[position]
+
+    def _remove(self, session_id):
+        self._index_discard(self._sessions.pop(session_id))
+        self.total_bytes -= self._sizes.pop(session_id)
+        del self._last_access[session_id]
+        del self._positions[session_id]
+
+    def _evict(self):
+        """Drops expired sessions, then least recently used ones until the caps hold."""
+        now = time.monotonic()
+        while self._sessions:
+            oldest = next(iter(self._sessions))
+            over_count = self.max_sessions and len(self._sessions) > self.max_sessions
+            over_bytes = self.max_bytes and self.total_bytes > self.max_bytes and len(self._sessions) > 1
+            if not (over_count or over_bytes or self._expired(oldest, now)):
+                break
+            self._remove(oldest)
+            self.evictions += 1
+            logging.debug(f"Evicted chat session {oldest}")
+
+    def create(self, session):
+        with self._lock:
+            session_id = session["id"]
+            if session_id in self._sessions:
+                self._remove(session_id)
+            stored = self._sessions[session_id] = Session(session)
+            self._index_add(stored)
+            self._positions[session_id] = {message.id: i for i, message in enumerate(stored.messages)}
+            self._sizes[session_id] = estimate_size(session)
+            self.total_bytes += self._sizes[session_id]
+            self._touch(session_id)
+            self._evict()
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if self._expired(session_id, time.monotonic()):
+                self._remove(session_id)
+                self.evictions += 1
+                return None
+            self._touch(session_id)
+            return session
+
+    def update(self, session_id, **fields):
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                return False
+            if "category" in fields:  # Re-file the session under its new category
+                self._index_discard(session)
+            for key, value in fields.items():
+                if key not in ("title", "category"):
+                    continue
+                delta = estimate_size(value) - estimate_size(session.get(key))
+                session.set(key, value)
+                self._sizes[session_id] += delta
+                self.total_bytes += delta
+            if "category" in fields:
+                self._index_add(session)
+            return True
+
+    def append_message(self, session_id, message):
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                return False
+            stored = Message(message)
+            self._positions[session_id][stored.id] = len(session.messages)
+            session.messages.append(stored)
+            size = estimate_size(message)
+            self._sizes[session_id] += size
+            self.total_bytes += size
+            self._evict()
+            return True
+
+    def delete(self, session_id):
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            self._remove(session_id)
+            return True
+
+    def list_sessions(self):
+        with self._lock:
+            now = time.monotonic()
+            return [
+                summarize(session, len(session["messages"]))
+                for session_id, session in self._sessions.items()
+                if not self._expired(session_id, now)
+            ]
+
+    def page_sessions(self, limit=None, cursor=None, category=None):
+        with self._lock:
+            index = self._index if category is None else self._category_index.get(category, [])
+            position = bisect_left(index, decode_cursor(cursor)) if cursor else len(index)
+            now = time.monotonic()
+            page = []
+            while position > 0 and (limit is None or len(page) < limit):  # Walk back from the cursor, newest first
+                position -= 1
+                session_id = index[position][1]
+                if self._expired(session_id, now):
+                    self._remove(session_id)  # Also drops index[position]; everything before it keeps its place
+                    self.evictions += 1
+                    continue
+                session = self._sessions[session_id]
+                page.append(summarize(session, len(session["messages"])))
+            next_cursor = encode_cursor(page[-1]["created_at"], page[-1]["id"]) if page and position > 0 else None
+            return page, next_cursor
+
+    def summary(self, session_id):
+        with self._lock:
+            session = self.get(session_id)
+            return None if session is None else summarize(session, len(session.messages))
+
+    def read_messages(self, session_id, start=0, end=None):
+        """The stored Message objects (read like dicts), without converting them."""
+        with self._lock:
+            session = self.get(session_id)
+            return None if session is None else session.messages[start:end]
+
+    def get_messages(self, session_id, after=None, limit=None):
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                return None
+            start = 0
+            if after is not None:
+                position = self._positions[session_id].get(compact_id(after))
+                if position is None:
+                    raise ValueError(f"Unknown message id: {after}")
+                start = position + 1
+            messages = session.messages
+            end = len(messages) if limit is None else min(start + limit, len(messages))
+            return session.to_dict(messages[start:end]), end < len(messages)
+
+def thread_connection(local, path):
+    """Returns this thread's autocommit, WAL-mode connection to path, opening it on first use.
+
+    A connection inherited through fork (e.g. a server that imports the app before forking workers)
+    is never reused; the worker opens its own.
+    """
+    conn = getattr(local, "conn", None)
+    if conn is None or local.pid != os.getpid():
+        conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        local.conn = conn
+        local.pid = os.getpid()
+    return conn
+
+class SQLiteSessionStore(SessionStore):
+    """Session store backed by a SQLite file in WAL mode.
+
+    Messages are only ever appended, so concurrent readers in other worker processes never
+    block writers. One connection is kept per thread. Writes wait for each other up to
+    SQLITE_BUSY_TIMEOUT and then raise StoreBusy.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            category TEXT NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            message_id TEXT,
+            position INTEGER
+        );
+    """
+    INDEXES = """
+        CREATE INDEX IF NOT EXISTS messages_by_session ON messages (session_id, seq);
+        CREATE INDEX IF NOT EXISTS messages_by_position ON messages (session_id, position);
+        CREATE INDEX IF NOT EXISTS messages_by_id ON messages (session_id, message_id);
+        CREATE INDEX IF NOT EXISTS sessions_by_created ON sessions (created_at, id);
+        CREATE INDEX IF NOT EXISTS sessions_by_category ON sessions (category, created_at, id);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(messages)")]
+        if "message_id" not in columns:  # Files created before message ids were indexed
+            conn.execute("ALTER TABLE messages ADD COLUMN message_id TEXT")
+            conn.execute("UPDATE messages SET message_id = json_extract(data, '$.id')")
+        if "position" not in columns:  # Files created before messages were numbered within their session
+            conn.execute("ALTER TABLE messages ADD COLUMN position INTEGER")
+            conn.execute(
+                "UPDATE messages SET position = numbered.position FROM ("
+                "SELECT seq, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY seq) - 1 AS position FROM messages"
+                ") AS numbered WHERE messages.seq = numbered.seq"
+            )
+        conn.executescript(self.INDEXES)
+
+    def _connect(self):
+        return thread_connection(self._local, self.path)
+
+    @busy_as_store_busy
+    def create(self, session):
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, title, created_at, category, message_count) VALUES (?, ?, ?, ?, 0)",
+                (session["id"], session["title"], session["created_at"], session.get("category", "general"))
+            )
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session["id"],))
+            for message in session.get("messages", []):
+                self._insert_message(conn, session["id"], message)
+
+    def get(self, session_id):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT id, title, created_at, category FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        session = dict(zip(SESSION_SUMMARY_FIELDS, row))
+        session["messages"] = [
+            json.loads(data) for (data,) in
+            conn.execute("SELECT data FROM messages WHERE session_id = ? ORDER BY seq", (session_id,))
+        ]
+        return session
+
+    def __contains__(self, session_id):
+        return self._connect().execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is not None
+
+    def summary(self, session_id):
+        row = self._connect().execute(
+            "SELECT id, title, created_at, category, message_count FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        return None if row is None else dict(zip(SESSION_SUMMARY_FIELDS + ("message_count",), row))
+
+    def read_messages(self, session_id, start=0, end=None):
+        """A range scan of the (session_id, position) index; only the rows returned are read and decoded."""
+        bounds, params = "position >= ?", (session_id, start)
+        if end is not None:
+            bounds, params = "position >= ? AND position < ?", (session_id, start, end)
+        rows = self._connect().execute(
+            f"SELECT data FROM messages WHERE session_id = ? AND {bounds} ORDER BY position", params
+        ).fetchall()
+        if not rows and session_id not in self:
+            return None
+        return [json.loads(data) for (data,) in rows]
+
+    @busy_as_store_busy
+    def update(self, session_id, **fields):
+        fields = {key: value for key, value in fields.items() if key in ("title", "category")}
+        if not fields:
+            return session_id in self
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        cursor = self._connect().execute(
+            f"UPDATE sessions SET {assignments} WHERE id = ?", (*fields.values(), session_id)
+        )
+        return cursor.rowcount > 0
+
+    def _insert_message(self, conn, session_id, message):
+        conn.execute(
+            "INSERT INTO messages (session_id, data, message_id, position) "
+            "VALUES (?, ?, ?, (SELECT message_count FROM sessions WHERE id = ?))",
+            (session_id, json.dumps(message), message.get("id"), session_id)
+        )
+        conn.execute("UPDATE sessions SET message_count = message_count + 1 WHERE id = ?", (session_id,))
+
+    @busy_as_store_busy
+    def append_message(self, session_id, message):
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is None:
+                return False
+            self._insert_message(conn, session_id, message)
+            return True
+
+    @busy_as_store_busy
+    def delete(self, session_id):
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            deleted = conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        return deleted > 0
+
+    def list_sessions(self):
+        rows = self._connect().execute(
+            "SELECT id, title, created_at, category, message_count FROM sessions"
+        ).fetchall()
+        return [dict(zip(SESSION_SUMMARY_FIELDS + ("message_count",), row)) for row in rows]
+
+    def page_sessions(self, limit=None, cursor=None, category=None):
+        conditions, params = [], []
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        if cursor:
+            conditions.append("(created_at, id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._connect().execute(
+            f"SELECT id, title, created_at, category, message_count FROM sessions {where} "
+            "ORDER BY created_at DESC, id DESC LIMIT ?",
+            (*params, -1 if limit is None else limit + 1)  # One extra row tells whether another page exists
+        ).fetchall()
+        page = [dict(zip(SESSION_SUMMARY_FIELDS + ("message_count",), row)) for row in rows[:limit]]
+        next_cursor = encode_cursor(page[-1]["created_at"], page[-1]["id"]) if limit is not None and len(rows) > limit else None
+        return page, next_cursor
+
+    def get_messages(self, session_id, after=None, limit=None):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT id, title, created_at, category FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        start = 0
+        if after is not None:
+            found = conn.execute(
+                "SELECT seq FROM messages WHERE session_id = ? AND message_id = ?", (session_id, after)
+            ).fetchone()
+            if found is None:
+                raise ValueError(f"Unknown message id: {after}")
+            start = found[0]
+        rows = conn.execute(
+            "SELECT data FROM messages WHERE session_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (session_id, start, -1 if limit is None else limit + 1)
+        ).fetchall()
+        page = dict(zip(SESSION_SUMMARY_FIELDS, row))
+        page["messages"] = [json.loads(data) for (data,) in rows[:limit]]
+        return page, limit is not None and len(rows) > limit
+
+def create_session_store(backend=None):
+    """Builds the session store selected by SESSION_STORE ("memory" or "sqlite") and its env settings."""
+    backend = backend or os.getenv("SESSION_STORE", "memory")
+    if backend == "sqlite":
+        path = os.getenv("SESSION_DB_PATH", "chat_sessions.db")
+        logging.info(f"Using SQLite session store at {path}")
+        return SQLiteSessionStore(path)
+    if backend != "memory":
+        logging.warning(f"Unknown SESSION_STORE '{backend}'. Falling back to in-memory store.")
+    return MemorySessionStore(
+        max_sessions=int(os.getenv("SESSION_MAX_COUNT", "0")) or None,
+        max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024))) or None,
+        ttl_seconds=int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600))) or None
+    )
@@ -0,0 +1,170 @@
+"""Single-flight coalescing of identical in-flight generations.
+
+When several requests with the same key (category, model, normalized prompt and history digest)
+arrive while the first is still generating, only the first (the leader) calls the model; the
+others (followers) read the leader's raw chunks as they arrive. Each subscriber still formats,
+frames and stores its own reply, so every client gets its own message id and the usual SSE frames.
+
+A flight ends when its upstream stream ends. Requests arriving after that start a new flight (or
+hit the response cache). If the leader's upstream fails, or the leader's client goes away before
+the stream ends, every follower gets the same error.
+"""
+import asyncio
+import threading
+
+class FlightAbandoned(Exception):
+    """The leader stopped reading its upstream stream before it finished."""
+
+class Flight:
+    """Raw chunks of one upstream generation, readable by any number of followers."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self._changed = threading.Condition()
+
+    def publish(self, chunk):
+        with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    def finish(self, error=None):
+        with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    def follow(self):
+        """Yields every chunk from the start, blocking for new ones; re-raises the leader's error at the end."""
+        index = 0
+        while True:
+            with self._changed:
+                while index == len(self.chunks) and not self.done:
+                    self._changed.wait()
+                chunks = self.chunks[index:]
+                done = self.done
+            yield from chunks
+            index += len(chunks)
+            if done and index == len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+class AsyncFlight(Flight):
+    """Flight for the asyncio server; publisher and followers all run on the event loop."""
+
+    def __init__(self):
+        super().__init__()
+        self._event = asyncio.Event()
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        self._event.set()
+        self._event = asyncio.Event()  # Waiters hold the event that was just set
+
+    async def follow(self):
+        index = 0
+        while True:
+            if index == len(self.chunks) and not self.done:
+                await self._event.wait()
+                continue
+            while index < len(self.chunks):
+                index += 1
+                yield self.chunks[index - 1]
+            if self.done and index == len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+class SingleFlight:
+    """Registry of in-flight generations by key (one per process and serving mode)."""
+
+    flight_class = Flight
+
+    def __init__(self, counter=None):
+        self.counter = counter  # Optional metrics counter, incremented with label "leader" or "follower"
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._flights)
+
+    def __contains__(self, key):
+        """Whether a generation for key is running (a request arriving now would most likely follow it)."""
+        return key in self._flights
+
+    def join(self, key):
+        """Returns (flight, True) for a new leader or (flight, False) for a follower of a running flight."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None or flight.done
+            if leader:
+                flight = self._flights[key] = self.flight_class()
+            else:
+                flight.followers += 1
+        if self.counter:
+            self.counter.inc(1, "leader" if leader else "follower")
+        return flight, leader
+
+    def release(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stream(self, key, start):
+        """Yields the raw chunks for key; only the leader calls start() for the upstream iterator.
+
+        The flight is joined on the first next(), so an iterator that is never started never blocks followers.
+        """
+        flight, leader = self.join(key)
+        if not leader:
+            yield from flight.follow()
+            return
+        try:
+            for chunk in start():
+                flight.publish(chunk)
+                yield chunk
+            flight.finish()
+        except GeneratorExit:  # Our client disconnected mid-stream
+            flight.finish(FlightAbandoned("The shared generation was cancelled"))
+            raise
+        except Exception as e:
+            flight.finish(e)
+            raise
+        finally:
+            self.release(key, flight)
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight over async iterators for asgi.py."""
+
+    flight_class = AsyncFlight
+
+    async def stream(self, key, start):
+        flight, leader = self.join(key)
+        if not leader:
+            async for chunk in flight.follow():
+                yield chunk
+            return
+        try:
+            async for chunk in start():
+                flight.publish(chunk)
+                yield chunk
+            flight.finish()
+        except (GeneratorExit, asyncio.CancelledError):
+            flight.finish(FlightAbandoned("The shared generation was cancelled"))
+            raise
+        except Exception as e:
+            flight.finish(e)
+            raise
+        finally:
+            self.release(key, flight)
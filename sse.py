@@ -0,0 +1,226 @@
+"""Server-Sent Events framing for the streaming chat endpoint.
+
+Two framings are available; the client picks one with "framing" in the request body:
+
+    legacy   - one frame per chunk, each carrying id, chunk, position and code_block (the original format)
+    compact  - chunks coalesced over a short time/size window into {"c": text} frames, the message id
+               sent once in the metadata frame, and a SHA-256 digest of the answer in the completion
+               frame. The stream may also be gzip/deflate-compressed when the client accepts it.
+               Events carry an SSE "id:" line, so a dropped stream can be resumed with Last-Event-ID.
+
+Legacy events never carry "id:" lines: the original api.js parser drops events that have one.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+from static_assets import accepted
+
+# Coalescing window for compact framing: flush when the oldest buffered text is this old...
+COALESCE_SECONDS = float(os.getenv("SSE_COALESCE_MS", "50")) / 1000
+# ...or when this many characters are buffered
+COALESCE_CHARS = int(os.getenv("SSE_COALESCE_CHARS", "2048"))
+
+def sse_event(payload):
+    """Serializes a payload into a single Server-Sent Events frame."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+def compact_event(payload):
+    """Like sse_event, without the optional whitespace in the JSON."""
+    return f"data: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+class LegacyFraming:
+    """The original wire format: one self-describing frame per chunk."""
+
+    event_ids = False  # Older clients drop events with an "id:" line
+    window = None      # Every chunk is sent as it arrives
+
+    def flush_delay(self):
+        return None
+
+    def flush(self):
+        return ""
+
+    def open(self, turn):
+        return sse_event(turn.metadata())
+
+    def chunk(self, turn, text):
+        data = {  # Data payload for each chunk sent to frontend
+            "id": turn.message_id,
+            "chunk": text,
+            "position": turn.position,
+            "code_block": turn.code_block_open  # Send code_block status to frontend
+        }
+        return sse_event(data)
+
+    def complete(self, turn, final_content):
+        return sse_event({"id": turn.message_id, "status": "complete"})
+
+    def error(self, turn, message):
+        error_data = {"id": turn.message_id, "chunk": message, "position": 0, "error": "Gemini API Error"}  # Error flag for frontend
+        complete_data = {"id": turn.message_id, "status": "complete", "final_content": message, "error": "Gemini API Error"}
+        return sse_event(error_data) + sse_event(complete_data)  # Error chunk followed by completion
+
+class CompactFraming:
+    """Coalesced {"c": text} frames; id only in the metadata frame; digest instead of the full answer."""
+
+    event_ids = True  # Clients asking for compact framing understand "id:" lines and resume with them
+
+    def __init__(self, window=COALESCE_SECONDS, max_chars=COALESCE_CHARS):
+        self.window = window
+        self.max_chars = max_chars
+        self.buffer = []
+        self.buffered_chars = 0
+        self.buffered_since = 0.0
+        self.sent_first = False
+
+    def open(self, turn):
+        metadata = turn.metadata()
+        metadata["framing"] = "compact"
+        return compact_event(metadata)
+
+    def flush_delay(self):
+        """Seconds until the buffered text is due (0 when overdue), or None when nothing is buffered."""
+        if not self.buffer:
+            return None
+        return max(0.0, self.buffered_since + self.window - time.monotonic())
+
+    def flush(self):
+        """Returns one frame for everything buffered (empty string if nothing is)."""
+        if not self.buffer:
+            return ""
+        text = "".join(self.buffer)
+        self.buffer = []
+        self.buffered_chars = 0
+        return compact_event({"c": text})
+
+    def chunk(self, turn, text):
+        now = time.monotonic()
+        if not self.buffer:
+            self.buffered_since = now
+        self.buffer.append(text)
+        self.buffered_chars += len(text)
+        # The first chunk goes out immediately to keep time-to-first-byte low
+        if not self.sent_first or self.buffered_chars >= self.max_chars or now - self.buffered_since >= self.window:
+            self.sent_first = True
+            return self.flush()
+        return ""
+
+    def complete(self, turn, final_content):
+        digest = hashlib.sha256(final_content.encode()).hexdigest()
+        return self.flush() + compact_event({"status": "complete", "sha256": digest})
+
+    def error(self, turn, message):
+        return self.flush() + compact_event({"c": message, "error": "Gemini API Error"}) + \
+            compact_event({"status": "complete", "final_content": message, "error": "Gemini API Error"})
+
+FRAMINGS = {"legacy": LegacyFraming, "compact": CompactFraming}
+
+def make_framing(name):
+    """Returns a new framing instance for one stream (legacy for unknown names)."""
+    return FRAMINGS.get(name or "legacy", LegacyFraming)()
+
+def sends_event_ids(name):
+    """Whether events of this framing carry SSE "id:" lines."""
+    return FRAMINGS.get(name or "legacy", LegacyFraming).event_ids
+
+_PUMP_DONE = object()
+
+def paced_chunks(chunks, delay):
+    """Yields the items of chunks, and None whenever delay() seconds pass without one (delay() None: no limit).
+
+    Lets a coalescing producer flush on time while the upstream is quiet. The iterator is read on a
+    helper thread; when the caller stops early, it is closed after its next item.
+    """
+    items = queue.Queue()
+    stopped = threading.Event()
+
+    def pump():
+        try:
+            for chunk in chunks:
+                items.put((chunk, None))
+                if stopped.is_set():
+                    chunks.close()  # Ends a shared flight or frees the upstream slot, as a closed stream would
+                    return
+            items.put((_PUMP_DONE, None))
+        except Exception as e:
+            items.put((_PUMP_DONE, e))
+
+    threading.Thread(target=pump, name=f"{threading.current_thread().name}-upstream", daemon=True).start()
+    try:
+        while True:
+            try:
+                chunk, error = items.get(timeout=delay())
+            except queue.Empty:
+                yield None  # The deadline passed with no new chunk
+                continue
+            if chunk is _PUMP_DONE:
+                if error is not None:
+                    raise error
+                return
+            yield chunk
+    finally:
+        stopped.set()
+
+async def async_paced_chunks(chunks, delay):
+    """Async twin of paced_chunks for asgi.py: waits for the next chunk with a timeout, no extra thread."""
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(anext(chunks))
+            done, _ = await asyncio.wait((pending,), timeout=delay())
+            if not done:
+                yield None  # The deadline passed with no new chunk; the read stays pending
+                continue
+            task, pending = pending, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        if pending is not None:
+            pending.cancel()  # Cancels the upstream read, as closing the stream would
+        else:
+            await chunks.aclose()
+
+def negotiate_encoding(accept_encoding):
+    """Picks gzip or deflate from an Accept-Encoding header value (ignoring q=0 entries, as static assets do), or None."""
+    encodings = accepted(accept_encoding)
+    for encoding in ("gzip", "deflate"):
+        if encoding in encodings:
+            return encoding
+    return None
+
+class StreamEncoder:
+    """Encodes SSE frames to bytes, compressing with a sync flush after each frame so nothing is delayed."""
+
+    def __init__(self, encoding=None):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._compressor = zlib.compressobj(wbits=31)
+        elif encoding == "deflate":
+            self._compressor = zlib.compressobj(wbits=15)
+        else:
+            self._compressor = None
+
+    def encode(self, frame):
+        data = frame.encode()
+        if self._compressor is None:
+            return data
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush() if self._compressor else b""
+
+    def headers(self):
+        """Extra response headers for this encoding."""
+        if self.encoding is None:
+            return {}
+        return {"Content-Encoding": self.encoding, "Vary": "Accept-Encoding"}
@@ -58,81 +58,190 @@ class ApiService {
   }
 
   // Enhanced streaming method for better code handling
+  // A dropped connection is resumed from the last event id (the reply keeps generating on the server)
   async streamMessage(message, category = 'general', onChunk = () => {}, onComplete = () => {}, onError = () => {}) {
     if (!this.sessionId) {
       await this.createNewChat(category);
     }
 
+    const state = {
+      fullMessage: '',
+      messageId: null,
+      userMessageId: null,
+      lastEventId: 0,
+      codeBlockOpen: false,
+      currentLanguage: '',
+      complete: false
+    };
+
     try {
       const response = await fetch(`${API_URL}/api/chat/${this.sessionId}/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ message, category })
+        // Compact framing: coalesced chunks, id sent once, digest instead of the full answer at the end
+        body: JSON.stringify({ message, category, framing: 'compact' })
       });
 
       if (!response.ok) {
         throw new Error(`Failed to stream message: ${response.status} ${response.statusText}`);
       }
+      state.messageId = response.headers.get('X-Message-Id');
+      state.userMessageId = response.headers.get('X-User-Message-Id');
+
+      for (let attempt = 0; ; attempt++) {
+        let elsewhere = false;
+        try {
+          const stream = attempt === 0 ? response : await this.resumeStream(state);
+          if (stream) {
+            await this.readStream(stream, state, category, onChunk, onComplete);
+          } else {
+            elsewhere = true;
+          }
+        } catch (error) {
+          if (!state.messageId || attempt >= this.resumeAttempts) throw error;
+          console.warn('Stream interrupted, resuming:', error);
+        }
+        if (elsewhere) { // Another worker is generating the reply: wait for it to be saved
+          await this.waitForStoredReply(state, category, onChunk, onComplete);
+          break;
+        }
+        if (state.complete) break;
+        if (!state.messageId || attempt >= this.resumeAttempts) {
+          throw new Error('Stream ended before the reply was complete');
+        }
+        await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+      }
+    } catch (error) {
+      console.error('Error in API stream:', error);
+      onError(error);
+      throw error;
+    }
+  }
+
+  get resumeAttempts() {
+    return 4;
+  }
+
+  // How long to poll for a reply generated by another worker, in milliseconds
+  get storedReplyTimeout() {
+    return 300000;
+  }
+
+  // Reconnects to a reply in progress; the server sends the events after Last-Event-ID.
+  // Returns null when this worker does not have the reply (workers without sticky routing).
+  async resumeStream(state) {
+    const response = await fetch(`${API_URL}/api/chat/${this.sessionId}/stream/${state.messageId}?framing=compact`, {
+      headers: { 'Last-Event-ID': String(state.lastEventId) }
+    });
+    if (response.status === 404) return null;
+    if (!response.ok) {
+      throw new Error(`Failed to resume stream: ${response.status} ${response.statusText}`);
+    }
+    return response;
+  }
+
+  // Polls the messages after the user message until the reply has been saved, then completes with it
+  async waitForStoredReply(state, category, onChunk, onComplete) {
+    const deadline = Date.now() + this.storedReplyTimeout;
+    while (Date.now() < deadline) {
+      const page = await this.getChatHistory(state.userMessageId ? { after: state.userMessageId } : {});
+      const stored = (page.messages || []).find(msg => msg.id === state.messageId);
+      if (stored) {
+        state.fullMessage = stored.content;
+        state.complete = true;
+        onChunk(state.fullMessage, state.messageId, false, '');
+        onComplete(state.fullMessage, state.messageId, category);
+        return;
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+    throw new Error('Timed out waiting for the reply');
+  }
 
-      const reader = response.body.getReader();
-      const decoder = new TextDecoder();
-      let fullMessage = '';
-      let messageId = null;
-      let codeBlockOpen = false;
-      let currentLanguage = '';
-
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-
-        const chunk = decoder.decode(value);
-        const lines = chunk.split('\n\n');
-
-        for (const line of lines) {
-          if (line.startsWith('data: ')) {
-            try {
-              const data = JSON.parse(line.slice(6));
-              
-              if (data.status === 'streaming' && !messageId) {
-                messageId = data.id;
-              } else if (data.chunk) {
-                fullMessage += data.chunk;
-                
-                // Detect code block openings and closings for better rendering
-                if (data.chunk.includes('```')) {
-                  const matches = data.chunk.match(/```([a-zA-Z]*)/g);
-                  if (matches) {
-                    for (const match of matches) {
-                      if (!codeBlockOpen) {
-                        codeBlockOpen = true;
-                        currentLanguage = match.replace('```', '') || 'plaintext';
-                      } else {
-                        codeBlockOpen = false;
-                        currentLanguage = '';
-                      }
+  // Reads SSE events from one response into state until it ends
+  async readStream(response, state, category, onChunk, onComplete) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+
+      // Frames can be split across reads; keep the incomplete last one for the next read
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split('\n\n');
+      buffer = events.pop();
+
+      for (const event of events) {
+        let line = null;
+        for (const field of event.split('\n')) {
+          if (field.startsWith('id: ')) {
+            state.lastEventId = parseInt(field.slice(4), 10) || state.lastEventId;
+          } else if (field.startsWith('data: ')) {
+            line = field;
+          }
+        }
+        if (line) {
+          try {
+            const data = JSON.parse(line.slice(6));
+
+            if (data.status === 'streaming') {
+              state.messageId = state.messageId || data.id;
+              if (data.reset) { // The server is resending the whole reply
+                state.fullMessage = '';
+                state.codeBlockOpen = false;
+                state.currentLanguage = '';
+              }
+            } else if (data.c || data.chunk) {
+              const text = data.c || data.chunk;
+              state.fullMessage += text;
+
+              // Detect code block openings and closings for better rendering
+              if (text.includes('```')) {
+                const matches = text.match(/```([a-zA-Z]*)/g);
+                if (matches) {
+                  for (const match of matches) {
+                    if (!state.codeBlockOpen) {
+                      state.codeBlockOpen = true;
+                      state.currentLanguage = match.replace('```', '') || 'plaintext';
+                    } else {
+                      state.codeBlockOpen = false;
+                      state.currentLanguage = '';
                     }
                   }
                 }
-                
-                onChunk(fullMessage, messageId, codeBlockOpen, currentLanguage);
-              } else if (data.status === 'complete') {
-                onComplete(data.final_content || fullMessage, messageId, category);
               }
-            } catch (err) {
-              console.error('Error parsing streaming data:', err, line);
+
+              onChunk(state.fullMessage, state.messageId, state.codeBlockOpen, state.currentLanguage);
+            } else if (data.status === 'complete') {
+              if (data.sha256 && !data.final_content && !(await this.digestMatches(state.fullMessage, data.sha256))) {
+                console.warn('Streamed message does not match its digest, reloading it from history');
+                const history = await this.getChatHistory();
+                const stored = (history.messages || []).find(msg => msg.id === state.messageId);
+                if (stored) state.fullMessage = stored.content;
+              }
+              state.complete = true;
+              onComplete(data.final_content || state.fullMessage, state.messageId, category);
             }
+          } catch (err) {
+            console.error('Error parsing streaming data:', err, line);
           }
         }
       }
-    } catch (error) {
-      console.error('Error in API stream:', error);
-      onError(error);
-      throw error;
     }
   }
 
+  // Checks streamed text against the SHA-256 digest sent in the completion frame
+  async digestMatches(text, expected) {
+    if (!window.crypto || !window.crypto.subtle) return true; // Only available in secure contexts
+    const hash = await window.crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+    const hex = Array.from(new Uint8Array(hash)).map(b => b.toString(16).padStart(2, '0')).join('');
+    return hex === expected;
+  }
+
   async sendMessage(message, category = 'general') {
     try {
       if (!this.sessionId) {
@@ -156,10 +265,15 @@ class ApiService {
     }
   }
 
-  async getChatHistory() {
+  // Without options the whole session is returned; with { after, limit } only that page (plus has_more)
+  async getChatHistory({ after = null, limit = null } = {}) {
     if (!this.sessionId) return { messages: [] };
     try {
-      const response = await fetch(`${API_URL}/api/chat/${this.sessionId}`);
+      const params = new URLSearchParams();
+      if (after) params.set('after', after);
+      if (limit) params.set('limit', limit);
+      const query = params.toString() ? `?${params}` : '';
+      const response = await fetch(`${API_URL}/api/chat/${this.sessionId}${query}`);
       if (!response.ok) {
         if (response.status === 404) {
           localStorage.removeItem('currentSessionId');
@@ -186,6 +300,21 @@ class ApiService {
     }
   }
 
+  // One page of the chat list, newest first; pass the previous page's next_cursor to continue
+  async getChatsPage({ cursor = null, limit = 50, category = null } = {}) {
+    try {
+      const params = new URLSearchParams({ limit });
+      if (cursor) params.set('cursor', cursor);
+      if (category) params.set('category', category);
+      const response = await fetch(`${API_URL}/api/chats?${params}`);
+      if (!response.ok) throw new Error('Failed to fetch chats');
+      return await response.json();
+    } catch (error) {
+      console.error('Error fetching chats:', error);
+      return { chats: [], next_cursor: null };
+    }
+  }
+
   async deleteChat(chatId) {
     try {
       const response = await fetch(`${API_URL}/api/chat/${chatId}`, {
@@ -26,6 +26,10 @@ class ChatManager {
         });
   
         this.isProcessing = false;
+
+        // Page sizes for incremental loading of chat history and the conversation list
+        this.historyPageSize = 50;
+        this.conversationsPageSize = 50;
         
         // Add streaming control properties
         this.streamingBuffer = "";
@@ -139,13 +143,20 @@ setupScrollDetection() {
   
     async loadChatHistory() {
         try {
-            const chatHistory = await apiService.getChatHistory();
-            if (chatHistory.messages && chatHistory.messages.length > 0) {
-                this.welcomeMessage.style.display = 'none';
-                if (chatHistory.category) {
-                    this.currentCategory = chatHistory.category;
-                    this.categorySelect.value = this.currentCategory;
-                    this.updateUIForCategory(this.currentCategory);
+            // Load the history a page at a time so long chats start rendering before they are fully fetched
+            const sessionId = apiService.sessionId;
+            let after = null;
+            let hasMore = true;
+            while (hasMore && apiService.sessionId === sessionId) {
+                const chatHistory = await apiService.getChatHistory({ after, limit: this.historyPageSize });
+                if (!chatHistory.messages || chatHistory.messages.length === 0) break;
+                if (after === null) {
+                    this.welcomeMessage.style.display = 'none';
+                    if (chatHistory.category) {
+                        this.currentCategory = chatHistory.category;
+                        this.categorySelect.value = this.currentCategory;
+                        this.updateUIForCategory(this.currentCategory);
+                    }
                 }
                 chatHistory.messages.forEach(message => {
                     if (message.role === 'user') {
@@ -154,8 +165,12 @@ setupScrollDetection() {
                         this.addBotMessage(message.content, message.category || this.currentCategory);
                     }
                 });
-  
-                // Apply consistent styling after chat history is loaded
+                after = chatHistory.messages[chatHistory.messages.length - 1].id;
+                hasMore = chatHistory.has_more;
+            }
+
+            // Apply consistent styling after chat history is loaded
+            if (after !== null) {
                 this.applyConsistentStyling();
                 this.fixMessageLayout();
             }
@@ -166,43 +181,60 @@ setupScrollDetection() {
   
     async loadConversations() {
         try {
-            const conversations = await apiService.getAllChats();
             this.conversationsList.innerHTML = '';
-            conversations.forEach(chat => {
-                const li = document.createElement('li');
-                li.className = 'conversation-item';
-                if (chat.id === apiService.sessionId) {
-                    li.classList.add('active');
-                }
-                if (chat.category) {
-                    li.classList.add(`category-${chat.category}`);
-                }
-                const categoryIcon = this.getCategoryIcon(chat.category || 'general');
-                
-                li.innerHTML = `
-                      <div class="conversation-title">
-                      ${categoryIcon} ${chat.title}
-                      </div>
-                      <button class="delete-chat-btn" data-id="${chat.id}">
-                      <i class="fas fa-trash"></i>
-                      </button>
-                      `;
-                li.addEventListener('click', (e) => {
-                    if (!e.target.closest('.delete-chat-btn')) {
-                        this.switchConversation(chat.id);
-                    }
-                });
-                const deleteBtn = li.querySelector('.delete-chat-btn');
-                deleteBtn.addEventListener('click', async (e) => {
-                    e.stopPropagation();
-                    await this.deleteConversation(chat.id);
-                });
-                this.conversationsList.appendChild(li);
-            });
+            await this.loadMoreConversations(null);
         } catch (error) {
             console.error('Failed to load conversations:', error);
         }
     }
+
+    // Appends one page of conversations, followed by a "load more" entry while older ones remain
+    async loadMoreConversations(cursor) {
+        const page = await apiService.getChatsPage({ cursor, limit: this.conversationsPageSize });
+        page.chats.forEach(chat => this.conversationsList.appendChild(this.createConversationItem(chat)));
+        if (page.next_cursor) {
+            const more = document.createElement('li');
+            more.className = 'conversation-item load-more-conversations';
+            more.textContent = 'Load older chats';
+            more.addEventListener('click', async () => {
+                more.remove();
+                await this.loadMoreConversations(page.next_cursor);
+            });
+            this.conversationsList.appendChild(more);
+        }
+    }
+
+    createConversationItem(chat) {
+        const li = document.createElement('li');
+        li.className = 'conversation-item';
+        if (chat.id === apiService.sessionId) {
+            li.classList.add('active');
+        }
+        if (chat.category) {
+            li.classList.add(`category-${chat.category}`);
+        }
+        const categoryIcon = this.getCategoryIcon(chat.category || 'general');
+        
+        li.innerHTML = `
+              <div class="conversation-title">
+              ${categoryIcon} ${chat.title}
+              </div>
+              <button class="delete-chat-btn" data-id="${chat.id}">
+              <i class="fas fa-trash"></i>
+              </button>
+              `;
+        li.addEventListener('click', (e) => {
+            if (!e.target.closest('.delete-chat-btn')) {
+                this.switchConversation(chat.id);
+            }
+        });
+        const deleteBtn = li.querySelector('.delete-chat-btn');
+        deleteBtn.addEventListener('click', async (e) => {
+            e.stopPropagation();
+            await this.deleteConversation(chat.id);
+        });
+        return li;
+    }
   
     setupEventListeners() {
         this.sendBtn.addEventListener('click', () => this.sendMessage());
@@ -0,0 +1,140 @@
+"""Serving of the built static assets (see build_static.py).
+
+The build writes minified, fingerprinted copies of static/ and their precompressed variants to
+STATIC_DIST_DIR, with a manifest.json describing them. StaticAssets loads all of it into memory
+at startup. respond() then picks the variant for each request:
+
+    Content-Encoding  br, then gzip, when the client accepts it and the build produced it
+    images            the WebP version when the client's Accept lists image/webp
+    caching           fingerprinted names are immutable for a year; the original names (the HTML
+                      pages, or old links to js/chat.js) are "no-cache" and revalidated with their ETag
+
+Paths the build does not know about return None, and the caller serves them from static/ as before.
+Without a build (no manifest), or when a source file changed after the build, load_static_assets()
+returns None and everything comes from static/.
+"""
+import json
+import logging
+import os
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIST_DIR = os.path.join(ROOT, os.getenv("STATIC_DIST_DIR", "static_dist"))  # Relative paths are under the app directory
+MANIFEST_NAME = "manifest.json"
+
+IMMUTABLE = "public, max-age=31536000, immutable"  # Fingerprinted names: a new build gets new names
+REVALIDATE = "no-cache"                            # Original names: cached, but checked with If-None-Match every time
+
+def accepted(header_value):
+    """Lower-cased tokens of an Accept or Accept-Encoding header value, excluding those with q=0."""
+    tokens = set()
+    for part in (header_value or "").split(","):
+        token, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if token.strip():
+            tokens.add(token.strip().lower())
+    return tokens
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value matches etag (weak comparison, as for GET)."""
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+class Asset:
+    """One built file and its variants (identity, br, gzip, webp), held in memory."""
+
+    __slots__ = ("content_type", "hash", "variants", "vary")
+
+    def __init__(self, content_type, digest, variants):
+        self.content_type = content_type
+        self.hash = digest
+        self.variants = variants  # Variant name -> bytes
+        self.vary = "Accept" if "webp" in variants else "Accept-Encoding" if len(variants) > 1 else None
+
+    def select(self, accept_encoding, accept):
+        """The variant name to send for these request headers."""
+        if len(self.variants) == 1:
+            return "identity"
+        if "webp" in self.variants:
+            return "webp" if "image/webp" in accepted(accept) else "identity"
+        encodings = accepted(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and encoding in encodings:
+                return encoding
+        return "identity"
+
+class StaticAssets:
+    """The built assets by URL path (both the original and the fingerprinted name)."""
+
+    def __init__(self, dist_dir, manifest):
+        self.dist_dir = dist_dir
+        self.sources = manifest.get("sources", [])
+        self.routes = {}  # path -> (Asset, immutable)
+        for logical, entry in manifest["assets"].items():
+            variants = {}
+            for name, relative in entry["files"].items():
+                with open(os.path.join(dist_dir, relative), "rb") as f:
+                    variants[name] = f.read()
+            asset = Asset(entry["type"], entry["hash"], variants)
+            self.routes[logical] = (asset, False)
+            if entry["path"] != logical:
+                self.routes[entry["path"]] = (asset, True)
+
+    def __len__(self):
+        return len(self.routes)
+
+    def stale(self):
+        """Whether a source file changed (or disappeared) since the build."""
+        built_at = os.path.getmtime(os.path.join(self.dist_dir, MANIFEST_NAME))
+        for source in self.sources:
+            path = os.path.join(ROOT, source)
+            if not os.path.exists(path) or os.path.getmtime(path) > built_at:
+                return True
+        return False
+
+    def respond(self, path, accept_encoding=None, accept=None, if_none_match=None):
+        """(status, headers, body) for a request to path, or None when path is not a built asset."""
+        entry = self.routes.get(path)
+        if entry is None:
+            return None
+        asset, immutable = entry
+        variant = asset.select(accept_encoding, accept)
+        etag = f'"{asset.hash}"' if variant == "identity" else f'"{asset.hash}-{variant}"'  # One strong ETag per representation
+        headers = {"ETag": etag, "Cache-Control": IMMUTABLE if immutable else REVALIDATE}
+        if asset.vary:
+            headers["Vary"] = asset.vary
+        if etag_matches(if_none_match, etag):
+            return 304, headers, b""
+        headers["Content-Type"] = "image/webp" if variant == "webp" else asset.content_type
+        if variant in ("br", "gzip"):
+            headers["Content-Encoding"] = variant
+        return 200, headers, asset.variants[variant]
+
+def manifest_path(dist_dir=STATIC_DIST_DIR):
+    return os.path.join(dist_dir, MANIFEST_NAME)
+
+def load_static_assets(dist_dir=STATIC_DIST_DIR):
+    """Loads the build in dist_dir, or returns None when there is none (or it cannot be read)."""
+    try:
+        with open(manifest_path(dist_dir), encoding="utf-8") as f:
+            manifest = json.load(f)
+        assets = StaticAssets(dist_dir, manifest)
+    except FileNotFoundError:
+        logging.info(f"No static build in {dist_dir}; serving static/ as is (run python build_static.py)")
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logging.error(f"Could not load the static build in {dist_dir}, serving static/ as is: {str(e)}")
+        return None
+    if assets.stale():  # Old pages and scripts would hide edits to static/ (serve.py rebuilds before starting)
+        logging.warning(f"The static build in {dist_dir} is older than its sources; serving static/ as is "
+                        f"(run python build_static.py)")
+        return None
+    logging.info(f"Serving {len(assets)} built static paths from {dist_dir}")
+    return assets
@@ -0,0 +1,12 @@
+"""Tests import the app's top-level modules, with the fake model provider and in-memory stores."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("MODEL_PROVIDER", "fake")
+os.environ.setdefault("FAKE_LATENCY_MS", "0")
+os.environ.setdefault("FAKE_TOKENS_PER_SECOND", "0")
+os.environ.setdefault("GENAI_WARMUP", "lazy")
+os.environ.setdefault("SESSION_STORE", "memory")
+os.environ.setdefault("RESPONSE_CACHE", "memory")
@@ -0,0 +1,28 @@
+from history import HistoryCache
+
+def messages(count, size=100):
+    return [{"role": ("user", "assistant")[index % 2], "content": "x" * size} for index in range(count)]
+
+def test_cold_read_stops_at_the_char_budget():
+    session = messages(10000)
+    reads = []
+
+    def read(start, stop):
+        reads.append((start, stop))
+        return session[start:stop]
+
+    turns = HistoryCache(char_budget=1000).turns("s", len(session), read)
+    assert 0 < len(turns) <= 10 and turns[0]["role"] == "user"
+    assert sum(stop - start for start, stop in reads) < 100
+
+def test_warm_read_only_fetches_new_messages():
+    session = messages(6)
+    cache = HistoryCache()
+    cache.turns("s", 4, lambda start, stop: session[start:stop])
+    reads = []
+
+    def read(start, stop):
+        reads.append((start, stop))
+        return session[start:stop]
+
+    assert len(cache.turns("s", 6, read)) == 6 and reads == [(4, 6)]
@@ -0,0 +1,45 @@
+import time
+
+from resumable import EventsLost, GenerationRegistry
+
+def frames(count):
+    return "".join(f"data: {index}\n\n" for index in range(count))
+
+def test_finished_generation_expires_after_ttl():
+    registry = GenerationRegistry(ttl=0.05)
+    registry.finish(registry.start("old", "session"))
+    time.sleep(0.06)
+    registry.start("new", "session")
+    assert registry.get("old") is None and registry.get("new") is not None
+
+def test_buffer_kept_for_the_starting_connection_then_dropped():
+    registry = GenerationRegistry()
+    generation = registry.start("m", "session", "compact")
+    generation.publish(frames(3))
+    registry.finish(generation)  # Before the starting connection read anything
+    assert "".join(generation.follow(0, attached=True)).count("data:") == 3
+    assert len(generation.events) == 0
+    try:
+        list(generation.follow(1))  # A late reconnect is sent the saved reply instead
+        assert False, "expected EventsLost"
+    except EventsLost:
+        pass
+
+def test_reconnect_resumes_after_last_event_id():
+    generation = GenerationRegistry().start("m", "session", "compact")
+    generation.publish(frames(5))
+    generation.finish()
+    replay = "".join(generation.follow(3))
+    assert replay == "id: 4\ndata: 3\n\nid: 5\ndata: 4\n\n"
+
+def test_events_lost_once_the_ring_buffer_overflows():
+    generation = GenerationRegistry(max_events=4).start("m", "session", "compact")
+    generation.publish(frames(10))
+    followed = generation.follow(2)  # Events 3..6 were dropped to keep the last 4
+    try:
+        next(followed)
+        assert False, "expected EventsLost"
+    except EventsLost:
+        pass
+    generation.finish()
+    assert "".join(generation.follow(6)).count("data:") == 4  # Still buffered for the starting connection
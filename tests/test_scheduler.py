@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+
+from scheduler import AsyncScheduler, FairQueue, Scheduler, TokenBucket
+
+def test_threads_and_coroutines_share_one_bucket():
+    scheduler = Scheduler(rate=10, burst=1)
+    scheduler.acquire("batch:job").release()  # A batch worker thread takes the only token
+
+    async def chat_turn():
+        started = time.monotonic()
+        (await AsyncScheduler(scheduler).acquire("session")).release()
+        return time.monotonic() - started
+
+    assert asyncio.run(chat_turn()) >= 0.08  # Waits for the next token (1/rate s)
+
+def test_thread_release_wakes_a_coroutine():
+    scheduler = Scheduler(max_concurrent=1)
+    slot = scheduler.acquire("batch:job")
+    threading.Timer(0.05, slot.release).start()
+
+    async def chat_turn():
+        (await AsyncScheduler(scheduler).acquire("session")).release()
+
+    asyncio.run(asyncio.wait_for(chat_turn(), 2))
+    assert scheduler.active == 0 and len(scheduler.queue) == 0
+
+def test_asgi_chat_turns_and_batch_items_share_the_app_scheduler():
+    import app
+    import asgi
+
+    assert asgi.upstream.scheduler is app.upstream
+
+def test_token_bucket_paces_starts_in_reservation_order():
+    bucket = TokenBucket(rate=20, burst=2)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]  # The burst
+    assert 0.04 <= waits[2] <= 0.05 and 0.09 <= waits[3] <= 0.1  # Then one start every 1/rate s, in order
+
+def test_fair_queue_round_robin_across_sessions():
+    queue = FairQueue()
+    for session_id, waiter in (("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("c", "c1"), ("c", "c2")):
+        queue.push(session_id, waiter)
+    assert queue.remove("c", "c2") and not queue.remove("c", "c2")
+    assert [queue.pop() for _ in range(len(queue))] == ["a1", "b1", "c1", "a2", "a3"]
+    assert queue.pop() is None
+
+def test_busy_session_cannot_starve_the_others():
+    scheduler = Scheduler(max_concurrent=1)
+    slot = scheduler.acquire("first")
+    served = []
+
+    def call(session_id):
+        scheduler.call(session_id, lambda: served.append(session_id))
+
+    threads = []
+    for session_id in ("busy", "busy", "busy", "other"):
+        thread = threading.Thread(target=call, args=(session_id,))
+        thread.start()
+        threads.append(thread)
+        while len(scheduler.queue) < len(threads):  # Queue them in this order
+            time.sleep(0.001)
+    slot.release()
+    for thread in threads:
+        thread.join(2)
+    assert served == ["busy", "other", "busy", "busy"]
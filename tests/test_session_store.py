@@ -0,0 +1,38 @@
+import sqlite3
+
+import app
+import session_store
+from session_store import SQLiteSessionStore, StoreBusy
+
+def test_locked_sqlite_store_answers_503(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_store, "SQLITE_BUSY_TIMEOUT", 0.05)
+    path = str(tmp_path / "sessions.db")
+    monkeypatch.setattr(app, "session_store", SQLiteSessionStore(path))
+    other_worker = sqlite3.connect(path, isolation_level=None)
+    other_worker.execute("BEGIN IMMEDIATE")  # Holds the write lock
+    try:
+        response = app.app.test_client().post('/api/chat/new', json={})
+    finally:
+        other_worker.execute("ROLLBACK")
+        other_worker.close()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(app.STORE_BUSY_RETRY_AFTER)
+    assert app.app.test_client().post('/api/chat/new', json={}).status_code == 200  # The lock is free again
+
+def test_store_busy_raised_by_writes_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_store, "SQLITE_BUSY_TIMEOUT", 0.05)
+    path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(path)
+    store.create({"id": "s", "title": "t", "created_at": "", "messages": []})
+    other_worker = sqlite3.connect(path, isolation_level=None)
+    other_worker.execute("BEGIN IMMEDIATE")
+    try:
+        assert store.get("s")["id"] == "s"  # WAL readers never wait for the writer
+        try:
+            store.create({"id": "s2", "title": "t", "created_at": "", "messages": []})
+            assert False, "expected StoreBusy"
+        except StoreBusy:
+            pass
+    finally:
+        other_worker.execute("ROLLBACK")
+        other_worker.close()
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+
+from singleflight import AsyncSingleFlight, FlightAbandoned, SingleFlight
+
+class Roles:
+    """Stands in for the metrics counter: counts joins by role."""
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def inc(self, amount, role):
+        self.counts[role] += amount
+
+def follow_in_thread(flights, key, results):
+    def start():
+        raise AssertionError("a follower must not call the model")
+
+    def run():
+        try:
+            results.append(list(flights.stream(key, start)))
+        except Exception as e:
+            results.append(e)
+
+    joined = flights.counter.counts["follower"]
+    thread = threading.Thread(target=run)
+    thread.start()
+    while flights.counter.counts["follower"] == joined:  # Joined before the leader can finish
+        time.sleep(0.001)
+    return thread
+
+def test_followers_share_the_leader_generation():
+    flights = SingleFlight(Roles())
+    calls = []
+
+    def start():
+        calls.append(1)
+        yield from ("a", "b", "c")
+
+    leader = flights.stream("key", start)
+    assert next(leader) == "a"  # Joins the flight as leader
+    results = []
+    threads = [follow_in_thread(flights, "key", results) for _ in range(3)]
+    assert list(leader) == ["b", "c"]
+    for thread in threads:
+        thread.join(2)
+    assert results == [["a", "b", "c"]] * 3 and calls == [1]
+    assert flights.counter.counts == {"leader": 1, "follower": 3} and "key" not in flights
+
+def test_leader_error_reaches_every_follower():
+    flights = SingleFlight(Roles())
+    error = ValueError("upstream failed")
+
+    def start():
+        yield "a"
+        raise error
+
+    leader = flights.stream("key", start)
+    next(leader)
+    results = []
+    threads = [follow_in_thread(flights, "key", results) for _ in range(2)]
+    try:
+        list(leader)
+        assert False, "expected the upstream error"
+    except ValueError:
+        pass
+    for thread in threads:
+        thread.join(2)
+    assert results == [error, error]
+
+def test_followers_fail_when_the_leader_disconnects():
+    flights = SingleFlight(Roles())
+    leader = flights.stream("key", lambda: iter(("a", "b")))
+    next(leader)
+    results = []
+    thread = follow_in_thread(flights, "key", results)
+    leader.close()
+    thread.join(2)
+    assert isinstance(results[0], FlightAbandoned)
+
+def test_async_followers_share_the_leader_generation():
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def start():
+        calls.append(1)
+        for chunk in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def read():
+        return [chunk async for chunk in flights.stream("key", start)]
+
+    async def main():
+        return await asyncio.gather(read(), read(), read())
+
+    assert asyncio.run(main()) == [["a", "b", "c"]] * 3 and calls == [1]
@@ -0,0 +1,7 @@
+from sse import negotiate_encoding
+
+def test_negotiate_encoding_skips_refused_encodings():
+    assert negotiate_encoding("gzip;q=0, deflate") == "deflate"
+    assert negotiate_encoding("gzip; q=0") is None
+    assert negotiate_encoding("br, GZIP;q=0.5") == "gzip"
+    assert negotiate_encoding(None) is None